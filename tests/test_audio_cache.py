@@ -0,0 +1,75 @@
+import os
+import threading
+
+import pytest
+
+pytest.importorskip("loguru")
+
+from xtts_api_server.audio_cache import AudioCache
+
+
+def test_put_then_get(tmp_path):
+    cache = AudioCache(str(tmp_path), max_bytes=1000)
+    key = AudioCache.make_key(text="hello", format="mp3")
+
+    assert cache.get(key) is None
+    cache.put(key, b"audio")
+
+    assert cache.get(key) == b"audio"
+    assert os.listdir(tmp_path) == [key + AudioCache.SUFFIX]
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_keys_differ_by_format():
+    assert AudioCache.make_key(text="hello", format="wav") != AudioCache.make_key(text="hello", format="mp3")
+
+
+def test_least_recently_used_is_evicted(tmp_path):
+    cache = AudioCache(str(tmp_path), max_bytes=10)
+    cache.put("a", b"1234")
+    cache.put("b", b"1234")
+    cache.get("a")
+    cache.put("c", b"1234")
+
+    assert cache.get("b") is None
+    assert cache.get("a") == b"1234"
+    assert cache.get("c") == b"1234"
+    assert cache.stats()["evictions"] == 1
+    assert cache.stats()["bytes"] == 8
+
+
+def test_entries_survive_a_restart(tmp_path):
+    AudioCache(str(tmp_path), max_bytes=100).put("a", b"1234")
+    # A writer killed halfway leaves its temp file behind
+    (tmp_path / "b.audio.1.2.tmp").write_bytes(b"12")
+
+    cache = AudioCache(str(tmp_path), max_bytes=100)
+
+    assert cache.get("a") == b"1234"
+    assert cache.stats()["entries"] == 1
+    assert sorted(os.listdir(tmp_path)) == ["a.audio"]
+
+
+def test_removed_file_is_a_miss(tmp_path):
+    cache = AudioCache(str(tmp_path), max_bytes=100)
+    cache.put("a", b"1234")
+    os.remove(tmp_path / "a.audio")
+
+    assert cache.get("a") is None
+    assert cache.stats()["entries"] == 0
+    assert cache.stats()["bytes"] == 0
+
+
+def test_concurrent_puts_of_one_key(tmp_path):
+    cache = AudioCache(str(tmp_path), max_bytes=10**6)
+    payloads = [bytes([i]) * 10000 for i in range(8)]
+    threads = [threading.Thread(target=cache.put, args=("a", payload)) for payload in payloads]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert cache.get("a") in payloads
+    assert os.listdir(tmp_path) == ["a.audio"]
+    assert cache.stats()["bytes"] == 10000
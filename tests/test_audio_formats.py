@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("torchaudio")
+
+from xtts_api_server import audio_formats
+from xtts_api_server.audio_formats import StreamEncoder, encode, negotiate_format, stream_format, to_pcm16, wav_header
+
+
+@pytest.fixture
+def ffmpeg(monkeypatch):
+    monkeypatch.setattr(audio_formats.shutil, "which", lambda name: "/usr/bin/ffmpeg")
+
+
+@pytest.fixture
+def no_ffmpeg(monkeypatch):
+    monkeypatch.setattr(audio_formats.shutil, "which", lambda name: None)
+
+
+def test_explicit_format(ffmpeg):
+    assert negotiate_format("MP3") == "mp3"
+    assert negotiate_format("ogg") == "opus"
+    assert negotiate_format("wav", accept="audio/mpeg") == "wav"
+
+
+def test_unknown_format():
+    with pytest.raises(ValueError):
+        negotiate_format("aac")
+
+
+def test_explicit_format_needs_ffmpeg(no_ffmpeg):
+    with pytest.raises(ValueError):
+        negotiate_format("flac")
+    assert negotiate_format("pcm_s16le") == "pcm_s16le"
+
+
+def test_accept_header_by_quality(ffmpeg):
+    assert negotiate_format(accept="audio/wav;q=0.5, audio/mpeg") == "mp3"
+    assert negotiate_format(accept="audio/ogg, audio/flac") == "opus"
+    assert negotiate_format(accept="text/html, audio/mpeg;q=0") == "wav"
+
+
+def test_accept_header_skips_formats_without_ffmpeg(no_ffmpeg):
+    assert negotiate_format(accept="audio/mpeg, audio/L16;q=0.9") == "pcm_s16le"
+
+
+def test_default():
+    assert negotiate_format() == "wav"
+    assert negotiate_format(accept="*/*", default="mp3") == "mp3"
+
+
+def test_pcm16_clips_and_is_little_endian():
+    pcm = to_pcm16(np.array([0.0, 0.5, -2.0, 2.0], dtype=np.float32))
+    assert np.frombuffer(pcm, dtype="<i2").tolist() == [0, 16383, -32767, 32767]
+
+
+def test_raw_pcm_encoding():
+    wav = np.linspace(-1, 1, 100, dtype=np.float32)
+    assert encode(wav, "pcm_s16le") == to_pcm16(wav)
+    assert encode(wav, "wav_s16")[44:] == to_pcm16(wav)
+
+
+def test_stream_format():
+    assert stream_format("wav") == "wav_s16"
+    assert stream_format("mp3") == "mp3"
+    with pytest.raises(ValueError):
+        StreamEncoder("wav")
+    encoder = StreamEncoder("wav_s16")
+    assert encoder.feed(b"\0\0") == wav_header(24000) + b"\0\0"
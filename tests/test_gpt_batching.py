@@ -0,0 +1,110 @@
+import time
+
+import pytest
+
+torch = pytest.importorskip("torch")
+gpt_module = pytest.importorskip("TTS.tts.layers.xtts.gpt")
+
+from xtts_api_server.gpt_batching import GPTBatcher
+
+SETTINGS = {
+    "temperature": 0.75,
+    "length_penalty": 1.0,
+    "repetition_penalty": 5.0,
+    "top_k": 50,
+    "top_p": 0.85,
+    "do_sample": False,
+}
+
+
+@pytest.fixture(scope="module")
+def gpt():
+    # A small randomly initialized XTTS GPT, greedy decoding is deterministic for any weights
+    torch.manual_seed(0)
+    model = gpt_module.GPT(
+        layers=2,
+        model_dim=64,
+        heads=4,
+        max_text_tokens=64,
+        max_mel_tokens=40,
+        max_prompt_tokens=16,
+        number_text_tokens=300,
+        num_audio_tokens=66,
+        start_audio_token=64,
+        stop_audio_token=65,
+    )
+    with torch.no_grad():
+        # Make the prompt's filler token 1 a likely pick, so the repetition penalty on it matters
+        model.mel_head.bias[1] += 2.0
+    model.init_gpt_for_inference(kv_cache=True, use_deepspeed=False)
+    return model.eval()
+
+
+def reference(gpt, gpt_cond_latent, text_tokens):
+    with torch.inference_mode():
+        return gpt.generate(
+            gpt_cond_latent,
+            text_tokens,
+            do_sample=False,
+            num_beams=1,
+            repetition_penalty=SETTINGS["repetition_penalty"],
+        )
+
+
+def test_batched_greedy_decode_matches_generate(gpt):
+    torch.manual_seed(1)
+    # Different speakers and text lengths, so prompts are padded against each other
+    prompts = [
+        (torch.randn(1, cond_length, 64), torch.randint(1, 250, (1, text_length)))
+        for cond_length, text_length in ((6, 5), (9, 12), (6, 20))
+    ]
+    batcher = GPTBatcher(gpt, SETTINGS, max_batch_size=4)
+
+    futures = [batcher.submit(gpt_cond_latent, text_tokens) for gpt_cond_latent, text_tokens in prompts]
+    for (gpt_cond_latent, text_tokens), future in zip(prompts, futures):
+        codes = future.result(timeout=60)
+        assert codes.tolist() == reference(gpt, gpt_cond_latent, text_tokens).tolist()
+
+
+def test_sentence_joining_a_running_batch_matches_generate(gpt):
+    torch.manual_seed(2)
+    first = (torch.randn(1, 6, 64), torch.randint(1, 250, (1, 15)))
+    second = (torch.randn(1, 7, 64), torch.randint(1, 250, (1, 8)))
+    batcher = GPTBatcher(gpt, SETTINGS, max_batch_size=4)
+
+    running = batcher.submit(*first)
+    # Join between steps of the first sentence, with a KV cache of a different length
+    deadline = time.monotonic() + 30
+    while batcher.steps < 3 and not running.done() and time.monotonic() < deadline:
+        time.sleep(0.001)
+    assert not running.done()
+    joining = batcher.submit(*second)
+
+    assert running.result(timeout=60).tolist() == reference(gpt, *first).tolist()
+    assert joining.result(timeout=60).tolist() == reference(gpt, *second).tolist()
+
+
+@pytest.mark.parametrize("dtype", [torch.float32, torch.float16])
+def test_cached_speaker_prefix_matches_generate(gpt, dtype):
+    batcher = GPTBatcher(gpt, SETTINGS, max_batch_size=4)
+    for seed in range(5):
+        torch.manual_seed(seed)
+        gpt_cond_latent = torch.randn(1, 8, 64)
+        text_tokens = torch.randint(1, 250, (1, 10))
+        # The wrapper's prefix cache keeps them in half precision
+        prefix_kv = tuple(tuple(t.to(dtype) for t in layer) for layer in batcher.speaker_prefix(gpt_cond_latent))
+
+        codes = batcher.submit(gpt_cond_latent, text_tokens, prefix_kv).result(timeout=60)
+        assert codes.tolist() == reference(gpt, gpt_cond_latent, text_tokens).tolist()
+
+
+def test_sentences_of_one_speaker_share_a_cached_prefix(gpt):
+    torch.manual_seed(3)
+    gpt_cond_latent = torch.randn(1, 8, 64)
+    sentences = [torch.randint(1, 250, (1, length)) for length in (4, 9, 14)]
+    batcher = GPTBatcher(gpt, SETTINGS, max_batch_size=4)
+    prefix_kv = batcher.speaker_prefix(gpt_cond_latent)
+
+    futures = [batcher.submit(gpt_cond_latent, text_tokens, prefix_kv) for text_tokens in sentences]
+    for text_tokens, future in zip(sentences, futures):
+        assert future.result(timeout=60).tolist() == reference(gpt, gpt_cond_latent, text_tokens).tolist()
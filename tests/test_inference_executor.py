@@ -0,0 +1,225 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("loguru")
+
+from xtts_api_server.inference_executor import DeadlineExceededError, InferenceExecutor, QueueFullError
+
+
+def block(executor):
+    """ Occupies the executor's only slot until the returned event is set. """
+    release = threading.Event()
+    running = threading.Event()
+
+    def job():
+        running.set()
+        release.wait(5)
+
+    future = executor.submit(job)
+    running.wait(5)
+    return release, future
+
+
+def test_run_returns_result():
+    executor = InferenceExecutor(slots=1)
+    assert asyncio.run(executor.run(lambda a, b: a + b, 2, 3)) == 5
+    assert executor.stats()["completed"] == 1
+
+
+def test_run_raises_the_job_error():
+    executor = InferenceExecutor(slots=1)
+
+    def fail():
+        raise ValueError("bad speaker")
+
+    with pytest.raises(ValueError):
+        asyncio.run(executor.run(fail))
+    assert executor.stats()["failed"] == 1
+
+
+def test_jobs_run_off_the_event_loop():
+    executor = InferenceExecutor(slots=1)
+    ticks = []
+
+    async def main():
+        async def tick():
+            while True:
+                ticks.append(time.monotonic())
+                await asyncio.sleep(0.01)
+
+        ticker = asyncio.create_task(tick())
+        await executor.run(time.sleep, 0.2)
+        ticker.cancel()
+
+    asyncio.run(main())
+    # The loop kept running while the job blocked its thread
+    assert len(ticks) > 5
+
+
+def test_slots_run_jobs_in_parallel():
+    executor = InferenceExecutor(slots=2)
+    started = time.monotonic()
+
+    async def main():
+        await asyncio.gather(executor.run(time.sleep, 0.2), executor.run(time.sleep, 0.2))
+
+    asyncio.run(main())
+    assert time.monotonic() - started < 0.35
+
+
+def test_stream_yields_items_in_order():
+    executor = InferenceExecutor(slots=1)
+
+    async def main():
+        return [item async for item in executor.stream(iter(range(5)))]
+
+    assert asyncio.run(main()) == [0, 1, 2, 3, 4]
+
+
+def test_full_queue_rejects():
+    executor = InferenceExecutor(slots=1, max_queue=1)
+    release, _ = block(executor)
+    try:
+        queued = executor.submit(lambda: "ok")
+        with pytest.raises(QueueFullError) as e:
+            executor.submit(lambda: None)
+        assert e.value.retry_after >= 1
+    finally:
+        release.set()
+    assert queued.result(timeout=1) == "ok"
+    assert executor.rejected == 1
+
+
+def test_queued_job_fails_at_its_deadline():
+    executor = InferenceExecutor(slots=1)
+    release, _ = block(executor)
+
+    async def main():
+        started = time.monotonic()
+        with pytest.raises(DeadlineExceededError):
+            await executor.run(lambda: None, deadline=time.monotonic() + 0.05)
+        return time.monotonic() - started
+
+    try:
+        # Fails when the deadline passes, not when the slot frees up
+        assert asyncio.run(main()) < 1
+        assert executor.expired == 1
+        assert executor.pending == 0
+    finally:
+        release.set()
+
+
+def test_expired_jobs_do_not_fill_the_queue():
+    executor = InferenceExecutor(slots=1, max_queue=1)
+    release, _ = block(executor)
+    try:
+        expiring = executor.submit(lambda: None, deadline=time.monotonic() + 0.05)
+        with pytest.raises(QueueFullError):
+            executor.submit(lambda: None)
+        with pytest.raises(DeadlineExceededError):
+            expiring.result(timeout=1)
+
+        # The expired job no longer takes the queue's only place
+        admitted = executor.submit(lambda: "ok")
+    finally:
+        release.set()
+    assert admitted.result(timeout=1) == "ok"
+    assert executor.rejected == 1
+
+
+def test_cancelled_job_is_skipped():
+    executor = InferenceExecutor(slots=1)
+    release, _ = block(executor)
+    calls = []
+    try:
+        future = executor.submit(lambda: calls.append(1))
+        assert future.cancel()
+        assert executor.pending == 0
+    finally:
+        release.set()
+    executor.submit(lambda: None).result(timeout=1)
+    assert calls == []
+
+
+def test_worker_survives_a_cancel_racing_the_expiry(monkeypatch):
+    executor = InferenceExecutor(slots=1)
+    # Without the timer the worker is the one to find the job expired
+    monkeypatch.setattr(executor, "_arm_timer", lambda job: None)
+    release, _ = block(executor)
+    expired = executor._enqueue(lambda: None, (), {}, time.monotonic() - 1)
+    # The waiter gives up after the worker checked the job but before it fails the future
+    original = expired.future.set_exception
+
+    def cancel_first(exception):
+        expired.future.cancel()
+        original(exception)
+
+    expired.future.set_exception = cancel_first
+    monkeypatch.setattr(executor, "_cancelled", lambda job, future: None)
+    release.set()
+
+    # The slot is still there
+    assert executor.submit(lambda: "ok").result(timeout=1) == "ok"
+
+
+def test_start_stream_raises_before_the_first_item():
+    executor = InferenceExecutor(slots=1)
+    release, _ = block(executor)
+
+    async def main():
+        with pytest.raises(DeadlineExceededError):
+            await executor.start_stream(iter(range(3)), deadline=time.monotonic() + 0.05)
+
+    try:
+        asyncio.run(main())
+    finally:
+        release.set()
+
+
+def test_start_stream_yields_every_item():
+    executor = InferenceExecutor(slots=1)
+
+    async def main():
+        items = await executor.start_stream(iter(range(3)))
+        empty = await executor.start_stream(iter([]))
+        return [item async for item in items], [item async for item in empty]
+
+    assert asyncio.run(main()) == ([0, 1, 2], [])
+
+
+def test_same_key_runs_once():
+    executor = InferenceExecutor(slots=1)
+    calls = []
+
+    def job():
+        calls.append(1)
+        time.sleep(0.05)
+        return "audio"
+
+    async def main():
+        return await asyncio.gather(*(executor.run(job, key="same") for _ in range(3)))
+
+    assert asyncio.run(main()) == ["audio"] * 3
+    assert len(calls) == 1
+    assert executor.coalesced == 2
+
+
+def test_waiter_giving_up_keeps_the_shared_job():
+    executor = InferenceExecutor(slots=1)
+
+    def job():
+        time.sleep(0.1)
+        return "audio"
+
+    async def main():
+        impatient = asyncio.ensure_future(executor.run(job, key="same"))
+        patient = asyncio.ensure_future(executor.run(job, key="same"))
+        await asyncio.sleep(0.02)
+        impatient.cancel()
+        return await patient
+
+    assert asyncio.run(main()) == "audio"
+    assert executor.stats()["completed"] == 1
@@ -0,0 +1,100 @@
+import threading
+import time
+
+import pytest
+
+from xtts_api_server.latents_cache import LatentsCache, latents_nbytes
+
+
+class FakeTensor:
+    """ Just enough of a tensor for latents_nbytes. """
+
+    def __init__(self, nbytes):
+        self.nbytes = nbytes
+
+    def element_size(self):
+        return 1
+
+    def nelement(self):
+        return self.nbytes
+
+
+def test_nbytes_of_nested_kv():
+    kv = ((FakeTensor(3), FakeTensor(4)), (FakeTensor(5), FakeTensor(6)))
+    assert latents_nbytes(kv) == 18
+
+
+def test_least_recently_used_is_evicted():
+    cache = LatentsCache(max_bytes=20)
+    cache.get_or_create("a", lambda: FakeTensor(10))
+    cache.get_or_create("b", lambda: FakeTensor(10))
+    # Touch a so b is the oldest
+    cache.get_or_create("a", lambda: FakeTensor(10))
+    cache.get_or_create("c", lambda: FakeTensor(10))
+
+    assert "a" in cache and "c" in cache
+    assert "b" not in cache
+    assert cache.total_bytes == 20
+    assert cache.evictions == 1
+    assert cache.hits == 1 and cache.misses == 3
+
+
+def test_pinned_entries_stay_over_budget():
+    cache = LatentsCache(max_bytes=10)
+    cache.set_pinned(["a", "b"])
+    cache.get_or_create("a", lambda: FakeTensor(10))
+    cache.get_or_create("b", lambda: FakeTensor(10))
+    cache.get_or_create("c", lambda: FakeTensor(10))
+
+    assert "a" in cache and "b" in cache
+    assert not cache.has_room()
+
+    # Unpinning lets them go again
+    cache.set_pinned([])
+    assert cache.total_bytes <= 10
+
+
+def test_concurrent_misses_share_one_computation():
+    cache = LatentsCache(max_bytes=100)
+    calls = []
+    started = threading.Event()
+
+    def create():
+        calls.append(1)
+        started.set()
+        time.sleep(0.1)
+        return FakeTensor(1)
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_create("a", create))) for _ in range(4)]
+    threads[0].start()
+    started.wait()
+    for thread in threads[1:]:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert cache.computations == 1
+    assert all(result is results[0] for result in results)
+
+
+def test_failed_creation_is_not_cached():
+    cache = LatentsCache(max_bytes=100)
+
+    def fail():
+        raise OSError("unreadable")
+
+    with pytest.raises(OSError):
+        cache.get_or_create("a", fail)
+    assert "a" not in cache
+    assert cache.get_or_create("a", lambda: FakeTensor(1)).nbytes == 1
+
+
+def test_discard():
+    cache = LatentsCache(max_bytes=100)
+    cache.get_or_create("a", lambda: FakeTensor(7))
+    cache.discard("a")
+    cache.discard("missing")
+    assert "a" not in cache
+    assert cache.total_bytes == 0
@@ -0,0 +1,107 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("loguru")
+
+from xtts_api_server.latents_store import LatentsStore
+
+
+def latents(seed):
+    torch.manual_seed(seed)
+    return torch.randn(1, 32, 1024), torch.randn(1, 512, 1)
+
+
+def open_store(folder, model_version="2.0.2"):
+    store = LatentsStore(str(folder), model_version, save_delay=60)
+    store.open()
+    return store
+
+
+def assert_stored(store, speaker_hash, expected):
+    loaded = store.load(speaker_hash, "cpu")
+    assert loaded is not None
+    for tensor, reference in zip(loaded, expected):
+        assert tensor.dtype == torch.float32
+        torch.testing.assert_close(tensor, reference.to(torch.float16).float())
+
+
+def test_latents_survive_a_restart(tmp_path):
+    store = open_store(tmp_path)
+    store.put("speaker", *latents(0))
+    store.flush()
+
+    reopened = open_store(tmp_path)
+    assert "speaker" in reopened
+    assert_stored(reopened, "speaker", latents(0))
+
+
+def test_latents_are_keyed_by_model_version(tmp_path):
+    store = open_store(tmp_path)
+    store.put("speaker", *latents(0))
+    store.flush()
+
+    assert "speaker" not in open_store(tmp_path, model_version="2.0.3")
+
+
+def test_speakers_are_packed_into_one_file(tmp_path):
+    store = open_store(tmp_path)
+    for seed in range(3):
+        store.put(f"speaker{seed}", *latents(seed))
+    store.flush()
+
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["latents.bin", "latents.json"]
+    # fp16, nothing but the records
+    assert (tmp_path / "latents.bin").stat().st_size == 3 * (32 * 1024 + 512) * 2
+    for seed in range(3):
+        assert_stored(store, f"speaker{seed}", latents(seed))
+
+
+def test_unsaved_records_are_dropped_after_a_crash(tmp_path):
+    store = open_store(tmp_path)
+    store.put("saved", *latents(0))
+    store.flush()
+    store.put("unsaved", *latents(1))
+
+    reopened = open_store(tmp_path)
+    assert "saved" in reopened
+    assert "unsaved" not in reopened
+
+
+def test_discarded_speakers_are_forgotten(tmp_path):
+    store = open_store(tmp_path)
+    store.put("kept", *latents(0))
+    store.put("removed", *latents(1))
+    store.discard("removed")
+    store.discard("never stored")
+    store.flush()
+
+    assert "removed" not in store
+    assert "removed" not in open_store(tmp_path)
+    assert len(open_store(tmp_path)) == 1
+
+
+def test_compaction_reclaims_discarded_and_replaced_records(tmp_path):
+    record_size = (32 * 1024 + 512) * 2
+    store = open_store(tmp_path)
+    for seed in range(4):
+        store.put(f"speaker{seed}", *latents(seed))
+    store.flush()
+    # A view handed out before the compaction stays readable
+    view = store.get("speaker3")[0]
+    expected = view.copy()
+
+    # Half the records dead is not worth rewriting the file yet
+    store.discard("speaker0")
+    store.put("speaker1", *latents(10))
+    store.flush()
+    assert (tmp_path / "latents.bin").stat().st_size == 5 * record_size
+
+    store.discard("speaker2")
+    store.flush()
+    assert (tmp_path / "latents.bin").stat().st_size == 2 * record_size
+
+    for reopened in (store, open_store(tmp_path)):
+        assert len(reopened) == 2
+        assert_stored(reopened, "speaker1", latents(10))
+        assert_stored(reopened, "speaker3", latents(3))
+    assert (view == expected).all()
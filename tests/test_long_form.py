@@ -0,0 +1,35 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from xtts_api_server.long_form import Crossfader, pack_sentences
+
+
+def test_pack_sentences():
+    sentences = ["One two.", "Three.", "A sentence longer than the limit.", "", "End."]
+    assert pack_sentences(sentences, 15) == ["One two. Three.", "A sentence longer than the limit.", "End."]
+
+
+def test_crossfade_length_and_untouched_samples():
+    fader = Crossfader(overlap=4)
+    first = np.arange(10, dtype=np.float32)
+    second = np.full(10, 100, dtype=np.float32)
+
+    out = [fader.push(first)]
+    # Everything but the overlap is final right away
+    np.testing.assert_array_equal(out[0], first[:6])
+    out.append(fader.push(second))
+    out.append(fader.finish())
+
+    joined = np.concatenate(out)
+    assert len(joined) == len(first) + len(second) - 4
+    # The seam starts on the first segment and ends on the second
+    assert joined[6] == first[6]
+    np.testing.assert_array_equal(joined[10:], second[4:])
+
+
+def test_crossfade_segment_shorter_than_overlap():
+    fader = Crossfader(overlap=8)
+    total = sum(len(fader.push(np.ones(n, dtype=np.float32))) for n in (20, 3, 20)) + len(fader.finish())
+    # The short segment is blended into the held back tail entirely
+    assert total == 20 + 3 + 20 - 3
@@ -0,0 +1,76 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+torch = pytest.importorskip("torch")
+TTS = pytest.importorskip("TTS")
+tts_funcs = pytest.importorskip("xtts_api_server.tts_funcs")
+
+from TTS.tts.configs.xtts_config import XttsConfig
+from TTS.tts.layers.xtts.tokenizer import VoiceBpeTokenizer
+from TTS.tts.models.xtts import Xtts, XttsArgs
+
+# The XTTS vocabulary comes with the model; the tortoise one shipped with TTS has the same format
+VOCAB_FILE = os.path.join(os.path.dirname(TTS.__file__), "tts", "utils", "assets", "tortoise", "tokenizer.json")
+
+TEXT = "The first sentence is short. The second one is a little longer than that! And a third?"
+
+
+@pytest.fixture(scope="module")
+def model():
+    # XTTS with a small random GPT that stops within a few dozen codes
+    torch.manual_seed(0)
+    config = XttsConfig()
+    config.model_args = XttsArgs(
+        gpt_layers=2,
+        gpt_n_model_channels=64,
+        gpt_n_heads=4,
+        gpt_number_text_tokens=300,
+        gpt_num_audio_tokens=66,
+        gpt_start_audio_token=64,
+        gpt_stop_audio_token=65,
+        gpt_max_audio_tokens=40,
+        decoder_input_dim=64,
+    )
+    model = Xtts(config)
+    model.init_models()
+    model.tokenizer = VoiceBpeTokenizer(VOCAB_FILE)
+    # Xtts.eval() returns nothing
+    model.eval()
+    return model
+
+
+def make_wrapper(model):
+    wrapper = tts_funcs.TTSWrapper.__new__(tts_funcs.TTSWrapper)
+    wrapper.model = model
+    wrapper.device = "cpu"
+    wrapper.tts_settings = {
+        "temperature": 0.75,
+        "length_penalty": 1.0,
+        "repetition_penalty": 5.0,
+        "top_k": 50,
+        "top_p": 0.85,
+        "enable_text_splitting": True,
+    }
+    wrapper._vocoder_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="vocoder")
+    wrapper._vocoder_stream = None
+    wrapper._stage_times = threading.local()
+    return wrapper
+
+
+@pytest.mark.parametrize("text", [TEXT, "Just one sentence."])
+def test_pipelined_inference_matches_xtts(model, text):
+    wrapper = make_wrapper(model)
+    gpt_cond_latent = torch.randn(1, 32, 64)
+    speaker_embedding = torch.randn(1, 512, 1)
+
+    # Sampling draws from the global generator in sentence order either way
+    torch.manual_seed(1)
+    wav = wrapper.pipelined_inference(text, "en", gpt_cond_latent, speaker_embedding)
+    torch.manual_seed(1)
+    expected = model.inference(text, "en", gpt_cond_latent, speaker_embedding, **wrapper.tts_settings)["wav"]
+
+    assert wav.shape == expected.shape
+    torch.testing.assert_close(torch.from_numpy(wav), torch.from_numpy(expected), rtol=1e-4, atol=1e-5)
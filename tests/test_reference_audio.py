@@ -0,0 +1,233 @@
+import io
+import os
+import wave
+
+import numpy as np
+import pytest
+
+torch = pytest.importorskip("torch")
+torchaudio = pytest.importorskip("torchaudio")
+
+from xtts_api_server.reference_audio import ReferenceAudioCache, file_sha256
+
+
+def wav_bytes(seconds, sample_rate=44100, channels=2, seed=0):
+    samples = np.random.default_rng(seed).uniform(-0.25, 0.25, (int(seconds * sample_rate), channels))
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as f:
+        f.setnchannels(channels)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        f.writeframes((samples * 32767).astype("<i2").tobytes())
+    return buffer.getvalue()
+
+
+def write_wav(path, seconds, **kwargs):
+    path.write_bytes(wav_bytes(seconds, **kwargs))
+    return str(path)
+
+
+def can_load_audio():
+    try:
+        torchaudio.load(io.BytesIO(wav_bytes(0.1)))
+    except (ImportError, RuntimeError, OSError):
+        return False
+    return True
+
+
+needs_audio_loading = pytest.mark.skipif(not can_load_audio(), reason="torchaudio has no backend to load wavs")
+
+
+def make_cache(folder, **kwargs):
+    """ A cache whose decoding is instant, max_seconds of a constant per file. """
+    cache = ReferenceAudioCache(str(folder), **kwargs)
+    cache.decodes = []
+
+    def decode(path):
+        cache.decodes.append(path)
+        return np.full(cache.sample_rate * cache.max_seconds, len(cache.decodes), dtype=np.float32)
+
+    cache.decode = decode
+    return cache
+
+
+def test_references_are_decoded_once(tmp_path):
+    wav = write_wav(tmp_path / "alice.wav", 0.1)
+    cache = make_cache(tmp_path / "reference", max_seconds=1)
+
+    decoded = cache.get(wav)
+    again = cache.get(wav)
+
+    assert cache.decodes == [wav]
+    assert isinstance(again, np.memmap)
+    np.testing.assert_array_equal(decoded, again)
+    # A cache of another length has files of its own
+    other = make_cache(tmp_path / "reference", max_seconds=2)
+    assert len(other.get(wav)) == 2 * 22050
+    assert other.decodes == [wav]
+
+
+def test_least_recently_used_references_are_removed(tmp_path):
+    wavs = [write_wav(tmp_path / f"{i}.wav", 0.1, seed=i) for i in range(3)]
+    folder = tmp_path / "reference"
+    # Room for two one-second references
+    cache = make_cache(folder, max_seconds=1, max_bytes=2 * 22050 * 4 + 1024)
+    cache.get(wavs[0])
+    cache.get(wavs[1])
+    cache.get(wavs[0])
+    cache.get(wavs[2])
+
+    assert cache.stats()["evictions"] == 1
+    assert sorted(os.listdir(folder)) == sorted(os.path.basename(cache._path(file_sha256(w))) for w in (wavs[0], wavs[2]))
+    assert cache.stats()["bytes"] == sum(os.path.getsize(folder / name) for name in os.listdir(folder))
+
+    # The next run starts from what is on disk
+    reopened = make_cache(folder, max_seconds=1, max_bytes=22050 * 4 + 1024)
+    assert reopened.stats()["entries"] == 1
+
+
+def test_discard(tmp_path):
+    wav = write_wav(tmp_path / "alice.wav", 0.1)
+    folder = tmp_path / "reference"
+    cache = make_cache(folder, max_seconds=1)
+    cache.get(wav)
+
+    cache.discard(file_sha256(wav))
+    cache.discard("unknown")
+
+    assert os.listdir(folder) == []
+    assert cache.stats()["bytes"] == 0
+
+
+def test_zero_size_keeps_nothing(tmp_path):
+    wav = write_wav(tmp_path / "alice.wav", 0.1)
+    cache = make_cache(tmp_path / "reference", max_seconds=1, max_bytes=0)
+
+    assert len(cache.get(wav)) == 22050
+    assert os.listdir(tmp_path / "reference") == []
+
+
+@needs_audio_loading
+def test_decoding_cuts_downmixes_and_resamples(tmp_path):
+    wav = write_wav(tmp_path / "alice.wav", 2)
+    cache = ReferenceAudioCache(str(tmp_path / "reference"), max_seconds=1)
+
+    audio = cache.get(wav)
+    assert audio.dtype == np.float32
+    assert len(audio) == 22050
+
+
+tts_funcs = pytest.importorskip("xtts_api_server.tts_funcs")
+from TTS.tts.configs.xtts_config import XttsConfig
+from TTS.tts.models.xtts import Xtts, XttsArgs
+
+from xtts_api_server.latents_cache import LatentsCache
+from xtts_api_server.latents_store import LatentsStore
+from xtts_api_server.reference_audio import SpeakerEmbeddingCache
+from xtts_api_server.speaker_index import scan_speakers
+
+
+@pytest.fixture(scope="module")
+def model():
+    # XTTS with a small random GPT, the speaker encoder and conditioning encoder keep their layout
+    torch.manual_seed(0)
+    config = XttsConfig()
+    config.model_args = XttsArgs(
+        gpt_layers=2,
+        gpt_n_model_channels=64,
+        gpt_n_heads=4,
+        gpt_number_text_tokens=300,
+        gpt_num_audio_tokens=66,
+        gpt_start_audio_token=64,
+        gpt_stop_audio_token=65,
+        decoder_input_dim=64,
+    )
+    model = Xtts(config)
+    model.init_models()
+    # Xtts.eval() returns nothing
+    model.eval()
+    return model
+
+
+def make_wrapper(model, cache_folder):
+    wrapper = tts_funcs.TTSWrapper.__new__(tts_funcs.TTSWrapper)
+    wrapper.model = model
+    wrapper.device = "cpu"
+    wrapper._file_hashes = {}
+    wrapper.reference_audio = ReferenceAudioCache(os.path.join(cache_folder, "reference"))
+    wrapper.speaker_embeddings = SpeakerEmbeddingCache(os.path.join(cache_folder, "embeddings"), "test")
+    return wrapper
+
+
+def assert_latents_equal(latents, expected):
+    for tensor, reference in zip(latents, expected):
+        torch.testing.assert_close(tensor, reference, rtol=1e-4, atol=1e-5)
+
+
+@needs_audio_loading
+def test_latents_match_xtts(model, tmp_path):
+    # Longer than the 30 s XTTS reads, at another rate and in stereo
+    wav = write_wav(tmp_path / "alice.wav", 31)
+    cache_folder = str(tmp_path / "cache")
+
+    expected = model.get_conditioning_latents(audio_path=wav)
+    assert_latents_equal(make_wrapper(model, cache_folder).compute_conditioning_latents(wav), expected)
+    # Again, from the cached reference audio
+    assert_latents_equal(make_wrapper(model, cache_folder).compute_conditioning_latents(wav), expected)
+
+
+def test_references_of_removed_speakers_are_discarded(tmp_path):
+    folder = tmp_path / "speakers"
+    (folder / "bob").mkdir(parents=True)
+    alice = write_wav(folder / "alice.wav", 0.1, seed=1)
+    bob = [write_wav(folder / "bob" / f"{i}.wav", 0.1, seed=i + 2) for i in range(2)]
+    wrapper = tts_funcs.TTSWrapper.__new__(tts_funcs.TTSWrapper)
+    wrapper.lowvram = True
+    wrapper._file_hashes = {}
+    wrapper.reference_audio = make_cache(tmp_path / "reference", max_seconds=1)
+    wrapper.latents_cache = LatentsCache(max_bytes=100)
+    wrapper.prefix_cache = LatentsCache(max_bytes=100)
+    wrapper.latents_store = LatentsStore(str(tmp_path / "latents"), "test")
+    before = scan_speakers(str(folder))
+    for wav in [alice] + bob:
+        wrapper.reference_audio.get(wav, wrapper.get_file_hash(wav))
+
+    # alice is deleted, bob gets a third sample
+    os.remove(alice)
+    write_wav(folder / "bob" / "2.wav", 0.1, seed=4)
+    after = scan_speakers(str(folder))
+    wrapper.on_speakers_changed([after["bob"]], [before["alice"], before["bob"]])
+
+    # bob's first two samples are still used
+    assert wrapper.reference_audio.stats()["entries"] == 2
+    assert sorted(os.listdir(tmp_path / "reference")) == sorted(
+        os.path.basename(wrapper.reference_audio._path(file_sha256(wav))) for wav in bob
+    )
+
+
+@needs_audio_loading
+def test_multi_sample_latents_match_xtts(model, tmp_path):
+    # The GPT latent only sees the first 6 s of the concatenation, which spans the first two files
+    wavs = [write_wav(tmp_path / f"{i}.wav", seconds, seed=i) for i, seconds in enumerate((4, 3, 5))]
+    wrapper = make_wrapper(model, str(tmp_path / "cache"))
+
+    expected = model.get_conditioning_latents(audio_path=wavs)
+    assert_latents_equal(wrapper.compute_conditioning_latents(wavs), expected)
+
+
+def test_adding_a_sample_only_processes_that_file(model, tmp_path, monkeypatch):
+    wavs = [write_wav(tmp_path / f"{i}.wav", 0.1, seed=i) for i in range(3)]
+    wrapper = make_wrapper(model, str(tmp_path / "cache"))
+    wrapper.reference_audio = make_cache(tmp_path / "reference", max_seconds=1)
+    embedded = []
+    original = model.get_speaker_embedding
+    monkeypatch.setattr(model, "get_speaker_embedding", lambda audio, sr: embedded.append(audio) or original(audio, sr))
+
+    wrapper.compute_conditioning_latents(wavs[:2])
+    gpt_cond_latent, speaker_embedding = wrapper.compute_conditioning_latents(wavs)
+
+    assert len(embedded) == 3
+    assert wrapper.reference_audio.decodes == wavs
+    # Still the mean of the per-file embeddings
+    expected = torch.stack([original(audio, 22050) for audio in embedded]).mean(dim=0)
+    torch.testing.assert_close(speaker_embedding, expected)
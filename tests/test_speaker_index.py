@@ -0,0 +1,131 @@
+import os
+import sys
+import threading
+
+import pytest
+
+pytest.importorskip("loguru")
+
+from xtts_api_server import speaker_index
+from xtts_api_server.speaker_index import EVENT_HEADER, IN_CREATE, SpeakerIndex, parse_events, scan_speaker, scan_speakers
+
+
+def write_wav(path, data=b"RIFF"):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+@pytest.fixture
+def folder(tmp_path):
+    write_wav(tmp_path / "alice.wav")
+    write_wav(tmp_path / "bob" / "1.wav")
+    write_wav(tmp_path / "bob" / "2.wav")
+    os.makedirs(tmp_path / "empty")
+    write_wav(tmp_path / ".upload.wav")
+    (tmp_path / "notes.txt").write_text("not a speaker")
+    return tmp_path
+
+
+class Changes:
+    def __init__(self):
+        self.calls = []
+        self.event = threading.Event()
+
+    def __call__(self, changed, removed):
+        self.calls.append((sorted(s["speaker_name"] for s in changed), sorted(s["speaker_name"] for s in removed)))
+        self.event.set()
+
+
+def test_scan(folder):
+    speakers = scan_speakers(str(folder))
+
+    assert list(speakers) == ["alice", "bob"]
+    assert speakers["alice"]["speaker_wav"] == str(folder / "alice.wav")
+    assert speakers["bob"]["speaker_wav"] == [str(folder / "bob" / "1.wav"), str(folder / "bob" / "2.wav")]
+    assert speakers["bob"]["preview"] == os.path.join("bob", "1.wav")
+
+
+def test_scan_one_speaker_matches_the_full_scan(folder):
+    speakers = scan_speakers(str(folder))
+    for name in ("alice", "bob"):
+        assert scan_speaker(str(folder), name) == speakers[name]
+    for name in ("empty", "nobody", ".upload", "notes.txt"):
+        assert scan_speaker(str(folder), name) is None
+
+
+def test_rescan_reports_the_difference(folder):
+    changes = Changes()
+    index = SpeakerIndex(str(folder), on_change=changes)
+    index.load()
+
+    write_wav(folder / "carol.wav")
+    write_wav(folder / "alice.wav", b"RIFF, longer")
+    write_wav(folder / "bob" / "3.wav")
+    os.remove(folder / "bob" / "1.wav")
+    os.remove(folder / "bob" / "2.wav")
+    os.remove(folder / "bob" / "3.wav")
+    index.rescan()
+
+    assert changes.calls == [(["alice", "carol"], ["alice", "bob"])]
+    assert [s["speaker_name"] for s in index.speakers()] == ["alice", "carol"]
+
+
+def test_rescanning_some_speakers(folder):
+    changes = Changes()
+    index = SpeakerIndex(str(folder), on_change=changes)
+    index.load()
+
+    write_wav(folder / "aaron.wav")
+    write_wav(folder / "zoe" / "1.wav")
+    write_wav(folder / "alice.wav", b"RIFF, longer")
+    os.remove(folder / "bob" / "1.wav")
+    index.rescan(["aaron", "zoe", "bob", "nobody"])
+
+    # alice was not named, so her change waits for a full rescan
+    assert changes.calls == [(["aaron", "bob", "zoe"], ["bob"])]
+    assert [s["speaker_name"] for s in index.speakers()] == ["aaron", "alice", "bob", "zoe"]
+
+    index.rescan()
+    assert changes.calls[-1] == (["alice"], ["alice"])
+    assert index.speakers() == list(scan_speakers(str(folder)).values())
+
+
+def test_parse_events():
+    def event(wd, mask, name):
+        encoded = name.encode()
+        # Names are padded with NULs to an aligned length
+        padded = encoded + b"\0" * (16 - len(encoded))
+        return EVENT_HEADER.pack(wd, mask, 0, len(padded)) + padded
+
+    buffer = event(1, IN_CREATE, "alice.wav") + EVENT_HEADER.pack(2, IN_CREATE, 0, 0) + event(1, IN_CREATE, "bob")
+    assert parse_events(buffer) == [(1, IN_CREATE, "alice.wav"), (2, IN_CREATE, ""), (1, IN_CREATE, "bob")]
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="inotify is Linux only")
+def test_watcher_rescans_only_the_changed_speakers(folder, monkeypatch):
+    changes = Changes()
+    index = SpeakerIndex(str(folder), on_change=changes, rescan_interval=600)
+    index.load()
+    full_scans = []
+    original = speaker_index.scan_speakers
+    monkeypatch.setattr(speaker_index, "scan_speakers", lambda folder: full_scans.append(folder) or original(folder))
+    index.start()
+    # Give the watcher time to add its watches
+    threading.Event().wait(0.5)
+
+    write_wav(folder / "carol.wav")
+    assert changes.event.wait(10)
+    assert changes.calls == [(["carol"], [])]
+
+    # Samples added to a new directory are picked up too
+    changes.event.clear()
+    os.makedirs(folder / "dave")
+    write_wav(folder / "dave" / "1.wav")
+    assert changes.event.wait(10)
+    changes.event.clear()
+    write_wav(folder / "dave" / "2.wav")
+    assert changes.event.wait(10)
+    assert index.get("dave")["speaker_wav"] == [str(folder / "dave" / "1.wav"), str(folder / "dave" / "2.wav")]
+
+    assert full_scans == []
@@ -0,0 +1,103 @@
+import io
+import os
+import threading
+import zipfile
+
+import pytest
+
+pytest.importorskip("TTS")
+tts_funcs = pytest.importorskip("xtts_api_server.tts_funcs")
+
+from xtts_api_server.speaker_index import SpeakerIndex
+
+WAV = b"RIFF\x24\x00\x00\x00WAVEfmt "
+
+
+@pytest.fixture
+def wrapper(tmp_path):
+    wrapper = tts_funcs.TTSWrapper.__new__(tts_funcs.TTSWrapper)
+    wrapper.speaker_folder = str(tmp_path)
+    wrapper._speaker_write_lock = threading.Lock()
+    wrapper.speaker_index = SpeakerIndex(str(tmp_path))
+    wrapper.latents_workers = 2
+    wrapper.lowvram = False
+    wrapper.load_progress = {"stage": "waiting"}
+    return wrapper
+
+
+def make_zip(files):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        for name, data in files.items():
+            archive.writestr(name, data)
+    buffer.seek(0)
+    return buffer
+
+
+def test_single_wav_speaker(wrapper, tmp_path):
+    assert wrapper.add_speaker("alice", [("a.wav", WAV)]) == "alice"
+
+    assert os.listdir(tmp_path) == ["alice.wav"]
+    assert (tmp_path / "alice.wav").read_bytes() == WAV
+    assert wrapper.speaker_index.get("alice")["speaker_wav"] == str(tmp_path / "alice.wav")
+
+
+def test_multi_sample_speaker(wrapper, tmp_path):
+    wrapper.add_speaker("bob", [("x/1.wav", WAV), ("y/1.wav", WAV + b"2")])
+
+    assert sorted(os.listdir(tmp_path / "bob")) == ["000_1.wav", "001_1.wav"]
+    assert len(wrapper.speaker_index.get("bob")["speaker_wav"]) == 2
+
+
+def test_existing_and_invalid_speakers_are_refused(wrapper, tmp_path):
+    wrapper.add_speaker("alice", [("a.wav", WAV)])
+
+    with pytest.raises(FileExistsError):
+        wrapper.add_speaker("alice", [("a.wav", WAV)])
+    with pytest.raises(ValueError):
+        wrapper.add_speaker("../carol", [("a.wav", WAV)])
+    with pytest.raises(ValueError):
+        wrapper.add_speaker("carol", [("a.mp3", b"ID3")])
+    assert os.listdir(tmp_path) == ["alice.wav"]
+
+
+def test_filesystem_without_hard_links(wrapper, tmp_path, monkeypatch):
+    def link(src, dst):
+        raise PermissionError(1, "Operation not permitted")
+
+    monkeypatch.setattr(tts_funcs.os, "link", link)
+    wrapper.add_speaker("alice", [("a.wav", WAV)])
+
+    # Written in place, the temporary file is gone
+    assert os.listdir(tmp_path) == ["alice.wav"]
+    assert (tmp_path / "alice.wav").read_bytes() == WAV
+
+
+def test_zip_import(wrapper, tmp_path):
+    archive = make_zip({
+        "alice.wav": WAV,
+        "bob/1.wav": WAV,
+        "bob/2.wav": WAV,
+        "bob/readme.txt": b"skipped",
+        "__MACOSX/._alice.wav": WAV,
+        "bad name!.wav": WAV,
+        "carol.wav": b"not a wav",
+    })
+
+    imported, skipped = wrapper.import_speakers_zip(archive)
+
+    assert sorted(imported) == ["alice", "bob"]
+    assert sorted(skipped) == ["bad name!", "carol"]
+    assert sorted(os.listdir(tmp_path)) == ["alice.wav", "bob"]
+
+
+def test_zip_size_limits(wrapper, tmp_path, monkeypatch):
+    monkeypatch.setattr(tts_funcs, "zip_member_max_bytes", 100)
+    imported, skipped = wrapper.import_speakers_zip(make_zip({"alice.wav": WAV, "bob.wav": WAV + bytes(100)}))
+    assert imported == ["alice"]
+    assert list(skipped) == ["bob"]
+
+    monkeypatch.setattr(tts_funcs, "zip_max_bytes", 100)
+    with pytest.raises(ValueError):
+        wrapper.import_speakers_zip(make_zip({"carol.wav": WAV, "dave.wav": WAV, "erin/1.wav": WAV + bytes(80)}))
+    assert sorted(os.listdir(tmp_path)) == ["alice.wav"]
@@ -0,0 +1,90 @@
+import json
+import os
+import threading
+
+import pytest
+
+pytest.importorskip("loguru")
+
+from xtts_api_server import speaker_usage
+from xtts_api_server.speaker_usage import SpeakerUsage
+
+DAY = 24 * 3600
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1_000_000.0]
+    monkeypatch.setattr(speaker_usage.time, "time", lambda: now[0])
+    return now
+
+
+def test_score_halves_every_half_life(tmp_path, clock):
+    usage = SpeakerUsage(str(tmp_path / "usage.json"), half_life=DAY)
+    usage.touch("alice")
+    usage.touch("alice")
+    assert usage.score("alice") == pytest.approx(2.0)
+
+    clock[0] += DAY
+    assert usage.score("alice") == pytest.approx(1.0)
+    usage.touch("alice")
+    assert usage.score("alice") == pytest.approx(2.0)
+    assert usage.score("nobody") == 0.0
+
+
+def test_recent_use_outweighs_old_counts(tmp_path, clock):
+    usage = SpeakerUsage(str(tmp_path / "usage.json"), half_life=DAY)
+    for _ in range(4):
+        usage.touch("old")
+    clock[0] += 3 * DAY
+    usage.touch("new")
+
+    assert [s["speaker"] for s in usage.stats()] == ["new", "old"]
+    assert usage.stats()[1]["count"] == 4
+
+
+def test_usage_survives_a_restart(tmp_path, clock):
+    path = str(tmp_path / "usage.json")
+    usage = SpeakerUsage(path, half_life=DAY, save_interval=0)
+    assert usage.touch("alice")
+    assert usage.touch("alice")
+
+    reopened = SpeakerUsage(path, half_life=DAY)
+    assert reopened.score("alice") == pytest.approx(2.0)
+    assert reopened.last_used("alice") == clock[0]
+    assert os.listdir(tmp_path) == ["usage.json"]
+
+
+def test_saves_are_spaced_out(tmp_path):
+    usage = SpeakerUsage(str(tmp_path / "usage.json"), save_interval=3600)
+    assert not usage.touch("alice")
+    assert not os.path.exists(tmp_path / "usage.json")
+    assert usage.save()
+    assert not usage.save()
+
+
+def test_concurrent_saves(tmp_path):
+    usage = SpeakerUsage(str(tmp_path / "usage.json"), save_interval=0)
+
+    def touch(name):
+        for _ in range(20):
+            usage.touch(name)
+
+    threads = [threading.Thread(target=touch, args=(f"speaker{i}",)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    usage.save()
+
+    assert os.listdir(tmp_path) == ["usage.json"]
+    assert len(SpeakerUsage(str(tmp_path / "usage.json")).stats()) == 4
+
+
+def test_older_files_and_unreadable_ones(tmp_path, clock):
+    path = tmp_path / "usage.json"
+    path.write_text(json.dumps({"last_used": {"alice": clock[0]}}))
+    assert SpeakerUsage(str(path)).score("alice") == pytest.approx(1.0)
+
+    path.write_text("{not json")
+    assert SpeakerUsage(str(path)).stats() == []
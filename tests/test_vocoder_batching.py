@@ -0,0 +1,161 @@
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from xtts_api_server.vocoder_batching import VocoderBatcher
+
+
+class RecordingDecoder:
+    """ Stands in for the HiFiGAN generator: 4 samples per frame, records the batch of every call. """
+
+    def __init__(self):
+        self.batches = []
+
+    def __call__(self, z, g=None):
+        self.batches.append(z.shape[0])
+        return (z.sum(dim=1, keepdim=True) + g.sum(dim=1, keepdim=True)).repeat_interleave(4, dim=-1)
+
+
+def decode_all(batcher, chunks):
+    results = [None] * len(chunks)
+
+    def decode(i, z, g):
+        results[i] = batcher.decode(z, g)
+
+    threads = [threading.Thread(target=decode, args=(i, z, g)) for i, (z, g) in enumerate(chunks)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_equal_chunks_share_a_call():
+    decoder = RecordingDecoder()
+    batcher = VocoderBatcher(decoder, max_batch_size=8, window=0.2)
+    chunks = [(torch.randn(1, 3, 10), torch.randn(1, 2, 1)) for _ in range(3)]
+
+    wavs = decode_all(batcher, chunks)
+
+    assert decoder.batches == [3]
+    for (z, g), wav in zip(chunks, wavs):
+        torch.testing.assert_close(wav, decoder(z, g).reshape(-1))
+
+
+def test_chunks_of_different_lengths_are_not_padded():
+    decoder = RecordingDecoder()
+    batcher = VocoderBatcher(decoder, max_batch_size=8, window=0.2)
+    chunks = [(torch.randn(1, 3, frames), torch.randn(1, 2, 1)) for frames in (10, 12, 10)]
+
+    wavs = decode_all(batcher, chunks)
+
+    assert sorted(decoder.batches) == [1, 2]
+    assert [len(wav) for wav in wavs] == [40, 48, 40]
+
+
+tts_funcs = pytest.importorskip("xtts_api_server.tts_funcs")
+hifigan = pytest.importorskip("TTS.tts.layers.xtts.hifigan_decoder")
+from TTS.tts.models.xtts import Xtts
+
+
+class FakeGPTBatcher:
+    """ Streams precomputed latents; with a barrier, each chunk's tokens wait for the other streams. """
+
+    def __init__(self, latents, chunk_size, barrier=None, skip_rounds=0, rounds=None):
+        self.latents = latents
+        self.chunk_size = chunk_size
+        self.barrier = barrier
+        self.skip_rounds = skip_rounds
+        self.rounds = rounds
+
+    def stream(self, gpt_cond_latent, text_tokens, prefix_kv=None):
+        latents = self.latents[text_tokens]
+        chunks = [latents[i : i + self.chunk_size] for i in range(0, len(latents), self.chunk_size)]
+        if self.barrier is None:
+            for latent in latents:
+                yield 0, latent
+            return
+        rounds = [None] * self.skip_rounds + chunks
+        rounds += [None] * (self.rounds - len(rounds))
+        for chunk in rounds:
+            self.barrier.wait(timeout=30)
+            for latent in chunk if chunk is not None else []:
+                yield 0, latent
+
+
+@pytest.fixture(scope="module")
+def decoder():
+    torch.manual_seed(0)
+    # XTTS's decoder layout with fewer channels, the receptive field is the same
+    return hifigan.HifiDecoder(decoder_input_dim=32, upsample_initial_channel_decoder=64, d_vector_dim=16).eval()
+
+
+def make_wrapper(decoder, gpt_batcher, vocoder_batcher):
+    wrapper = tts_funcs.TTSWrapper.__new__(tts_funcs.TTSWrapper)
+    wrapper.model = SimpleNamespace(hifigan_decoder=decoder)
+    wrapper.stream_chunk_size = 20
+    wrapper.vocoder_context_frames = 32
+    wrapper._stage_times = threading.local()
+    wrapper.tokenize_sentences = lambda text, language: [text]
+    wrapper.gpt_batcher = gpt_batcher
+    wrapper.vocoder_batcher = vocoder_batcher
+    return wrapper
+
+
+def xtts_stream(decoder, latents, speaker_embedding, chunk_size=20, overlap_len=1024):
+    """ The chunks Xtts.inference_stream makes, vocoding every latent so far each time. """
+    chunks = []
+    wav_gen_prev, wav_overlap = None, None
+    for end in list(range(chunk_size, len(latents) + 1, chunk_size)) + [len(latents)]:
+        wav_gen = decoder(torch.stack(latents[:end])[None, :], g=speaker_embedding).reshape(-1)
+        wav_chunk, wav_gen_prev, wav_overlap = Xtts.handle_chunks(None, wav_gen, wav_gen_prev, wav_overlap, overlap_len)
+        chunks.append(wav_chunk)
+    return chunks
+
+
+@pytest.mark.parametrize("frames", [13, 20, 47, 120])
+def test_windowed_stream_matches_xtts(decoder, frames):
+    torch.manual_seed(frames)
+    latents = list(torch.randn(frames, 32))
+    speaker_embedding = torch.randn(1, 16, 1)
+    wrapper = make_wrapper(decoder, FakeGPTBatcher({"text": latents}, 20), VocoderBatcher(decoder.waveform_decoder, window=0))
+
+    with torch.inference_mode():
+        chunks = list(wrapper.batched_stream("text", "en", None, speaker_embedding))
+        expected = xtts_stream(decoder, latents, speaker_embedding)
+
+    assert [len(chunk) for chunk in chunks] == [len(chunk) for chunk in expected]
+    torch.testing.assert_close(torch.cat(chunks), torch.cat(expected), rtol=1e-4, atol=1e-5)
+
+
+def test_staggered_streams_share_vocoder_calls(decoder):
+    torch.manual_seed(1)
+    latents = {"first": list(torch.randn(120, 32)), "second": list(torch.randn(120, 32))}
+    speaker_embedding = torch.randn(1, 16, 1)
+    vocoder_batcher = VocoderBatcher(decoder.waveform_decoder, max_batch_size=4, window=0.2)
+    barrier = threading.Barrier(2)
+    # The second stream starts two chunks after the first, each has 6 chunks and a final one
+    streams = [
+        make_wrapper(decoder, FakeGPTBatcher(latents, 20, barrier, skip_rounds=0, rounds=8), vocoder_batcher),
+        make_wrapper(decoder, FakeGPTBatcher(latents, 20, barrier, skip_rounds=2, rounds=8), vocoder_batcher),
+    ]
+    counts = {}
+
+    def listen(name, wrapper):
+        with torch.inference_mode():
+            counts[name] = len(list(wrapper.batched_stream(name, "en", None, speaker_embedding)))
+
+    threads = [threading.Thread(target=listen, args=args) for args in zip(latents, streams)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(60)
+
+    assert counts == {"first": 7, "second": 7}
+    stats = vocoder_batcher.stats()
+    assert stats["chunks"] == 14
+    # Only each stream's first two chunks are shorter than the window, every later chunk is vocoded in pairs
+    assert stats["calls"] == 10
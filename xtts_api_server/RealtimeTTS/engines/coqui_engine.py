@@ -11,6 +11,7 @@ import logging
 import pyaudio
 import torch
 import json
+import time
 import os
 import re
 
@@ -38,6 +39,8 @@ class CoquiEngine(BaseEngine):
                  use_mps = False,
                  use_deepspeed = False,
                  prepare_text_for_synthesis_callback = None,
+                 reference_cache_path = None,
+                 reference_cache_size = 1024 * 2**20,
                  ):
         """
         Initializes a coqui voice realtime text to speech engine object.
@@ -63,9 +66,17 @@ class CoquiEngine(BaseEngine):
             use_mps (bool): Enable MPS for the coqui model.
             use_deepspeed (bool): Enable deepspeed for the coqui model.
             prepare_text_for_synthesis_callback (function): Function to prepare text for synthesis. If not specified, a default sentence parser will be used. 
+            reference_cache_path (str): Folder for preprocessed reference audio, so cloning references are decoded only once. Disabled if not specified.
+            reference_cache_size (int): Maximum size in bytes of the preprocessed reference audio, least recently used files are removed first.
         """
 
         self._synthesize_lock = Lock()
+
+        # Worker statistics: time spent synthesizing and audio received over the pipe
+        self.busy_seconds = 0.0
+        self.bytes_received = 0
+        self.chunks_received = 0
+
         self.model_name = model_name
         self.language = language
         self.cloning_reference_wav = cloning_reference_wav
@@ -94,7 +105,7 @@ class CoquiEngine(BaseEngine):
             logging.info(f"Local XTTS Model: \"{specific_model}\" specified")
             self.local_model_path = self.download_model(specific_model, local_models_path)
 
-        self.synthesize_process = Process(target=CoquiEngine._synthesize_worker, args=(child_synthesize_pipe, model_name, cloning_reference_wav, language, self.main_synthesize_ready_event, level, self.speed, thread_count, stream_chunk_size, full_sentences, overlap_wav_len, temperature, length_penalty, repetition_penalty, top_k, top_p, enable_text_splitting, use_mps, self.local_model_path, use_deepspeed, self.voices_path))
+        self.synthesize_process = Process(target=CoquiEngine._synthesize_worker, args=(child_synthesize_pipe, model_name, cloning_reference_wav, language, self.main_synthesize_ready_event, level, self.speed, thread_count, stream_chunk_size, full_sentences, overlap_wav_len, temperature, length_penalty, repetition_penalty, top_k, top_p, enable_text_splitting, use_mps, self.local_model_path, use_deepspeed, self.voices_path, reference_cache_path, reference_cache_size))
         self.synthesize_process.start()
 
         logging.debug('Waiting for coqui text to speech synthesize model to start')
@@ -105,7 +116,7 @@ class CoquiEngine(BaseEngine):
         self.engine_name = "coqui"
 
     @staticmethod
-    def _synthesize_worker(conn, model_name, cloning_reference_wav: Union[str, List[str]], language, ready_event, loglevel, speed, thread_count, stream_chunk_size, full_sentences, overlap_wav_len, temperature, length_penalty, repetition_penalty, top_k, top_p, enable_text_splitting, use_mps, local_model_path, use_deepspeed, voices_path):
+    def _synthesize_worker(conn, model_name, cloning_reference_wav: Union[str, List[str]], language, ready_event, loglevel, speed, thread_count, stream_chunk_size, full_sentences, overlap_wav_len, temperature, length_penalty, repetition_penalty, top_k, top_p, enable_text_splitting, use_mps, local_model_path, use_deepspeed, voices_path, reference_cache_path=None, reference_cache_size=1024 * 2**20):
         """
         Worker process for the coqui text to speech synthesis model.
 
@@ -127,6 +138,18 @@ class CoquiEngine(BaseEngine):
 
         logging.info(f"Starting CoquiEngine")
 
+        reference_cache = None
+        if reference_cache_path:
+            from xtts_api_server.reference_audio import ReferenceAudioCache, conditioning_latents
+            reference_cache = ReferenceAudioCache(reference_cache_path, max_seconds=60, max_bytes=reference_cache_size)
+
+        def compute_conditioning_latents(audio_paths):
+            if reference_cache is None:
+                return tts.get_conditioning_latents(audio_path=audio_paths, gpt_cond_len=30, max_ref_length=60)
+            if not isinstance(audio_paths, list):
+                audio_paths = [audio_paths]
+            audios = [reference_cache.load(path, 60, device) for path in audio_paths]
+            return conditioning_latents(tts, audios, reference_cache.sample_rate, gpt_cond_len=30)
 
         def get_conditioning_latents(filenames: Union[str, List[str]]):
             """
@@ -192,7 +215,7 @@ class CoquiEngine(BaseEngine):
                 # compute and write latents to json file
                 logging.debug(f"Computing latents for {filename}")
 
-                gpt_cond_latent, speaker_embedding = tts.get_conditioning_latents(audio_path=filename_voice_wav, gpt_cond_len=30, max_ref_length=60)
+                gpt_cond_latent, speaker_embedding = compute_conditioning_latents(filename_voice_wav)
 
                 latents = {
                     "gpt_cond_latent": gpt_cond_latent.cpu().squeeze().half().tolist(),
@@ -227,7 +250,7 @@ class CoquiEngine(BaseEngine):
                 # compute and write latents to json file
                 logging.debug(f"Computing latents for {filename}")
 
-                gpt_cond_latent, speaker_embedding = tts.get_conditioning_latents(audio_path=audio_path_list, gpt_cond_len=30, max_ref_length=60)
+                gpt_cond_latent, speaker_embedding = compute_conditioning_latents(audio_path_list)
 
                 latents = {
                     "gpt_cond_latent": gpt_cond_latent.cpu().squeeze().half().tolist(),
@@ -509,20 +532,26 @@ class CoquiEngine(BaseEngine):
                 return
 
             data = {'text': text, 'language': self.language}
+            start_time = time.perf_counter()
             self.send_command('synthesize', data)
 
-            status, result = self.parent_synthesize_pipe.recv()
-
-            while not 'finished' in status:
-                if 'shutdown' in status or 'error' in status:
-                    if 'error' in status:
-                        logging.error(f'Error synthesizing text: {text}')
-                        logging.error(f'Error: {result}')
-                    return False
-                self.queue.put(result)
+            try:
                 status, result = self.parent_synthesize_pipe.recv()
 
-            return True
+                while not 'finished' in status:
+                    if 'shutdown' in status or 'error' in status:
+                        if 'error' in status:
+                            logging.error(f'Error synthesizing text: {text}')
+                            logging.error(f'Error: {result}')
+                        return False
+                    self.bytes_received += len(result)
+                    self.chunks_received += 1
+                    self.queue.put(result)
+                    status, result = self.parent_synthesize_pipe.recv()
+
+                return True
+            finally:
+                self.busy_seconds += time.perf_counter() - start_time
     
     @staticmethod
     def download_file(url, destination):
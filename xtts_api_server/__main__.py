@@ -8,12 +8,26 @@ parser.add_argument("-p", "--port", default=8020, type=int, help="Port to bind")
 parser.add_argument("-d", "--device", default="cuda", type=str, help="Device that will be used, you can choose cpu or cuda")
 parser.add_argument("-sf", "--speaker_folder", default="speakers/", type=str, help="The folder where you get the samples for tts")
 parser.add_argument("-o", "--output", default="output/", type=str, help="Output folder")
+parser.add_argument("-c", "--cache", default="cache/", type=str, help="Folder for cached audio and speaker data")
 parser.add_argument("-t", "--tunnel", default="", type=str, help="URL of tunnel used (e.g: ngrok, localtunnel)")
 parser.add_argument("-ms", "--model-source", default="local", choices=["api","apiManual", "local"],
                     help="Define the model source: 'api' for latest version from repository, apiManual for 2.0.2 model and api inference or 'local' for using local inference and model v2.0.2.")
 parser.add_argument("-v", "--version", default="2.0.2", type=str, help="You can specify which version of xtts to use,This version will be used everywhere in local, api and apiManual.")
 parser.add_argument("--lowvram", action='store_true', help="Enable low vram mode which switches the model to RAM when not actively processing.")
 parser.add_argument("--deepspeed", action='store_true', help="Enables deepspeed mode, speeds up processing by several times.")
+parser.add_argument("--max-queue-size", default=32, type=int, help="Maximum number of synthesis requests waiting for the model, extra requests get 429. 0 means unlimited.")
+parser.add_argument("--audio-cache-size", default=512, type=int, help="Maximum size in MB of the synthesized audio cache, 0 disables it.")
+parser.add_argument("--latents-cache-size", default=256, type=int, help="Memory budget in MB for speaker latents, least recently used speakers are dropped first.")
+parser.add_argument("--reference-cache-size", default=1024, type=int, help="Maximum size in MB of the decoded reference audio kept in the cache folder, 0 disables it.")
+parser.add_argument("--prefix-cache-size", default=64, type=int, help="Memory budget in MB for the speaker prefixes of the batched GPT decoder.")
+parser.add_argument("--latents-workers", default=2, type=int, help="Number of threads creating speaker latents in the background.")
+parser.add_argument("--pinned-speakers", default=16, type=int, help="Number of most requested speakers whose latents are never evicted from memory.")
+parser.add_argument("--gpt-batch-size", default=1, type=int, help="Number of sentences from concurrent requests decoded together by the GPT, 1 disables batching.")
+parser.add_argument("--vocoder-batch-window", default=5, type=float, help="Milliseconds concurrent stream chunks wait to be vocoded together when GPT batching is on.")
+parser.add_argument("--model-replicas", default=1, type=int, help="Number of model copies that synthesize segments of long texts in parallel.")
+parser.add_argument("--long-form-chars", default=1000, type=int, help="Texts sent to /tts_to_file longer than this are synthesized in parallel segments, 0 disables it.")
+parser.add_argument("--encoder-workers", default=2, type=int, help="Number of threads that encode compressed audio formats.")
+parser.add_argument("--model-load-wait", default=30, type=float, help="Seconds a synthesis request waits for the model while it loads before getting 503.")
 parser.add_argument("--streaming-mode", action='store_true', help="Enables streaming mode, currently needs a lot of work.")
 parser.add_argument("--streaming-mode-improve", action='store_true', help="Includes an improved streaming mode that consumes 2gb more VRAM and uses a better tokenizer, good for languages such as Chinese")
 parser.add_argument("--stream-play-sync", action='store_true', help="Additional flag for streaming mod that allows you to play all audio one at a time without interruption")
@@ -23,12 +37,26 @@ args = parser.parse_args()
 os.environ['DEVICE'] = args.device  # Set environment variable for output folder.
 os.environ['OUTPUT'] = args.output  # Set environment variable for output folder.
 os.environ['SPEAKER'] = args.speaker_folder  # Set environment variable for speaker folder.
+os.environ['CACHE'] = args.cache  # Set environment variable for cache folder.
 os.environ['BASE_URL'] = "http://" + args.host + ":" + str(args.port)  # Set environment variable for base url."
 os.environ['TUNNEL_URL'] = args.tunnel  # it is necessary to correctly return correct previews in list of speakers
 os.environ['MODEL_SOURCE'] = args.model_source  # Set environment variable for the model source
 os.environ["MODEL_VERSION"] = args.version # Specify version of XTTS model
 os.environ["DEEPSPEED"] = str(args.deepspeed).lower() # Set lowvram mode
 os.environ["LOWVRAM_MODE"] = str(args.lowvram).lower() # Set lowvram mode
+os.environ["MAX_QUEUE_SIZE"] = str(args.max_queue_size) # Admission queue depth
+os.environ["AUDIO_CACHE_SIZE"] = str(args.audio_cache_size) # Audio cache size in MB
+os.environ["LATENTS_CACHE_SIZE"] = str(args.latents_cache_size) # Speaker latents memory budget in MB
+os.environ["PREFIX_CACHE_SIZE"] = str(args.prefix_cache_size) # Speaker prefix KV memory budget in MB
+os.environ["REFERENCE_CACHE_SIZE"] = str(args.reference_cache_size) # Decoded reference audio cache size in MB
+os.environ["LATENTS_WORKERS"] = str(args.latents_workers) # Background latents threads
+os.environ["PINNED_SPEAKERS"] = str(args.pinned_speakers) # Speakers kept in the latents hot set
+os.environ["GPT_BATCH_SIZE"] = str(args.gpt_batch_size) # Batched GPT decoding
+os.environ["VOCODER_BATCH_WINDOW"] = str(args.vocoder_batch_window) # Batched vocoder wait in ms
+os.environ["MODEL_REPLICAS"] = str(args.model_replicas) # Model copies for long texts
+os.environ["LONG_FORM_CHARS"] = str(args.long_form_chars) # Long-form threshold
+os.environ["ENCODER_WORKERS"] = str(args.encoder_workers) # Audio encoding threads
+os.environ["MODEL_LOAD_WAIT"] = str(args.model_load_wait) # Wait for the model while it loads
 os.environ["STREAM_MODE"] = str(args.streaming_mode).lower() # Enable Streaming mode
 os.environ["STREAM_MODE_IMPROVE"] = str(args.streaming_mode_improve).lower() # Enable improved Streaming mode
 os.environ["STREAM_PLAY_SYNC"] = str(args.stream_play_sync).lower() # Enable Streaming mode
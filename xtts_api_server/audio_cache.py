@@ -0,0 +1,132 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from loguru import logger
+
+
+class AudioCache:
+    """
+    Content-addressed store of synthesized audio.
+
+    Entries are files named after their key inside cache_folder. The key already
+    covers the output format, so they share a neutral extension. The total size
+    on disk is bounded by max_bytes, the least recently used entries go first.
+    """
+
+    SUFFIX = ".audio"
+
+    def __init__(self, cache_folder, max_bytes):
+        self.cache_folder = cache_folder
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> size in bytes, oldest first
+        self._lock = threading.Lock()
+
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        os.makedirs(self.cache_folder, exist_ok=True)
+        self._load()
+
+    @staticmethod
+    def make_key(**parts):
+        """ Hashes the parts that determine the generated audio into a cache key. """
+        payload = json.dumps(parts, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_folder, key + self.SUFFIX)
+
+    def _load(self):
+        """ Indexes entries left by a previous run, oldest access first. """
+        files = []
+        with os.scandir(self.cache_folder) as it:
+            for entry in it:
+                if not entry.is_file():
+                    continue
+                if entry.name.endswith(".tmp"):
+                    # Left by a writer that didn't finish
+                    os.remove(entry.path)
+                elif entry.name.endswith(self.SUFFIX):
+                    stat = entry.stat()
+                    files.append((stat.st_atime, entry.name[: -len(self.SUFFIX)], stat.st_size))
+
+        for _, key, size in sorted(files):
+            self._entries[key] = size
+            self.total_bytes += size
+
+        if files:
+            logger.info(f"Audio cache: {len(files)} entries, {self.total_bytes / 2**20:.1f} MB")
+        with self._lock:
+            self._evict()
+
+    def get(self, key):
+        """ Returns the cached audio bytes for key, or None. """
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+
+        # Read without the lock so lookups of other keys don't wait on the disk
+        try:
+            with open(self._path(key), "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            data = None
+
+        with self._lock:
+            if data is None:
+                # Evicted meanwhile, or removed behind our back
+                if key in self._entries and not os.path.exists(self._path(key)):
+                    self.total_bytes -= self._entries.pop(key)
+                self.misses += 1
+                return None
+            if key in self._entries:
+                self._entries.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def put(self, key, data):
+        """ Stores audio bytes under key. """
+        size = len(data)
+        if size > self.max_bytes:
+            return
+
+        # Unique per writer, concurrent puts of one key must not share a temp file
+        tmp_path = f"{self._path(key)}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, self._path(key))
+
+        with self._lock:
+            self.total_bytes -= self._entries.pop(key, 0)
+            self._entries[key] = size
+            self.total_bytes += size
+            self._evict()
+
+    def _evict(self):
+        while self.total_bytes > self.max_bytes and self._entries:
+            key, size = self._entries.popitem(last=False)
+            self.total_bytes -= size
+            self.evictions += 1
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,252 @@
+import asyncio
+import io
+import queue
+import shutil
+import struct
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+import torchaudio
+
+from xtts_api_server.metrics import timed
+
+# name -> media type, file extension and ffmpeg output arguments (None for formats encoded in python)
+FORMATS = {
+    "wav": {"media_type": "audio/wav", "extension": "wav", "ffmpeg": None},  # 32-bit float
+    "wav_s16": {"media_type": "audio/wav", "extension": "wav", "ffmpeg": None},
+    "pcm_s16le": {"media_type": "audio/L16", "extension": "pcm", "ffmpeg": None},
+    "flac": {"media_type": "audio/flac", "extension": "flac", "ffmpeg": ["-f", "flac"]},
+    "mp3": {"media_type": "audio/mpeg", "extension": "mp3", "ffmpeg": ["-f", "mp3", "-c:a", "libmp3lame", "-b:a", "64k"]},
+    "opus": {"media_type": "audio/ogg", "extension": "ogg", "ffmpeg": ["-f", "ogg", "-c:a", "libopus", "-b:a", "32k", "-page_duration", "20000"]},
+}
+
+# Accept header media types -> format name
+ACCEPT_TYPES = {
+    "audio/wav": "wav",
+    "audio/wave": "wav",
+    "audio/x-wav": "wav",
+    "audio/l16": "pcm_s16le",
+    "audio/pcm": "pcm_s16le",
+    "audio/flac": "flac",
+    "audio/x-flac": "flac",
+    "audio/mpeg": "mp3",
+    "audio/mp3": "mp3",
+    "audio/ogg": "opus",
+    "audio/opus": "opus",
+}
+
+EXTENSIONS = {"wav": "wav", "pcm": "pcm_s16le", "flac": "flac", "mp3": "mp3", "ogg": "opus", "opus": "opus"}
+
+
+def negotiate_format(requested=None, accept=None, default="wav"):
+    """
+    Picks the output format from an explicit format name or an Accept header.
+
+    Raises ValueError for an unknown explicit format or when ffmpeg is missing.
+    """
+    if requested:
+        requested = requested.lower()
+        if requested == "ogg":
+            requested = "opus"
+        if requested not in FORMATS:
+            raise ValueError(f"Unsupported format {requested}, choose one of: {', '.join(FORMATS)}")
+        _check_ffmpeg(requested)
+        return requested
+
+    if accept:
+        # Highest q value first, the order in the header breaks ties
+        candidates = []
+        for i, part in enumerate(accept.split(",")):
+            media_type, *params = [p.strip() for p in part.split(";")]
+            q = 1.0
+            for param in params:
+                if param.startswith("q="):
+                    try:
+                        q = float(param[2:])
+                    except ValueError:
+                        q = 0.0
+            candidates.append((-q, i, media_type.lower()))
+        for neg_q, _, media_type in sorted(candidates):
+            if neg_q < 0 and media_type in ACCEPT_TYPES:
+                audio_format = ACCEPT_TYPES[media_type]
+                if FORMATS[audio_format]["ffmpeg"] and shutil.which("ffmpeg") is None:
+                    continue
+                return audio_format
+
+    return default
+
+
+def format_from_path(path, default="wav"):
+    """ Output format implied by a file name's extension. """
+    extension = path.rsplit(".", 1)[-1].lower() if "." in path else ""
+    return EXTENSIONS.get(extension, default)
+
+
+def stream_format(audio_format):
+    """
+    Format used for audio that is encoded incrementally. A 32-bit float WAV
+    can't be streamed, so plain wav becomes 16-bit PCM WAV there.
+    """
+    return "wav_s16" if audio_format == "wav" else audio_format
+
+
+def media_type(audio_format, sample_rate=24000):
+    if audio_format == "pcm_s16le":
+        return f"audio/L16;rate={sample_rate};channels=1"
+    return FORMATS[audio_format]["media_type"]
+
+
+def to_pcm16(wav):
+    """ Float waveform in [-1, 1] to little-endian 16-bit PCM bytes. """
+    wav = np.clip(wav, -1, 1)
+    return (wav * 32767).astype("<i2").tobytes()
+
+
+def wav_header(sample_rate, channels=1, width=2, data_size=0xFFFFFFFF):
+    """ PCM WAV header, the default sizes mark an open-ended stream. """
+    block_align = channels * width
+    riff_size = 0xFFFFFFFF if data_size == 0xFFFFFFFF else 36 + data_size
+    return b"".join([
+        b"RIFF", struct.pack("<I", riff_size), b"WAVE",
+        b"fmt ", struct.pack("<IHHIIHH", 16, 1, channels, sample_rate, sample_rate * block_align, block_align, width * 8),
+        b"data", struct.pack("<I", data_size),
+    ])
+
+
+def _check_ffmpeg(audio_format):
+    if FORMATS[audio_format]["ffmpeg"] and shutil.which("ffmpeg") is None:
+        raise ValueError(f"ffmpeg is required to encode {audio_format}")
+
+
+def encode(wav, audio_format, sample_rate=24000):
+    """ Encodes a whole float waveform into the given format. """
+    if audio_format == "wav":
+        buffer = io.BytesIO()
+        # from_numpy shares memory with the array instead of copying it
+        torchaudio.save(buffer, torch.from_numpy(wav).unsqueeze(0), sample_rate, format="wav")
+        return buffer.getvalue()
+
+    pcm = to_pcm16(wav)
+    if audio_format == "pcm_s16le":
+        return pcm
+    if audio_format == "wav_s16":
+        return wav_header(sample_rate, data_size=len(pcm)) + pcm
+
+    encoder = StreamEncoder(audio_format, sample_rate)
+    return encoder.feed(pcm) + encoder.finish()
+
+
+class StreamEncoder:
+    """
+    Incremental encoder fed with 16-bit PCM.
+
+    feed() returns whatever encoded bytes are available so far and finish()
+    returns the rest. Compressed formats are encoded by an ffmpeg process.
+    """
+
+    def __init__(self, audio_format, sample_rate=24000):
+        if audio_format == "wav":
+            raise ValueError("32-bit float WAV can't be encoded incrementally, use wav_s16")
+        _check_ffmpeg(audio_format)
+        self.audio_format = audio_format
+        self.sample_rate = sample_rate
+        self._header_sent = False
+        self._process = None
+
+        if FORMATS[audio_format]["ffmpeg"]:
+            self._output = queue.Queue()
+            self._process = subprocess.Popen(
+                ["ffmpeg", "-hide_banner", "-loglevel", "error",
+                 "-f", "s16le", "-ar", str(sample_rate), "-ac", "1", "-i", "pipe:0",
+                 "-flush_packets", "1", *FORMATS[audio_format]["ffmpeg"], "pipe:1"],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+            )
+            self._reader = threading.Thread(target=self._read_output, daemon=True)
+            self._reader.start()
+
+    def _read_output(self):
+        while True:
+            data = self._process.stdout.read1(65536)
+            if not data:
+                break
+            self._output.put(data)
+
+    def _drain(self):
+        data = []
+        while True:
+            try:
+                data.append(self._output.get_nowait())
+            except queue.Empty:
+                return b"".join(data)
+
+    def header(self):
+        """ Bytes that precede the audio, only the WAV formats have one. """
+        if self.audio_format == "wav_s16":
+            return wav_header(self.sample_rate)
+        return b""
+
+    def feed(self, pcm):
+        if self._process is None:
+            if not self._header_sent:
+                self._header_sent = True
+                return self.header() + pcm
+            return pcm
+
+        self._process.stdin.write(pcm)
+        self._process.stdin.flush()
+        return self._drain()
+
+    def finish(self):
+        if self._process is None:
+            return b"" if self._header_sent else self.header()
+
+        self._process.stdin.close()
+        self._reader.join()
+        self._process.wait()
+        return self._drain()
+
+    def close(self):
+        """ Stops the encoder without waiting for the remaining output. """
+        if self._process is not None and self._process.poll() is None:
+            self._process.kill()
+            self._process.wait()
+
+
+class EncoderPool:
+    """ Worker threads that encode audio so the inference slots only run the model. """
+
+    def __init__(self, workers=2):
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="encoder")
+
+    async def call(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._pool, self._timed_call, fn, args)
+
+    @staticmethod
+    def _timed_call(fn, args):
+        with timed("encoding"):
+            return fn(*args)
+
+    async def encode(self, wav, audio_format, sample_rate=24000):
+        return await self.call(encode, wav, audio_format, sample_rate)
+
+    async def stream(self, pcm_chunks, audio_format, sample_rate=24000):
+        """ Encodes an async iterator of 16-bit PCM chunks as they arrive. """
+        encoder = StreamEncoder(audio_format, sample_rate)
+        finished = False
+        try:
+            async for chunk in pcm_chunks:
+                data = await self.call(encoder.feed, chunk)
+                if data:
+                    yield data
+            data = await self.call(encoder.finish)
+            finished = True
+            if data:
+                yield data
+        finally:
+            if not finished:
+                encoder.close()
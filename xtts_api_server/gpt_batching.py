@@ -0,0 +1,332 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import torch
+import torch.nn.functional as F
+from loguru import logger
+
+
+class _Sequence:
+    """ One sentence waiting for or being decoded. """
+    def __init__(self, prefix_kv, text_emb, text_len, stream=False):
+        self.prefix_kv = prefix_kv  # per layer (key, value) of the speaker's conditioning latent
+        self.text_emb = text_emb  # (1, text_len + 2, dim) with the start and stop text tokens
+        # Sentences within a power of two of each other in text length share a bucket
+        self.bucket = text_len.bit_length()
+        self.future = Future()
+        self.submitted_at = time.monotonic()
+        self.codes = []
+        # Streamed sentences also get every (token, latent) pair as it is sampled, then None
+        self.tokens = queue.Queue() if stream else None
+        self.abandoned = False
+
+
+def sample_tokens(logits, seen, settings):
+    """
+    Sampling as HF generate does it for XTTS: repetition penalty, temperature, top-k, top-p.
+    With do_sample=False in settings it is greedy, only the repetition penalty applies.
+    """
+    penalty = settings["repetition_penalty"]
+    if penalty != 1.0:
+        penalized = torch.where(logits < 0, logits * penalty, logits / penalty)
+        logits = torch.where(seen, penalized, logits)
+    if not settings.get("do_sample", True):
+        return logits.argmax(dim=-1)
+    logits = logits / max(settings["temperature"], 1e-5)
+
+    top_k = min(settings["top_k"], logits.size(-1))
+    if top_k > 0:
+        kth = torch.topk(logits, top_k, dim=-1).values[:, -1:]
+        logits = logits.masked_fill(logits < kth, float("-inf"))
+
+    if settings["top_p"] < 1.0:
+        sorted_logits, sorted_indices = torch.sort(logits, descending=False)
+        remove = sorted_logits.softmax(dim=-1).cumsum(dim=-1) <= (1 - settings["top_p"])
+        remove[:, -1] = False
+        logits = logits.masked_fill(remove.scatter(1, sorted_indices, remove), float("-inf"))
+
+    return torch.multinomial(logits.softmax(dim=-1), 1).squeeze(1)
+
+
+class GPTBatcher:
+    """
+    Continuous batching of the XTTS GPT decode across requests.
+
+    Callers submit sentences and get a Future of their audio codes, or stream
+    them to get each token with its GPT latent as it is sampled. A single
+    decode thread advances every running sentence by one token per step in one
+    batched forward pass. Waiting sentences are prefilled and join between
+    steps, finished ones leave, so throughput grows with concurrency and a long
+    sentence never holds shorter ones back.
+
+    The conditioning latent comes first in every prompt and attention is causal,
+    so its keys and values depend on the speaker only. They are computed once
+    per speaker (speaker_prefix) and a sentence's prefill only runs its text.
+
+    When more sentences wait than there is room for, those in the running
+    batch's text length bucket go first: sentences of similar length finish
+    together and waste less KV cache padding. A sentence that waited longer
+    than max_wait is admitted regardless of its bucket.
+    """
+
+    def __init__(self, gpt, settings, max_batch_size=8, max_wait=0.1):
+        self.gpt = gpt
+        self.inference = gpt.gpt_inference
+        # The wrapper's generation settings, read at every step
+        self.settings = settings
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+
+        self._waiting = []
+        self._cond = threading.Condition()
+
+        # Running batch, only touched by the decode thread
+        self._running = []
+        self._past = None  # per layer (key, value), each (batch, heads, length, head_dim)
+        self._mask = None  # (batch, length), 0 for left padding
+        self._positions = None  # (batch,) mel position of the next token fed in
+        self._tokens = None  # (batch,) last sampled token
+        self._seen = None  # (batch, vocab) tokens sampled so far, for the repetition penalty
+
+        self.steps = 0
+        self.tokens_decoded = 0
+        self.sequences_completed = 0
+
+        self._thread = threading.Thread(target=self._run, name="gpt-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, gpt_cond_latent, text_tokens, prefix_kv=None):
+        """
+        Queues one tokenized sentence, returns a Future of its (1, codes) tensor.
+
+        prefix_kv is speaker_prefix(gpt_cond_latent) if the caller has it cached.
+        """
+        return self._enqueue(gpt_cond_latent, text_tokens, prefix_kv).future
+
+    def stream(self, gpt_cond_latent, text_tokens, prefix_kv=None):
+        """
+        Queues one tokenized sentence and returns an iterator of (token, latent)
+        pairs as they are decoded, like the generator behind Xtts.inference_stream.
+        """
+        sequence = self._enqueue(gpt_cond_latent, text_tokens, prefix_kv, stream=True)
+        try:
+            while True:
+                item = sequence.tokens.get()
+                if item is None:
+                    break
+                yield item
+        finally:
+            # A listener that went away frees its place in the batch at the next step
+            sequence.abandoned = True
+        # Raises if the decode failed
+        sequence.future.result()
+
+    @torch.inference_mode()
+    def speaker_prefix(self, gpt_cond_latent):
+        """ Keys and values of the conditioning latent, per layer, shared by every sentence of the speaker. """
+        mask = torch.ones(gpt_cond_latent.shape[:2], dtype=torch.long, device=gpt_cond_latent.device)
+        _, _, past = self._forward(gpt_cond_latent, mask)
+        return tuple(tuple(layer) for layer in past)
+
+    @torch.inference_mode()
+    def _enqueue(self, gpt_cond_latent, text_tokens, prefix_kv=None, stream=False):
+        gpt = self.gpt
+        if prefix_kv is None:
+            prefix_kv = self.speaker_prefix(gpt_cond_latent)
+        text_inputs = F.pad(text_tokens, (0, 1), value=gpt.stop_text_token)
+        text_inputs = F.pad(text_inputs, (1, 0), value=gpt.start_text_token)
+        text_emb = gpt.text_embedding(text_inputs) + gpt.text_pos_embedding(text_inputs)
+        sequence = _Sequence(prefix_kv, text_emb, text_tokens.shape[-1], stream)
+        with self._cond:
+            self._waiting.append(sequence)
+            self._cond.notify()
+        return sequence
+
+    def stats(self):
+        with self._cond:
+            waiting = len(self._waiting)
+        return {
+            "max_batch_size": self.max_batch_size,
+            "running": len(self._running),
+            "waiting": waiting,
+            "steps": self.steps,
+            "tokens": self.tokens_decoded,
+            "completed": self.sequences_completed,
+            "avg_batch_size": self.tokens_decoded / self.steps if self.steps else 0.0,
+        }
+
+    def _run(self):
+        with torch.inference_mode():
+            while True:
+                joining = self._take_waiting()
+                try:
+                    if joining:
+                        self._join(joining)
+                    self._step()
+                except Exception as e:
+                    logger.exception("Batched GPT decode failed")
+                    for sequence in self._running + joining:
+                        if not sequence.future.done():
+                            sequence.future.set_exception(e)
+                            if sequence.tokens is not None:
+                                sequence.tokens.put(None)
+                    self._running = []
+                    self._past = None
+
+    def _take_waiting(self):
+        """ Picks the sentences that join the batch before the next step, blocking while idle. """
+        with self._cond:
+            while not self._waiting and not self._running:
+                self._cond.wait()
+            room = self.max_batch_size - len(self._running)
+            if room <= 0 or not self._waiting:
+                return []
+
+            now = time.monotonic()
+            if self._running:
+                buckets = [s.bucket for s in self._running]
+                target = max(set(buckets), key=buckets.count)
+            else:
+                target = min(self._waiting, key=lambda s: s.submitted_at).bucket
+            order = sorted(self._waiting, key=lambda s: (
+                now - s.submitted_at < self.max_wait,  # overdue first
+                abs(s.bucket - target),
+                s.submitted_at,
+            ))
+            chosen = order[:room]
+            self._waiting = order[room:]
+
+        # Callers that gave up while waiting are dropped here
+        return [s for s in chosen if s.future.set_running_or_notify_cancel()]
+
+    def _forward(self, inputs_embeds, attention_mask, past_key_values=None):
+        out = self.inference.transformer(
+            inputs_embeds=inputs_embeds,
+            past_key_values=past_key_values,
+            attention_mask=attention_mask,
+            use_cache=True,
+            return_dict=True,
+        )
+        past = out.past_key_values
+        if hasattr(past, "to_legacy_cache"):
+            past = past.to_legacy_cache()
+        # lm_head is (final_norm, mel_head); the normalized hidden state is the latent streaming vocodes
+        latents = self.inference.lm_head[0](out.last_hidden_state[:, -1])
+        return self.inference.lm_head[1](latents), latents, past
+
+    def _mel_embedding(self, tokens, positions):
+        return (self.inference.embeddings(tokens) + self.inference.pos_embedding.emb(positions)).unsqueeze(1)
+
+    def _join(self, joining):
+        """ Prefills the text of the new sentences together and merges their KV cache into the running batch. """
+        device = joining[0].text_emb.device
+        start = torch.full((1,), self.gpt.start_audio_token, dtype=torch.long, device=device)
+        start_emb = self._mel_embedding(start, torch.zeros_like(start))[0]
+        inputs = [torch.cat([s.text_emb[0], start_emb], dim=0) for s in joining]
+
+        # The speakers' cached prefixes come first, then the text, left padded so every
+        # sentence's last position lines up. Padding in the middle is masked like any other.
+        # Cached prefixes are kept in half precision and upcast here
+        dtype = joining[0].text_emb.dtype
+        prefix_lengths = [s.prefix_kv[0][0].shape[2] for s in joining]
+        prefix_length = max(prefix_lengths)
+        prefix_kv = [
+            tuple(torch.cat([self._pad_kv(s.prefix_kv[layer][i].to(dtype), prefix_length) for s in joining]) for i in range(2))
+            for layer in range(len(joining[0].prefix_kv))
+        ]
+        length = max(len(x) for x in inputs)
+        embeds = torch.stack([F.pad(x, (0, 0, length - len(x), 0)) for x in inputs])
+        mask = torch.stack([
+            torch.cat([
+                F.pad(torch.ones(n, dtype=torch.long, device=device), (prefix_length - n, 0)),
+                F.pad(torch.ones(len(x), dtype=torch.long, device=device), (length - len(x), 0)),
+            ])
+            for n, x in zip(prefix_lengths, inputs)
+        ])
+        logits, latents, past = self._forward(embeds, mask, prefix_kv)
+        length = mask.shape[1]
+
+        seen = torch.zeros_like(logits, dtype=torch.bool)
+        # GPT.generate hands HF a prompt of filler token 1 plus the start token, the repetition penalty sees both
+        seen[:, 1] = True
+        seen[:, self.gpt.start_audio_token] = True
+        tokens = sample_tokens(logits, seen, self.settings)
+        positions = torch.ones(len(joining), dtype=torch.long, device=device)
+
+        if self._running:
+            total = max(length, self._mask.shape[1])
+            past = [
+                tuple(torch.cat([self._pad_kv(a, total), self._pad_kv(b, total)]) for a, b in zip(old, new))
+                for old, new in zip(self._past, past)
+            ]
+            mask = torch.cat([F.pad(self._mask, (total - self._mask.shape[1], 0)), F.pad(mask, (total - length, 0))])
+            positions = torch.cat([self._positions, positions])
+            seen = torch.cat([self._seen, seen])
+            previous_tokens = self._tokens
+        else:
+            previous_tokens = tokens[:0]
+
+        self._running = self._running + joining
+        self._past, self._mask, self._positions, self._seen = past, mask, positions, seen
+        self._tokens = torch.cat([previous_tokens, tokens])
+        self._record(tokens, latents, range(len(self._running) - len(joining), len(self._running)))
+
+    @staticmethod
+    def _pad_kv(tensor, length):
+        return F.pad(tensor, (0, 0, length - tensor.shape[2], 0))
+
+    def _step(self):
+        if not self._running:
+            return
+        embeds = self._mel_embedding(self._tokens, self._positions)
+        mask = F.pad(self._mask, (0, 1), value=1)
+        logits, latents, past = self._forward(embeds, mask, self._past)
+        tokens = sample_tokens(logits, self._seen, self.settings)
+
+        self._past, self._mask, self._tokens = past, mask, tokens
+        self._positions = self._positions + 1
+        self.steps += 1
+        self._record(tokens, latents, range(len(self._running)))
+
+    def _record(self, tokens, latents, rows):
+        """ Appends the sampled tokens and lets finished sentences leave the batch. """
+        self.tokens_decoded += len(rows)
+        self._seen[torch.arange(rows.start, rows.stop, device=tokens.device), tokens] = True
+        stop = self.gpt.stop_audio_token
+        finished = []
+        for i, (row, token) in enumerate(zip(rows, tokens.tolist())):
+            sequence = self._running[row]
+            sequence.codes.append(token)
+            if sequence.tokens is not None:
+                sequence.tokens.put((token, latents[i]))
+            if token == stop or len(sequence.codes) >= self.gpt.max_gen_mel_tokens or sequence.abandoned:
+                finished.append(row)
+        if finished:
+            self._leave(finished)
+
+    def _leave(self, finished):
+        device = self._tokens.device
+        for row in finished:
+            sequence = self._running[row]
+            sequence.future.set_result(torch.tensor([sequence.codes], dtype=torch.long, device=device))
+            if sequence.tokens is not None:
+                sequence.tokens.put(None)
+            self.sequences_completed += 1
+
+        keep = [row for row in range(len(self._running)) if row not in finished]
+        self._running = [self._running[row] for row in keep]
+        if not keep:
+            self._past = self._mask = self._positions = self._tokens = self._seen = None
+            return
+
+        index = torch.tensor(keep, dtype=torch.long, device=device)
+        mask = self._mask.index_select(0, index)
+        # Drop the columns that are padding for every remaining sentence
+        offset = int(mask.any(dim=0).long().argmax())
+        self._mask = mask[:, offset:]
+        self._past = [tuple(t.index_select(0, index)[:, :, offset:] for t in layer) for layer in self._past]
+        self._positions = self._positions.index_select(0, index)
+        self._tokens = self._tokens.index_select(0, index)
+        self._seen = self._seen.index_select(0, index)
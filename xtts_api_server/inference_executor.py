@@ -0,0 +1,352 @@
+import asyncio
+import concurrent.futures
+import math
+import queue
+import threading
+import time
+
+from loguru import logger
+
+from xtts_api_server.metrics import QUEUE_WAIT_SECONDS
+
+# Marks the end of an iterator drained by InferenceExecutor.stream
+_DONE = object()
+
+
+class QueueFullError(Exception):
+    """ Raised when the admission queue is full; retry_after is a hint in seconds. """
+    def __init__(self, retry_after):
+        super().__init__(f"Inference queue is full, retry in {retry_after} seconds")
+        self.retry_after = retry_after
+
+
+class DeadlineExceededError(Exception):
+    """ Raised when a job's deadline passed before it reached an inference slot. """
+
+
+class _Job:
+    def __init__(self, fn, args, kwargs, deadline):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.deadline = deadline
+        self.future = concurrent.futures.Future()
+        self.submitted_at = time.monotonic()
+        # Set under the executor lock: taken by a worker, or dropped (expired or cancelled) while queued
+        self.started = False
+        self.dropped = False
+        self.timer = None
+
+
+class _Flight:
+    """ A running or queued job shared by every request with the same key. """
+    def __init__(self, job):
+        self.job = job
+        self.waiters = 1
+
+
+class InferenceExecutor:
+    """
+    Runs blocking model calls on a fixed number of slots fed by a queue.
+
+    Each slot is a worker thread that owns the model while it runs a job, so
+    async handlers can await synthesis without blocking the event loop.
+    """
+
+    def __init__(self, slots=1, max_queue=0):
+        self.slots = slots
+        self.max_queue = max_queue  # 0 means unbounded
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+
+        # Counters for queue wait measurement
+        self.pending = 0
+        self.active = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.expired = 0
+        self.total_wait = 0.0
+        self.last_wait = 0.0
+        self.max_wait = 0.0
+        self.coalesced = 0
+        # Moving average of job run time, used to estimate throughput
+        self.avg_service_time = None
+
+        # key -> _Flight for single-flight deduplication
+        self._inflight = {}
+
+        self._workers = []
+        for i in range(slots):
+            worker = threading.Thread(target=self._worker, name=f"inference-{i}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def submit(self, fn, *args, deadline=None, **kwargs):
+        """
+        Queues fn(*args, **kwargs) and returns a concurrent.futures.Future.
+
+        deadline is a time.monotonic() value; if the job is still queued when the
+        deadline passes it is dropped right away and the future fails with
+        DeadlineExceededError. Raises QueueFullError when the queue is full.
+        """
+        return self._enqueue(fn, args, kwargs, deadline).future
+
+    def _enqueue(self, fn, args, kwargs, deadline):
+        job = _Job(fn, args, kwargs, deadline)
+        with self._lock:
+            # Only jobs still waiting count, expired and cancelled ones left pending when they were dropped
+            if self.max_queue and self.pending >= self.max_queue:
+                self.rejected += 1
+                raise QueueFullError(self._retry_after())
+            self.pending += 1
+        job.future.add_done_callback(lambda future: self._cancelled(job, future))
+        if deadline is not None:
+            self._arm_timer(job)
+        self._queue.put(job)
+        return job
+
+    def _arm_timer(self, job):
+        delay = max(0.0, job.deadline - time.monotonic())
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        if loop is not None:
+            job.timer = loop.call_later(delay, self._expire, job)
+        else:
+            job.timer = threading.Timer(delay, self._expire, args=(job,))
+            job.timer.daemon = True
+            job.timer.start()
+
+    def _expire(self, job):
+        """ Fails a job whose deadline passed while it was still queued. """
+        with self._lock:
+            if job.started or job.dropped or job.deadline is None:
+                return
+            if time.monotonic() < job.deadline:
+                # A coalesced waiter extended the deadline
+                extended = True
+            else:
+                extended = False
+                job.dropped = True
+                self.pending -= 1
+                self.expired += 1
+        if extended:
+            self._arm_timer(job)
+            return
+        try:
+            job.future.set_exception(DeadlineExceededError("Request deadline passed while waiting in queue"))
+        except concurrent.futures.InvalidStateError:
+            # Cancelled meanwhile
+            pass
+
+    def _cancelled(self, job, future):
+        # A job all callers gave up on no longer counts as waiting
+        if not future.cancelled():
+            return
+        with self._lock:
+            if job.started or job.dropped:
+                return
+            job.dropped = True
+            self.pending -= 1
+
+    async def run(self, fn, *args, deadline=None, key=None, **kwargs):
+        """
+        Awaits fn(*args, **kwargs) executed on an inference slot.
+
+        Calls sharing a key while one of them is queued or running attach to
+        that job and all receive its result instead of running fn again.
+        """
+        if key is None:
+            return await asyncio.wrap_future(self.submit(fn, *args, deadline=deadline, **kwargs))
+
+        with self._lock:
+            flight = self._inflight.get(key)
+            if flight is not None:
+                flight.waiters += 1
+                self.coalesced += 1
+                # The shared job lives as long as its most patient waiter
+                if flight.job.deadline is not None:
+                    flight.job.deadline = None if deadline is None else max(deadline, flight.job.deadline)
+
+        if flight is None:
+            flight = _Flight(self._enqueue(fn, args, kwargs, deadline))
+            with self._lock:
+                self._inflight[key] = flight
+            flight.job.future.add_done_callback(lambda _: self._land(key, flight))
+
+        try:
+            # Shielded so one waiter giving up does not cancel the others
+            return await asyncio.shield(asyncio.wrap_future(flight.job.future))
+        except asyncio.CancelledError:
+            with self._lock:
+                flight.waiters -= 1
+                if flight.waiters == 0:
+                    flight.job.future.cancel()
+            raise
+
+    def _land(self, key, flight):
+        with self._lock:
+            if self._inflight.get(key) is flight:
+                del self._inflight[key]
+
+    def _retry_after(self):
+        # Seconds until the current backlog is expected to drain
+        if not self.avg_service_time:
+            return 1
+        backlog = self.pending + self.active
+        return max(1, math.ceil(backlog * self.avg_service_time / self.slots))
+
+    def stream(self, iterator, deadline=None):
+        """
+        Drains a blocking iterator on an inference slot.
+
+        The job is admitted immediately, so QueueFullError is raised here rather
+        than on first iteration. Returns an async generator of the items.
+        """
+        loop = asyncio.get_running_loop()
+        items = asyncio.Queue()
+        stop = threading.Event()
+
+        def drain():
+            error = None
+            try:
+                for item in iterator:
+                    if stop.is_set():
+                        break
+                    loop.call_soon_threadsafe(items.put_nowait, item)
+            except Exception as e:
+                error = e
+            finally:
+                if hasattr(iterator, "close"):
+                    iterator.close()
+                loop.call_soon_threadsafe(items.put_nowait, (_DONE, error))
+
+        def dropped(future):
+            # An expired job never reaches drain(), so report its error here
+            if not future.cancelled() and future.exception() is not None:
+                loop.call_soon_threadsafe(items.put_nowait, (_DONE, future.exception()))
+
+        future = self.submit(drain, deadline=deadline)
+        future.add_done_callback(dropped)
+        return self._consume(items, stop, future)
+
+    async def start_stream(self, iterator, deadline=None):
+        """
+        stream(), but waits until the job reached a slot and produced its first
+        item, so a deadline passing in the queue or an early error is raised here
+        rather than in the middle of a response that has already started.
+        """
+        items = self.stream(iterator, deadline)
+        try:
+            first = await items.__anext__()
+        except StopAsyncIteration:
+            first = _DONE
+        except BaseException:
+            await items.aclose()
+            raise
+        return self._resume(first, items)
+
+    async def _resume(self, first, items):
+        try:
+            if first is not _DONE:
+                yield first
+                async for item in items:
+                    yield item
+        finally:
+            await items.aclose()
+
+    async def _consume(self, items, stop, future):
+        try:
+            while True:
+                item = await items.get()
+                if isinstance(item, tuple) and len(item) == 2 and item[0] is _DONE:
+                    if item[1] is not None:
+                        raise item[1]
+                    break
+                yield item
+        finally:
+            stop.set()
+            future.cancel()
+
+    def stats(self):
+        with self._lock:
+            finished = self.completed + self.failed
+            return {
+                "slots": self.slots,
+                "pending": self.pending,
+                "active": self.active,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "expired": self.expired,
+                "coalesced": self.coalesced,
+                "max_queue": self.max_queue,
+                "avg_service_time": self.avg_service_time or 0.0,
+                "avg_wait": self.total_wait / finished if finished else 0.0,
+                "last_wait": self.last_wait,
+                "max_wait": self.max_wait,
+            }
+
+    def _worker(self):
+        while True:
+            job = self._queue.get()
+            now = time.monotonic()
+            with self._lock:
+                # Expired or cancelled while queued, already taken off pending
+                if job.dropped:
+                    continue
+                if job.deadline is not None and now > job.deadline:
+                    # The timer hasn't fired yet
+                    job.dropped = True
+                    self.pending -= 1
+                    self.expired += 1
+                    expired = True
+                else:
+                    job.started = True
+                    self.pending -= 1
+                    expired = False
+            if isinstance(job.timer, threading.Timer):
+                job.timer.cancel()
+            if expired:
+                # A waiter may have cancelled it meanwhile, failing a finished future would kill this worker
+                try:
+                    job.future.set_exception(DeadlineExceededError("Request deadline passed while waiting in queue"))
+                except concurrent.futures.InvalidStateError:
+                    pass
+                continue
+
+            # The caller gave up between the checks above and now
+            if not job.future.set_running_or_notify_cancel():
+                continue
+
+            wait = now - job.submitted_at
+            with self._lock:
+                self.active += 1
+                self.total_wait += wait
+                self.last_wait = wait
+                self.max_wait = max(self.max_wait, wait)
+            QUEUE_WAIT_SECONDS.observe(wait)
+            logger.debug(f"Inference job started after waiting {wait:.2f} seconds in queue")
+
+            started = time.monotonic()
+            try:
+                result = job.fn(*job.args, **job.kwargs)
+            except BaseException as e:
+                with self._lock:
+                    self.active -= 1
+                    self.failed += 1
+                job.future.set_exception(e)
+            else:
+                with self._lock:
+                    self.active -= 1
+                    self.completed += 1
+                    self._record_service_time(time.monotonic() - started)
+                job.future.set_result(result)
+
+    def _record_service_time(self, elapsed):
+        if self.avg_service_time is None:
+            self.avg_service_time = elapsed
+        else:
+            self.avg_service_time = 0.8 * self.avg_service_time + 0.2 * elapsed
@@ -0,0 +1,127 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+def latents_nbytes(latents):
+    """ Size of a tensor or of nested tuples of tensors, such as a per-layer KV cache. """
+    if isinstance(latents, (tuple, list)):
+        return sum(latents_nbytes(t) for t in latents)
+    return latents.element_size() * latents.nelement()
+
+
+class LatentsCache:
+    """
+    In-memory speaker latents with a memory budget.
+
+    Keys identify the reference audio itself (not the speaker name), so changing
+    the speaker folder never serves stale latents. When the cache grows past
+    max_bytes the least recently used speakers are dropped. A missing entry is
+    computed once, concurrent callers for the same key wait for that result.
+    Pinned keys, the voices in highest demand, are never evicted.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (latents, size in bytes), oldest first
+        self._pending = {}  # key -> Future of an entry being computed
+        self._pinned = set()  # keys that are never evicted
+        self._lock = threading.Lock()
+
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.computations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def has_room(self):
+        return self.total_bytes < self.max_bytes
+
+    def is_pinned(self, key):
+        return key in self._pinned
+
+    def set_pinned(self, keys):
+        """ Replaces the set of keys kept in memory regardless of recency. """
+        with self._lock:
+            self._pinned = set(keys)
+            self._evict()
+
+    def get_or_create(self, key, create):
+        """ Returns the latents for key, calling create() if nobody else is already doing it. """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key][0]
+
+            self.misses += 1
+            future = self._pending.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._pending[key] = future
+
+        if not owner:
+            return future.result()
+
+        try:
+            latents = create()
+        except BaseException as e:
+            with self._lock:
+                del self._pending[key]
+            future.set_exception(e)
+            raise
+
+        with self._lock:
+            del self._pending[key]
+            self.computations += 1
+            self._put(key, latents)
+        future.set_result(latents)
+        return latents
+
+    def _put(self, key, latents):
+        if key in self._entries:
+            self.total_bytes -= self._entries.pop(key)[1]
+        size = latents_nbytes(latents)
+        self._entries[key] = (latents, size)
+        self.total_bytes += size
+        self._evict(keep=key)
+
+    def _evict(self, keep=None):
+        # Pinned entries and the one just added stay, even if that leaves the cache over budget
+        if self.total_bytes <= self.max_bytes:
+            return
+        for key in list(self._entries):
+            if self.total_bytes <= self.max_bytes:
+                break
+            if key in self._pinned or key == keep:
+                continue
+            self.total_bytes -= self._entries.pop(key)[1]
+            self.evictions += 1
+
+    def discard(self, key):
+        with self._lock:
+            if key in self._entries:
+                self.total_bytes -= self._entries.pop(key)[1]
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "computations": self.computations,
+                "computing": len(self._pending),
+                "pinned": len(self._pinned & self._entries.keys()),
+            }
@@ -0,0 +1,195 @@
+import hashlib
+import json
+import mmap
+import os
+import threading
+
+import numpy as np
+import torch
+from loguru import logger
+
+
+class LatentsStore:
+    """
+    Speaker conditioning latents of the whole voice library, packed in one file.
+
+    latents.bin holds fp16 records back to back and latents.json maps each key
+    (reference audio content hash and model version) to its record's offset and
+    tensor shapes. The data file is memory mapped, so a lookup returns views
+    into the page cache; they are only upcast and copied to the device when the
+    speaker is used. Records are appended; the space of replaced and discarded
+    ones is reclaimed by compacting once it outweighs the live records, when the
+    store is opened or saved. The index is saved at most every save_delay
+    seconds; records appended after the last save are orphaned by a crash and
+    their latents are simply created again.
+    """
+
+    def __init__(self, folder, model_version, save_delay=2.0):
+        self.folder = folder
+        self.model_version = model_version
+        self.data_path = os.path.join(folder, "latents.bin")
+        self.index_path = os.path.join(folder, "latents.json")
+
+        self._index = {}  # key -> [offset, gpt_cond_latent shape, speaker_embedding shape]
+        self._mmap = None
+        self._mapped_size = 0
+        self._data_size = 0
+        self._live_size = 0
+        self._lock = threading.Lock()
+        self.save_delay = save_delay
+        self._dirty = False
+        self._save_timer = None
+
+        os.makedirs(self.folder, exist_ok=True)
+
+    def make_key(self, speaker_hash):
+        return hashlib.sha256(f"{self.model_version}:{speaker_hash}".encode()).hexdigest()
+
+    @staticmethod
+    def _record_size(gpt_shape, embedding_shape):
+        return (int(np.prod(gpt_shape)) + int(np.prod(embedding_shape))) * 2
+
+    def open(self):
+        """ Loads the index, compacting the data file first if needed. Run it off the event loop. """
+        data_size = os.path.getsize(self.data_path) if os.path.exists(self.data_path) else 0
+        try:
+            with open(self.index_path, encoding="utf-8") as f:
+                index = json.load(f)
+        except FileNotFoundError:
+            index = {}
+        except ValueError as e:
+            logger.warning(f"Latents index {self.index_path} is unreadable, starting over: {e}")
+            index = {}
+
+        # Drop records that point past the data file, e.g. after a crash between the two writes
+        self._index = {
+            key: entry for key, entry in index.items()
+            if entry[0] + self._record_size(entry[1], entry[2]) <= data_size
+        }
+
+        self._data_size = data_size
+        self._live_size = sum(self._record_size(e[1], e[2]) for e in self._index.values())
+        if self._needs_compaction():
+            self._compact()
+        self._remap()
+
+        if self._index:
+            logger.info(f"Latents store: {len(self._index)} speakers, {self._live_size / 2**20:.1f} MB")
+
+    def _needs_compaction(self):
+        return self._data_size > 2 * self._live_size
+
+    def _remap(self):
+        # Views handed out keep the previous map alive until they are released
+        size = os.path.getsize(self.data_path) if os.path.exists(self.data_path) else 0
+        if size == 0:
+            self._mmap, self._mapped_size = None, 0
+            return
+        with open(self.data_path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._mapped_size = size
+
+    def _compact(self):
+        """ Rewrites the data file with live records only. """
+        tmp_path = self.data_path + ".tmp"
+        index = {}
+        with open(self.data_path, "rb") as src, open(tmp_path, "wb") as dst:
+            for key, (offset, gpt_shape, embedding_shape) in self._index.items():
+                src.seek(offset)
+                index[key] = [dst.tell(), gpt_shape, embedding_shape]
+                dst.write(src.read(self._record_size(gpt_shape, embedding_shape)))
+        os.replace(tmp_path, self.data_path)
+        self._index = index
+        self._data_size = self._live_size
+        self._save_index()
+
+    def _save_index(self):
+        self._dirty = False
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._index, f)
+        os.replace(tmp_path, self.index_path)
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, speaker_hash):
+        return self.make_key(speaker_hash) in self._index
+
+    def get(self, speaker_hash):
+        """ Returns fp16 (gpt_cond_latent, speaker_embedding) views into the mapped file, or None. """
+        key = self.make_key(speaker_hash)
+        with self._lock:
+            entry = self._index.get(key)
+            if entry is None:
+                return None
+            offset, gpt_shape, embedding_shape = entry
+            if offset + self._record_size(gpt_shape, embedding_shape) > self._mapped_size:
+                # Appended after the file was mapped
+                self._remap()
+            buffer = self._mmap
+
+        gpt_count = int(np.prod(gpt_shape))
+        embedding_count = int(np.prod(embedding_shape))
+        gpt_cond_latent = np.frombuffer(buffer, dtype=np.float16, count=gpt_count, offset=offset)
+        speaker_embedding = np.frombuffer(buffer, dtype=np.float16, count=embedding_count, offset=offset + gpt_count * 2)
+        return gpt_cond_latent.reshape(gpt_shape), speaker_embedding.reshape(embedding_shape)
+
+    def load(self, speaker_hash, device):
+        """ Stored latents upcast to float32 on device, or None. """
+        stored = self.get(speaker_hash)
+        if stored is None:
+            return None
+        return tuple(torch.from_numpy(view.astype(np.float32)).to(device) for view in stored)
+
+    def put(self, speaker_hash, gpt_cond_latent, speaker_embedding):
+        self._append(self.make_key(speaker_hash), gpt_cond_latent, speaker_embedding)
+        with self._lock:
+            self._schedule_save()
+
+    def discard(self, speaker_hash):
+        """ Forgets a speaker's latents, their space is reclaimed by a later compaction. """
+        with self._lock:
+            entry = self._index.pop(self.make_key(speaker_hash), None)
+            if entry is None:
+                return
+            self._live_size -= self._record_size(entry[1], entry[2])
+            self._schedule_save()
+
+    def _schedule_save(self):
+        self._dirty = True
+        # Saving per record would rewrite the whole index for every speaker of a large library
+        if self._save_timer is None:
+            self._save_timer = threading.Timer(self.save_delay, self.flush)
+            self._save_timer.daemon = True
+            self._save_timer.start()
+
+    def flush(self):
+        """ Saves the index if records were added or discarded since the last save. """
+        with self._lock:
+            if self._save_timer is not None:
+                self._save_timer.cancel()
+                self._save_timer = None
+            if not self._dirty:
+                return
+            if self._needs_compaction():
+                self._compact()
+                # Views handed out keep reading the replaced file
+                self._remap()
+            else:
+                self._save_index()
+
+    def _append(self, key, gpt_cond_latent, speaker_embedding):
+        gpt = gpt_cond_latent.detach().cpu().to(torch.float16).numpy()
+        embedding = speaker_embedding.detach().cpu().to(torch.float16).numpy()
+        with self._lock:
+            with open(self.data_path, "ab") as f:
+                offset = f.tell()
+                f.write(gpt.tobytes())
+                f.write(embedding.tobytes())
+                self._data_size = f.tell()
+            replaced = self._index.get(key)
+            if replaced is not None:
+                self._live_size -= self._record_size(replaced[1], replaced[2])
+            self._index[key] = [offset, list(gpt.shape), list(embedding.shape)]
+            self._live_size += self._record_size(gpt.shape, embedding.shape)
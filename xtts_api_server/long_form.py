@@ -0,0 +1,54 @@
+import numpy as np
+
+
+def pack_sentences(sentences, max_chars):
+    """ Groups consecutive sentences into segments of up to max_chars; a longer sentence stays whole. """
+    segments = []
+    current = ""
+    for sentence in sentences:
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+        if current and len(current) + 1 + len(sentence) > max_chars:
+            segments.append(current)
+            current = sentence
+        else:
+            current = f"{current} {sentence}" if current else sentence
+    if current:
+        segments.append(current)
+    return segments
+
+
+class Crossfader:
+    """
+    Joins separately synthesized segments with a short equal-power crossfade.
+
+    The last overlap samples of each segment are held back until the next one
+    arrives and are blended with its start, so everything before them can be
+    written out as soon as its segment is done.
+    """
+
+    def __init__(self, overlap):
+        self.overlap = overlap
+        self._tail = None
+
+    def push(self, wav):
+        """ Adds the next segment, returns the samples that are final. """
+        wav = np.asarray(wav, dtype=np.float32)
+        parts = []
+        if self._tail is not None and len(self._tail):
+            n = min(len(self._tail), len(wav))
+            ramp = np.linspace(0, np.pi / 2, n, dtype=np.float32)
+            parts.append(self._tail[: len(self._tail) - n])
+            parts.append(self._tail[len(self._tail) - n :] * np.cos(ramp) + wav[:n] * np.sin(ramp))
+            wav = wav[n:]
+
+        keep = min(self.overlap, len(wav))
+        parts.append(wav[: len(wav) - keep])
+        self._tail = wav[len(wav) - keep :]
+        return np.concatenate(parts)
+
+    def finish(self):
+        tail = self._tail if self._tail is not None else np.zeros(0, dtype=np.float32)
+        self._tail = None
+        return tail
@@ -0,0 +1,178 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Minimal Prometheus text exposition, so /metrics needs no extra dependency
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    pairs = ",".join(f'{name}="{str(value)}"' for name, value in labels)
+    return "{" + pairs + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class Counter:
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self.type = "counter"
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1.0, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, value) for key, value in self._values.items()]
+
+
+class Histogram:
+    def __init__(self, name, documentation, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.type = "histogram"
+        self.buckets = tuple(buckets) + (float("inf"),)
+        self._values = {}  # labels -> [bucket counts, sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            counts, total, count = self._values.get(key, ([0] * len(self.buckets), 0.0, 0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value, count + 1)
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, (counts, total, count) in self._values.items():
+                for bound, bucket_count in zip(self.buckets, counts):
+                    samples.append((f"{self.name}_bucket", key + (("le", _format_value(bound)),), bucket_count))
+                samples.append((f"{self.name}_sum", key, total))
+                samples.append((f"{self.name}_count", key, count))
+        return samples
+
+
+class Gauge:
+    """ Value read at scrape time; fn returns a number or a {labels tuple: number} dict. """
+
+    def __init__(self, name, documentation, fn, type="gauge"):
+        self.name = name
+        self.documentation = documentation
+        self.type = type
+        self.fn = fn
+
+    def samples(self):
+        value = self.fn()
+        if value is None:
+            return []
+        if isinstance(value, dict):
+            return [(self.name, tuple(sorted(labels)), v) for labels, v in value.items()]
+        return [(self.name, (), value)]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+
+    def gauge(self, name, documentation, fn, type="gauge"):
+        return self.register(Gauge(name, documentation, fn, type))
+
+    def render(self):
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            try:
+                samples = metric.samples()
+            except Exception:
+                # A failing collector must not break the whole scrape
+                continue
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, labels, value in samples:
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "xtts_stage_seconds",
+    "Time spent per synthesis stage (text_cleaning, latents, reference_decoding, gpt, vocoder, encoding, io).",
+))
+SYNTHESIS_SECONDS = REGISTRY.register(Histogram(
+    "xtts_synthesis_seconds",
+    "Total model time per synthesis request.",
+))
+REAL_TIME_FACTOR = REGISTRY.register(Histogram(
+    "xtts_real_time_factor",
+    "Processing time divided by generated audio duration.",
+    buckets=(0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 5.0),
+))
+AUDIO_SECONDS = REGISTRY.register(Counter(
+    "xtts_audio_seconds_total",
+    "Seconds of audio generated.",
+))
+QUEUE_WAIT_SECONDS = REGISTRY.register(Histogram(
+    "xtts_queue_wait_seconds",
+    "Time a job waited for an inference slot.",
+))
+
+
+@contextmanager
+def timed(stage):
+    """ Observes the duration of the block in xtts_stage_seconds. """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage=stage)
+
+
+def observe_synthesis(elapsed, audio_seconds):
+    SYNTHESIS_SECONDS.observe(elapsed)
+    if audio_seconds > 0:
+        AUDIO_SECONDS.inc(audio_seconds)
+        REAL_TIME_FACTOR.observe(elapsed / audio_seconds)
+
+
+def process_rss_bytes():
+    """ Resident set size of this process, the peak RSS where /proc is unavailable. """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        # Windows
+        return None
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if os.uname().sysname == "Darwin" else rss * 1024
+
+
+REGISTRY.gauge("process_resident_memory_bytes", "Resident memory size in bytes.", process_rss_bytes)
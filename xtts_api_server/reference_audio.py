@@ -0,0 +1,233 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import torch
+import torchaudio
+
+from xtts_api_server.metrics import timed
+
+
+def file_sha256(path):
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+@torch.inference_mode()
+def conditioning_latents(model, audios, sample_rate, gpt_cond_len=6, gpt_cond_chunk_len=6):
+    """ Xtts.get_conditioning_latents for references that are already loaded as (1, samples) tensors. """
+    speaker_embeddings = [model.get_speaker_embedding(audio, sample_rate) for audio in audios]
+    full_audio = torch.cat(audios, dim=-1)
+    gpt_cond_latent = model.get_gpt_cond_latents(full_audio, sample_rate, length=gpt_cond_len, chunk_length=gpt_cond_chunk_len)
+    speaker_embedding = torch.stack(speaker_embeddings).mean(dim=0)
+    return gpt_cond_latent, speaker_embedding
+
+
+@torch.inference_mode()
+def speaker_embedding(model, audio, sample_rate):
+    return model.get_speaker_embedding(audio, sample_rate)
+
+
+@torch.inference_mode()
+def gpt_cond_latent(model, audio, sample_rate, gpt_cond_len=6, gpt_cond_chunk_len=6):
+    return model.get_gpt_cond_latents(audio, sample_rate, length=gpt_cond_len, chunk_length=gpt_cond_chunk_len)
+
+
+class SpeakerEmbeddingCache:
+    """
+    Speaker embeddings per reference file.
+
+    XTTS averages the embeddings of a speaker's files, so a multi-sample speaker
+    only needs embeddings for the files it hasn't seen before. Entries are tiny
+    .npy files keyed by the file's content hash, the model version and the
+    reference length, and stay in memory once read.
+    """
+
+    def __init__(self, folder, model_version):
+        self.folder = folder
+        self.model_version = model_version
+        self._entries = {}
+        self._lock = threading.Lock()
+        os.makedirs(self.folder, exist_ok=True)
+
+    def _path(self, file_hash, max_seconds):
+        return os.path.join(self.folder, f"{file_hash}_{self.model_version}_{max_seconds}s.npy")
+
+    def get(self, file_hash, max_seconds):
+        """ Returns the embedding as a CPU tensor, or None. """
+        path = self._path(file_hash, max_seconds)
+        with self._lock:
+            if path in self._entries:
+                return self._entries[path]
+        try:
+            embedding = torch.from_numpy(np.load(path))
+        except (FileNotFoundError, ValueError):
+            return None
+        with self._lock:
+            self._entries[path] = embedding
+        return embedding
+
+    def put(self, file_hash, max_seconds, embedding):
+        path = self._path(file_hash, max_seconds)
+        embedding = embedding.detach().cpu()
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, embedding.numpy())
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._entries[path] = embedding
+
+
+class ReferenceAudioCache:
+    """
+    Reference wavs decoded once into mono float32 at the conditioning sample rate.
+
+    Each file is resampled, downmixed, clipped and cut to max_seconds the way
+    XTTS loads references, then saved as a .npy named after its content hash.
+    Later reads memory map that array, so computing latents again (for another
+    model version, or after the latents were evicted) skips decoding entirely.
+    The arrays on disk are bounded by max_bytes, the least recently used go
+    first; 0 keeps none.
+    """
+
+    def __init__(self, folder, sample_rate=22050, max_seconds=30, max_bytes=1024 * 2**20):
+        self.folder = folder
+        self.sample_rate = sample_rate
+        # The longest reference length read: 30 s for the local model, 60 s in streaming mode
+        self.max_seconds = max_seconds
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # file hash -> size in bytes, oldest first
+        self._lock = threading.Lock()
+        self.total_bytes = 0
+        self.evictions = 0
+        os.makedirs(self.folder, exist_ok=True)
+        self._load()
+
+    def _suffix(self):
+        # Caches of different lengths, the server's and the streaming engine's, share the folder
+        return f"_{self.sample_rate}_{self.max_seconds}s.npy"
+
+    def _path(self, file_hash):
+        return os.path.join(self.folder, file_hash + self._suffix())
+
+    def _load(self):
+        """ Indexes arrays left by a previous run, oldest access first. """
+        suffix = self._suffix()
+        files = []
+        with os.scandir(self.folder) as it:
+            for entry in it:
+                if entry.is_file() and entry.name.endswith(suffix):
+                    stat = entry.stat()
+                    files.append((stat.st_atime, entry.name[: -len(suffix)], stat.st_size))
+        with self._lock:
+            for _, file_hash, size in sorted(files):
+                self._add(file_hash, size)
+            self._evict()
+
+    def _add(self, file_hash, size):
+        self.total_bytes -= self._entries.pop(file_hash, 0)
+        self._entries[file_hash] = size
+        self.total_bytes += size
+
+    def _evict(self):
+        while self.total_bytes > self.max_bytes and self._entries:
+            file_hash, size = self._entries.popitem(last=False)
+            self.total_bytes -= size
+            self.evictions += 1
+            try:
+                # Arrays mapped at the moment stay readable
+                os.remove(self._path(file_hash))
+            except FileNotFoundError:
+                pass
+
+    def discard(self, file_hash):
+        """ Removes a file's array, e.g. once no speaker uses the file anymore. """
+        with self._lock:
+            size = self._entries.pop(file_hash, None)
+            if size is None:
+                return
+            self.total_bytes -= size
+            try:
+                os.remove(self._path(file_hash))
+            except FileNotFoundError:
+                pass
+
+    def get(self, path, file_hash=None):
+        """ Returns the preprocessed audio of path as a read-only memory-mapped array. """
+        file_hash = file_hash or file_sha256(path)
+        array_path = self._path(file_hash)
+        try:
+            audio = np.load(array_path, mmap_mode="r")
+        except (FileNotFoundError, ValueError):
+            audio = None
+        if audio is not None:
+            with self._lock:
+                if file_hash in self._entries:
+                    self._entries.move_to_end(file_hash)
+                else:
+                    # Written by another process since the folder was indexed
+                    self._add(file_hash, audio.offset + audio.nbytes)
+                    self._evict()
+            return audio
+
+        with timed("reference_decoding"):
+            audio = self.decode(path)
+        if audio.nbytes > self.max_bytes:
+            return audio
+        tmp_path = f"{array_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, audio)
+            size = f.tell()
+        os.replace(tmp_path, array_path)
+        with self._lock:
+            self._add(file_hash, size)
+            self._evict()
+        return audio
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+                "evictions": self.evictions,
+            }
+
+    def load(self, path, max_seconds, device="cpu", file_hash=None):
+        """ Preprocessed reference audio cut to max_seconds, as a (1, samples) tensor on device. """
+        audio = np.array(self.get(path, file_hash)[: self.sample_rate * max_seconds])
+        return torch.from_numpy(audio).unsqueeze(0).to(device)
+
+    def load_prefix(self, paths, max_seconds, prefix_seconds, device="cpu", file_hashes=None):
+        """
+        The first prefix_seconds of the references concatenated, each cut to max_seconds first.
+
+        Only the arrays that contribute to the prefix are read.
+        """
+        file_hashes = file_hashes or [None] * len(paths)
+        needed = self.sample_rate * prefix_seconds if prefix_seconds > 0 else None
+        parts = []
+        total = 0
+        for path, file_hash in zip(paths, file_hashes):
+            if needed is not None and total >= needed:
+                break
+            audio = self.get(path, file_hash)[: self.sample_rate * max_seconds]
+            if needed is not None:
+                audio = audio[: needed - total]
+            parts.append(np.array(audio))
+            total += len(audio)
+        return torch.from_numpy(np.concatenate(parts)).unsqueeze(0).to(device)
+
+    def decode(self, path):
+        audio, sample_rate = torchaudio.load(path)
+        if audio.size(0) != 1:
+            audio = torch.mean(audio, dim=0, keepdim=True)
+        if sample_rate != self.sample_rate:
+            audio = torchaudio.functional.resample(audio, sample_rate, self.sample_rate)
+        audio = audio[0, : self.sample_rate * self.max_seconds].clamp(-1, 1)
+        return audio.numpy().astype(np.float32)
@@ -1,32 +1,56 @@
 from TTS.api import TTS
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Query, WebSocket, WebSocketDisconnect, UploadFile, File, Form
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse,StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse,StreamingResponse,Response,PlainTextResponse,JSONResponse
 
 from pydantic import BaseModel
+from typing import List, Optional
 import uvicorn
 
 import os
 import time
+import asyncio
+import queue
+import threading
 from pathlib import Path
 import shutil
+import zipfile
+import stream2sentence as s2s
 from loguru import logger
 from argparse import ArgumentParser
 from pathlib import Path
 
 from xtts_api_server.tts_funcs import TTSWrapper,supported_languages
+from xtts_api_server.inference_executor import InferenceExecutor, QueueFullError, DeadlineExceededError
+from xtts_api_server.metrics import REGISTRY, timed
+from xtts_api_server.audio_formats import EncoderPool, StreamEncoder, negotiate_format, format_from_path, media_type, stream_format, FORMATS
 from xtts_api_server.RealtimeTTS import TextToAudioStream, CoquiEngine
-from xtts_api_server.modeldownloader import check_stream2sentence_version,install_deepspeed_based_on_python_version
+from xtts_api_server.modeldownloader import check_stream2sentence_version,check_tts_version,install_deepspeed_based_on_python_version
 
 # Default Folders , you can change them via API
 DEVICE = os.getenv('DEVICE',"cuda")
 OUTPUT_FOLDER = os.getenv('OUTPUT', 'output')
 SPEAKER_FOLDER = os.getenv('SPEAKER', 'speakers')
+CACHE_FOLDER = os.getenv('CACHE', 'cache')
 BASE_URL = os.getenv('BASE_URL', '127.0.0.1:8020')
 MODEL_SOURCE = os.getenv("MODEL_SOURCE", "local")
 MODEL_VERSION = os.getenv("MODEL_VERSION","2.0.2")
 LOWVRAM_MODE = os.getenv("LOWVRAM_MODE") == 'true'
 DEEPSPEED = os.getenv("DEEPSPEED") == 'true'
+MAX_QUEUE_SIZE = int(os.getenv("MAX_QUEUE_SIZE", "32"))
+AUDIO_CACHE_SIZE = int(os.getenv("AUDIO_CACHE_SIZE", "512")) # In MB, 0 disables the audio cache
+LATENTS_CACHE_SIZE = int(os.getenv("LATENTS_CACHE_SIZE", "256")) # In MB, memory budget for speaker latents
+PREFIX_CACHE_SIZE = int(os.getenv("PREFIX_CACHE_SIZE", "64")) # In MB, memory budget for the batched GPT's speaker prefixes
+REFERENCE_CACHE_SIZE = int(os.getenv("REFERENCE_CACHE_SIZE", "1024")) # In MB, decoded reference audio kept on disk
+LATENTS_WORKERS = int(os.getenv("LATENTS_WORKERS", "2")) # Threads creating speaker latents in the background
+PINNED_SPEAKERS = int(os.getenv("PINNED_SPEAKERS", "16")) # Most requested speakers kept in memory
+GPT_BATCH_SIZE = int(os.getenv("GPT_BATCH_SIZE", "1")) # Sentences decoded together by the GPT, 1 disables batching
+VOCODER_BATCH_WINDOW = float(os.getenv("VOCODER_BATCH_WINDOW", "5")) # Milliseconds stream chunks wait to be vocoded together
+MODEL_REPLICAS = int(os.getenv("MODEL_REPLICAS", "1")) # Model copies that synthesize segments of long texts in parallel
+LONG_FORM_CHARS = int(os.getenv("LONG_FORM_CHARS", "1000")) # Longer /tts_to_file texts are synthesized in parallel segments
+ENCODER_WORKERS = int(os.getenv("ENCODER_WORKERS", "2"))
+MODEL_LOAD_WAIT = float(os.getenv("MODEL_LOAD_WAIT", "30")) # Seconds a request waits for the model while it loads
 # STREAMING VARS
 STREAM_MODE = os.getenv("STREAM_MODE") == 'true'
 STREAM_MODE_IMPROVE = os.getenv("STREAM_MODE_IMPROVE") == 'true'
@@ -41,7 +65,14 @@ if(not MODEL_SOURCE == "local" and DEEPSPEED and not STREAM_MODE and not STREAM_
 
 # Create an instance of the TTSWrapper class and server
 app = FastAPI()
-XTTS = TTSWrapper(OUTPUT_FOLDER,SPEAKER_FOLDER,LOWVRAM_MODE,MODEL_SOURCE,MODEL_VERSION,DEVICE,DEEPSPEED)
+XTTS = TTSWrapper(OUTPUT_FOLDER,SPEAKER_FOLDER,LOWVRAM_MODE,MODEL_SOURCE,MODEL_VERSION,DEVICE,DEEPSPEED,CACHE_FOLDER,AUDIO_CACHE_SIZE * 2**20,LATENTS_CACHE_SIZE * 2**20,LATENTS_WORKERS,PINNED_SPEAKERS,1 if STREAM_MODE or STREAM_MODE_IMPROVE else GPT_BATCH_SIZE,VOCODER_BATCH_WINDOW / 1000,MODEL_REPLICAS,LONG_FORM_CHARS,PREFIX_CACHE_SIZE * 2**20,REFERENCE_CACHE_SIZE * 2**20)
+
+# Blocking synthesis runs here so the event loop stays free for lightweight endpoints.
+# The model keeps per-call state (the cached GPT prefix), so there is one slot per loaded model,
+# unless GPT decoding is batched: then every slot feeds the batcher and up to a batch runs at once.
+EXECUTOR = InferenceExecutor(slots=XTTS.gpt_batch_size, max_queue=MAX_QUEUE_SIZE)
+# Compressing audio happens on its own workers so it never holds a model slot
+ENCODERS = EncoderPool(ENCODER_WORKERS)
 
 # Create version string
 version_string = ""
@@ -53,26 +84,116 @@ else:
 if MODEL_SOURCE == "api" and MODEL_SOURCE != "2.0.2":
     logger.warning("Attention you have specified flag -v but you have selected --model-source api, please change --model-souce to apiManual or local to use the specified version, otherwise the latest version of the model will be loaded.")
 
-# Load model
-# logger.info(f"The model {version_string} starts to load,wait until it loads")
-if STREAM_MODE or STREAM_MODE_IMPROVE:
-    # Load model for Streaming
-    check_stream2sentence_version()
-
-    logger.warning("'Streaming Mode' has certain limitations, you can read about them here https://github.com/daswer123/xtts-api-server#about-streaming-mode")
-
-    if STREAM_MODE_IMPROVE:
-        logger.info("You launched an improved version of streaming, this version features an improved tokenizer and more context when processing sentences, which can be good for complex languages like Chinese")
-        
-    logger.info("Load model for Streaming")
+def load_models():
+    """ Loads the model in the background so the server answers /health and /ready meanwhile. """
+    global engine, stream, LOAD_ERROR
+    start_time = time.time()
+    try:
+        logger.info(f"The model {version_string} starts to load, requests will wait until it loads")
+        check_tts_version()
+        XTTS.speaker_index.load()
+        # Compacting the latents store can take a while with a large library, so it happens here and not at import
+        XTTS.load_progress["stage"] = "opening_latents_store"
+        XTTS.latents_store.open()
+        if STREAM_MODE or STREAM_MODE_IMPROVE:
+            # Load model for Streaming
+            check_stream2sentence_version()
+
+            logger.warning("'Streaming Mode' has certain limitations, you can read about them here https://github.com/daswer123/xtts-api-server#about-streaming-mode")
+
+            if STREAM_MODE_IMPROVE:
+                logger.info("You launched an improved version of streaming, this version features an improved tokenizer and more context when processing sentences, which can be good for complex languages like Chinese")
+                
+            logger.info("Load model for Streaming")
+            XTTS.load_progress["stage"] = "loading_model"
 
-    this_dir = Path(__file__).parent.resolve()
-    model_path = this_dir / "models"
-    
-    engine = CoquiEngine(specific_model=MODEL_VERSION,use_deepspeed=DEEPSPEED,local_models_path=str(model_path))
-    stream = TextToAudioStream(engine)
-else:
-  XTTS.load_model() 
+            this_dir = Path(__file__).parent.resolve()
+            model_path = this_dir / "models"
+            
+            engine = CoquiEngine(specific_model=MODEL_VERSION,use_deepspeed=DEEPSPEED,local_models_path=str(model_path),reference_cache_path=os.path.join(CACHE_FOLDER, "reference"),reference_cache_size=REFERENCE_CACHE_SIZE * 2**20)
+            stream = TextToAudioStream(engine)
+            XTTS.load_progress["stage"] = "ready"
+        else:
+            XTTS.load_model()
+        LOAD_TIMES["load_seconds"] = time.time() - start_time
+        MODEL_READY.set()
+    except Exception as e:
+        LOAD_ERROR = str(e)
+        XTTS.load_progress["stage"] = "failed"
+        logger.exception("Model loading failed")
+
+# Set once the model is loaded, latents are created and the warm-up ran
+MODEL_READY = threading.Event()
+LOAD_ERROR = None
+LOAD_TIMES = {"started": time.time(), "load_seconds": None}
+
+@app.on_event("startup")
+def start_model_loading():
+    threading.Thread(target=load_models, name="model-loader", daemon=True).start()
+
+@app.on_event("shutdown")
+def save_state():
+    XTTS.usage.save()
+    XTTS.latents_store.flush()
+
+def get_readiness():
+    if MODEL_READY.is_set():
+        status = "ready"
+    elif LOAD_ERROR is not None:
+        status = "failed"
+    else:
+        status = "loading"
+    readiness = {
+        "status": status,
+        **XTTS.get_load_progress(),
+        "uptime": round(time.time() - LOAD_TIMES["started"], 1),
+        "load_seconds": LOAD_TIMES["load_seconds"],
+    }
+    if LOAD_ERROR is not None:
+        readiness["error"] = LOAD_ERROR
+    return readiness
+
+async def wait_until_ready(deadline=None):
+    """
+    Waits up to MODEL_LOAD_WAIT seconds (or the request deadline if shorter)
+    for the model, then gives up with 503 and the loading progress.
+    """
+    if MODEL_READY.is_set():
+        return
+    timeout = MODEL_LOAD_WAIT if deadline is None else min(deadline, MODEL_LOAD_WAIT)
+    end = time.monotonic() + timeout
+    while not MODEL_READY.is_set() and LOAD_ERROR is None and time.monotonic() < end:
+        await asyncio.sleep(0.1)
+    if not MODEL_READY.is_set():
+        raise HTTPException(status_code=503, detail=get_readiness(), headers={"Retry-After": "5"})
+
+# Metrics read at scrape time
+REGISTRY.gauge("xtts_queue_pending", "Synthesis jobs waiting for an inference slot.", lambda: EXECUTOR.stats()["pending"])
+REGISTRY.gauge("xtts_queue_active", "Synthesis jobs running on an inference slot.", lambda: EXECUTOR.stats()["active"])
+REGISTRY.gauge("xtts_queue_rejected_total", "Requests rejected because the queue was full.", lambda: EXECUTOR.stats()["rejected"], type="counter")
+REGISTRY.gauge("xtts_queue_expired_total", "Queued jobs dropped after their deadline.", lambda: EXECUTOR.stats()["expired"], type="counter")
+REGISTRY.gauge("xtts_queue_coalesced_total", "Requests attached to an identical in-flight synthesis.", lambda: EXECUTOR.stats()["coalesced"], type="counter")
+REGISTRY.gauge("xtts_audio_cache_hits_total", "Audio cache hits.", lambda: XTTS.get_cache_stats().get("hits"), type="counter")
+REGISTRY.gauge("xtts_audio_cache_misses_total", "Audio cache misses.", lambda: XTTS.get_cache_stats().get("misses"), type="counter")
+REGISTRY.gauge("xtts_audio_cache_hit_ratio", "Audio cache hit ratio.", lambda: XTTS.get_cache_stats().get("hit_rate"))
+REGISTRY.gauge("xtts_audio_cache_bytes", "Size of the audio cache on disk.", lambda: XTTS.get_cache_stats().get("bytes"))
+REGISTRY.gauge("xtts_latents_cache_entries", "Speakers with cached latents.", lambda: len(XTTS.latents_cache))
+REGISTRY.gauge("xtts_latents_cache_bytes", "Memory held by cached speaker latents.", XTTS.get_latents_cache_bytes)
+REGISTRY.gauge("xtts_latents_store_speakers", "Speakers with latents in the on-disk store.", lambda: len(XTTS.latents_store))
+REGISTRY.gauge("xtts_latents_cache_hits_total", "Speaker latents cache hits.", lambda: XTTS.latents_cache.hits, type="counter")
+REGISTRY.gauge("xtts_latents_cache_misses_total", "Speaker latents cache misses.", lambda: XTTS.latents_cache.misses, type="counter")
+REGISTRY.gauge("xtts_latents_cache_evictions_total", "Speakers evicted from the latents cache.", lambda: XTTS.latents_cache.evictions, type="counter")
+REGISTRY.gauge("xtts_gpt_batch_running", "Sentences in the batched GPT decode.", lambda: XTTS.get_batching_stats().get("running"))
+REGISTRY.gauge("xtts_gpt_batch_waiting", "Sentences waiting to join the batched GPT decode.", lambda: XTTS.get_batching_stats().get("waiting"))
+REGISTRY.gauge("xtts_gpt_decode_steps_total", "Batched GPT decode steps.", lambda: XTTS.get_batching_stats().get("steps"), type="counter")
+REGISTRY.gauge("xtts_gpt_decoded_tokens_total", "Audio tokens decoded by the batched GPT.", lambda: XTTS.get_batching_stats().get("tokens"), type="counter")
+REGISTRY.gauge("xtts_vocoder_batch_calls_total", "Batched vocoder calls for stream chunks.", lambda: XTTS.get_batching_stats().get("vocoder", {}).get("calls"), type="counter")
+REGISTRY.gauge("xtts_vocoder_batch_chunks_total", "Stream chunks decoded by the batched vocoder.", lambda: XTTS.get_batching_stats().get("vocoder", {}).get("chunks"), type="counter")
+REGISTRY.gauge("xtts_latents_cache_pinned", "Pinned speakers whose latents are in memory.", lambda: XTTS.latents_cache.stats()["pinned"])
+if STREAM_MODE or STREAM_MODE_IMPROVE:
+    REGISTRY.gauge("xtts_stream_worker_busy_seconds_total", "Time the CoquiEngine worker spent synthesizing.", lambda: engine.busy_seconds, type="counter")
+    REGISTRY.gauge("xtts_stream_pipe_bytes_total", "Audio bytes received from the CoquiEngine worker.", lambda: engine.bytes_received, type="counter")
+    REGISTRY.gauge("xtts_stream_pipe_chunks_total", "Audio chunks received from the CoquiEngine worker.", lambda: engine.chunks_received, type="counter")
 
 # Add CORS middleware 
 origins = ["*"]
@@ -109,6 +230,71 @@ def play_stream(stream,language):
     else:
       stream.play_async()
 
+def start_stream_playback(request):
+    global stream
+    speaker_wav = XTTS.get_speaker_wav(request.speaker_wav)
+    language = request.language[0:2]
+
+    if stream.is_playing() and not STREAM_PLAY_SYNC:
+        stream.stop()
+        stream = TextToAudioStream(engine)
+
+    engine.set_voice(speaker_wav)
+    engine.language = request.language.lower()
+
+    # Start streaming, works only on your local computer.
+    stream.feed(request.text)
+    play_stream(stream,language)
+
+def get_deadline(seconds):
+    """ Converts a relative deadline in seconds into an executor deadline. """
+    return time.monotonic() + seconds if seconds else None
+
+def queue_full_exception(e):
+    return HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+async def run_inference(fn, deadline=None, key=None, **kwargs):
+    """
+    Runs fn on the inference executor, turning admission errors into HTTP errors.
+
+    Concurrent calls with the same key share a single synthesis.
+    """
+    try:
+        return await EXECUTOR.run(fn, deadline=get_deadline(deadline), key=key, **kwargs)
+    except QueueFullError as e:
+        logger.warning(e)
+        raise queue_full_exception(e)
+    except DeadlineExceededError as e:
+        logger.warning(e)
+        raise HTTPException(status_code=504, detail=str(e))
+
+def get_audio_format(requested, accept=None, default="wav"):
+    try:
+        return negotiate_format(requested, accept, default)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+async def synthesize_audio(text, speaker_wav, language, audio_format, deadline=None):
+    """
+    Returns encoded audio: from the cache, or generated on the inference executor
+    and then encoded on the encoder pool.
+    """
+    cache_key, audio = await run_in_threadpool(XTTS.get_cached_audio, text, speaker_wav, language, audio_format)
+    if audio is not None:
+        return audio
+
+    wav = await run_inference(
+        XTTS.process_tts_to_wav,
+        deadline=deadline,
+        key=("wav", text, speaker_wav, language),
+        text=text,
+        speaker_name_or_path=speaker_wav,
+        language=language
+    )
+    audio = await ENCODERS.encode(wav, audio_format, XTTS.sample_rate)
+    await run_in_threadpool(XTTS.store_cached_audio, cache_key, audio)
+    return audio
+
 class OutputFolderRequest(BaseModel):
     output_folder: str
 
@@ -119,12 +305,16 @@ class SynthesisRequest(BaseModel):
     text: str
     speaker_wav: str 
     language: str
+    deadline: Optional[float] = None  # Seconds the request may wait in the queue
+    format: Optional[str] = None  # Output format, negotiated from the Accept header when missing
 
 class SynthesisFileRequest(BaseModel):
     text: str
     speaker_wav: str 
     language: str
     file_name_or_path: str  
+    deadline: Optional[float] = None  # Seconds the request may wait in the queue
+    format: Optional[str] = None  # Output format, taken from the file extension when missing
 
 @app.get("/speakers_list")
 def get_speakers():
@@ -136,6 +326,46 @@ def get_speakers():
     speakers = XTTS.get_speakers_special()
     return speakers
 
+@app.post("/speakers")
+async def upload_speakers(files: List[UploadFile] = File(...), name: Optional[str] = Form(None)):
+    """
+    Adds a speaker from one or more wav files, or any number of speakers from a zip.
+
+    The speaker id can be used right away; its latents are created in the
+    background, GET /speakers/{speaker_id}/status tells when they are ready.
+    """
+    zips = [f for f in files if f.filename.lower().endswith(".zip")]
+    try:
+        if zips:
+            if len(zips) != len(files):
+                raise ValueError("Upload either wav files or zip archives, not both")
+            imported, skipped = [], {}
+            for archive in zips:
+                speakers, failed = await run_in_threadpool(XTTS.import_speakers_zip, archive.file)
+                imported += speakers
+                skipped.update(failed)
+            return {
+                "speakers": [{"speaker_id": speaker, "status": "pending"} for speaker in imported],
+                "skipped": skipped,
+            }
+
+        speaker_name = name or os.path.splitext(files[0].filename)[0]
+        wavs = [(f.filename, await f.read()) for f in files]
+        speaker_id = await run_in_threadpool(XTTS.add_speaker, speaker_name, wavs)
+        return await run_in_threadpool(XTTS.get_speaker_status, speaker_id)
+    except FileExistsError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except (ValueError, zipfile.BadZipFile) as e:
+        logger.error(e)
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/speakers/{speaker_id}/status")
+def get_speaker_status(speaker_id: str):
+    try:
+        return XTTS.get_speaker_status(speaker_id)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
 @app.get("/languages")
 def get_languages():
     languages = XTTS.list_languages()
@@ -156,6 +386,40 @@ def get_sample(file_name: str):
         logger.error("File not found")
         raise HTTPException(status_code=404, detail="File not found")
 
+@app.get("/health")
+def get_health():
+    # Liveness: the process answers; only a failed model load is fatal
+    if LOAD_ERROR is not None:
+        return JSONResponse(get_readiness(), status_code=500)
+    return {"status": "ok"}
+
+@app.get("/ready")
+def get_ready():
+    readiness = get_readiness()
+    if not MODEL_READY.is_set():
+        return JSONResponse(readiness, status_code=503)
+    return readiness
+
+@app.get("/queue_stats")
+def get_queue_stats():
+    return EXECUTOR.stats()
+
+@app.get("/batching_stats")
+def get_batching_stats():
+    return XTTS.get_batching_stats()
+
+@app.get("/cache_stats")
+def get_cache_stats():
+    return XTTS.get_cache_stats()
+
+@app.get("/speaker_usage")
+def get_speaker_usage(top: int = 20):
+    return XTTS.usage.stats(top)
+
+@app.get("/metrics")
+def get_metrics():
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
 @app.post("/set_output")
 def set_output(output_req: OutputFolderRequest):
     try:
@@ -175,28 +439,18 @@ def set_speaker_folder(speaker_req: SpeakerFolderRequest):
         raise HTTPException(status_code=400, detail=str(e))
 
 @app.post("/tts_to_audio/")
-async def tts_to_audio(request: SynthesisRequest):
+async def tts_to_audio(request: SynthesisRequest, http_request: Request):
     if STREAM_MODE or STREAM_MODE_IMPROVE:
         try:
-            global stream
             # Validate language code against supported languages.
             if request.language.lower() not in supported_languages:
                 raise HTTPException(status_code=400,
                                     detail="Language code sent is either unsupported or misspelled.")
 
-            speaker_wav = XTTS.get_speaker_wav(request.speaker_wav)
-            language = request.language[0:2]
-
-            if stream.is_playing() and not STREAM_PLAY_SYNC:
-                stream.stop()
-                stream = TextToAudioStream(engine)
+            await wait_until_ready(request.deadline)
 
-            engine.set_voice(speaker_wav)
-            engine.language = request.language.lower()
-           
-            # Start streaming, works only on your local computer.
-            stream.feed(request.text)
-            play_stream(stream,language)
+            # Setting the voice waits on the engine process, keep it off the event loop
+            await run_inference(start_stream_playback, request=request, deadline=request.deadline)
 
             # It's a hack, just send 1 second of silence so that there is no sillyTavern error.
             this_dir = Path(__file__).parent.resolve()
@@ -207,56 +461,303 @@ async def tts_to_audio(request: SynthesisRequest):
                 media_type='audio/wav',
                 filename="silence.wav",
             )
+        except HTTPException:
+            raise
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
     else:
         try:
-            if XTTS.model_source == "local":
-              logger.info(f"Processing TTS to audio with request: {request}")
+            logger.info(f"Processing TTS to audio with request: {request}")
 
             # Validate language code against supported languages.
             if request.language.lower() not in supported_languages:
                 raise HTTPException(status_code=400,
                                     detail="Language code sent is either unsupported or misspelled.")
 
-            # Generate an audio file using process_tts_to_file.
-            output_file_path = XTTS.process_tts_to_file(
-                text=request.text,
-                speaker_name_or_path=request.speaker_wav,
-                language=request.language.lower()
+            audio_format = get_audio_format(request.format, http_request.headers.get("accept"))
+            await wait_until_ready(request.deadline)
+
+            # Generate the audio in memory, nothing is written to the output folder.
+            audio = await synthesize_audio(
+                request.text,
+                request.speaker_wav,
+                request.language.lower(),
+                audio_format,
+                deadline=request.deadline
             )
 
-            # Return the file in the response
-            return FileResponse(
-                path=output_file_path,
-                media_type='audio/wav',
-                filename="output.wav",
+            # Return the audio in the response
+            extension = FORMATS[audio_format]["extension"]
+            return Response(
+                content=audio,
+                media_type=media_type(audio_format, XTTS.sample_rate),
+                headers={"Content-Disposition": f'attachment; filename="output.{extension}"'},
                 )
 
+        except HTTPException:
+            raise
         except Exception as e:
             logger.error(e)
             raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
 
+@app.get("/tts_stream")
+async def tts_stream(request: Request, text: str = Query(), speaker_wav: str = Query(), language: str = Query(), deadline: Optional[float] = Query(None), format: Optional[str] = Query(None)):
+    if STREAM_MODE or STREAM_MODE_IMPROVE:
+        raise HTTPException(status_code=400,
+                            detail="HTTP Streaming is not available in streaming mode, it plays audio on the server.")
+    # Validate language code against supported languages.
+    if language.lower() not in supported_languages:
+        raise HTTPException(status_code=400,
+                            detail="Language code sent is either unsupported or misspelled.")
+
+    audio_format = stream_format(get_audio_format(format, request.headers.get("accept")))
+    await wait_until_ready(deadline)
+
+    try:
+        # Resolving the speaker and saving its usage touch the disk, keep them off the event loop
+        chunks = await run_in_threadpool(
+            XTTS.process_tts_to_stream,
+            text=text,
+            speaker_name_or_path=speaker_wav,
+            language=language.lower()
+        )
+    except ValueError as e:
+        logger.error(e)
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # The generator holds an inference slot until it is exhausted or we stop reading.
+    # The response only starts once the first chunk is there, so queue errors still get their status code.
+    try:
+        pcm_chunks = await EXECUTOR.start_stream(chunks, deadline=get_deadline(deadline))
+    except QueueFullError as e:
+        logger.warning(e)
+        raise queue_full_exception(e)
+    except DeadlineExceededError as e:
+        logger.warning(e)
+        raise HTTPException(status_code=504, detail=str(e))
+    except ValueError as e:
+        logger.error(e)
+        raise HTTPException(status_code=400, detail=str(e))
+
+    async def connected_chunks():
+        try:
+            async for chunk in pcm_chunks:
+                # Stop generating if the client went away
+                if await request.is_disconnected():
+                    break
+                yield chunk
+        finally:
+            await pcm_chunks.aclose()
+
+    # WAV formats start with a header of open-ended length, every format is encoded as the PCM arrives
+    return StreamingResponse(ENCODERS.stream(connected_chunks(), audio_format, XTTS.sample_rate),
+                             media_type=media_type(audio_format, XTTS.sample_rate))
+
+# nltk data for stream2sentence is checked once, on the first WebSocket session
+_tokenizer_lock = threading.Lock()
+_tokenizer_ready = False
+
+def split_text_stream(fragments, language):
+    """ Turns a queue of text fragments (None ends it) into sentences with stream2sentence. """
+    global _tokenizer_ready
+    with _tokenizer_lock:
+        if not _tokenizer_ready:
+            s2s.init_tokenizer("nltk")
+            _tokenizer_ready = True
+
+    def text_stream():
+        while True:
+            fragment = fragments.get()
+            if fragment is None:
+                return
+            yield fragment
+
+    return s2s.generate_sentences(
+        text_stream(),
+        minimum_sentence_length=10,
+        minimum_first_fragment_length=10,
+        quick_yield_single_sentence_fragment=True,
+        cleanup_text_links=True,
+        cleanup_text_emojis=True,
+        tokenizer="nltk",
+        language=language,
+    )
+
+@app.websocket("/ws/tts")
+async def ws_tts(websocket: WebSocket):
+    """
+    Incremental text in, audio out.
+
+    The client first sends {"speaker_wav": ..., "language": ..., "format": ...}, then
+    any number of {"text": ...} fragments and finally {"event": "end"}. For every
+    sentence the server sends {"event": "sentence", "text": ...}, binary audio
+    frames, then {"event": "sentence_end"}; {"event": "done"} closes the session.
+    The default format is 24kHz 16-bit mono PCM, compressed formats are one
+    continuous stream over the whole session.
+    """
+    await websocket.accept()
+
+    try:
+        config = await websocket.receive_json()
+    except WebSocketDisconnect:
+        return
+    except (ValueError, KeyError, TypeError):
+        # Invalid JSON, or a binary frame
+        config = None
+    speaker = config.get("speaker_wav") if isinstance(config, dict) else None
+    language = config.get("language") if isinstance(config, dict) else None
+    if not isinstance(speaker, str) or not speaker or not isinstance(language, str) or not language:
+        await websocket.send_json({"event": "error", "detail": "The first message must be a JSON object with speaker_wav, language and optionally format."})
+        await websocket.close(code=1008)
+        return
+    language = language.lower()
+
+    # Checks that don't need the model come first, so a bad config isn't kept waiting for it
+    error = None
+    if STREAM_MODE or STREAM_MODE_IMPROVE:
+        error = "WebSocket streaming is not available in streaming mode, it plays audio on the server."
+    elif language not in supported_languages:
+        error = "Language code sent is either unsupported or misspelled."
+    if error:
+        await websocket.send_json({"event": "error", "detail": error})
+        await websocket.close(code=1008)
+        return
+
+    try:
+        await wait_until_ready()
+    except HTTPException as e:
+        await websocket.send_json({"event": "error", "detail": e.detail})
+        await websocket.close(code=1013)
+        return
+
+    try:
+        XTTS.get_speaker_wav(speaker)
+        audio_format = stream_format(negotiate_format(config.get("format"), default="pcm_s16le"))
+        encoder = StreamEncoder(audio_format, XTTS.sample_rate)
+    except ValueError as e:
+        await websocket.send_json({"event": "error", "detail": str(e)})
+        await websocket.close(code=1008)
+        return
+
+    loop = asyncio.get_running_loop()
+    fragments = queue.Queue()
+    sentences = asyncio.Queue()
+
+    def split_sentences():
+        try:
+            for sentence in split_text_stream(fragments, language[0:2]):
+                loop.call_soon_threadsafe(sentences.put_nowait, sentence)
+        finally:
+            loop.call_soon_threadsafe(sentences.put_nowait, None)
+
+    async def receive_text():
+        try:
+            while True:
+                message = await websocket.receive_json()
+                if message.get("event") == "end":
+                    break
+                if message.get("text"):
+                    fragments.put(message["text"])
+        except WebSocketDisconnect:
+            pass
+        finally:
+            fragments.put(None)
+
+    receiver = asyncio.create_task(receive_text())
+    splitter = loop.run_in_executor(None, split_sentences)
+
+    try:
+        while True:
+            sentence = await sentences.get()
+            if sentence is None:
+                break
+            sentence = sentence.strip()
+            if not sentence:
+                continue
+
+            await websocket.send_json({"event": "sentence", "text": sentence})
+            chunks = await run_in_threadpool(
+                XTTS.process_tts_to_stream,
+                text=sentence,
+                speaker_name_or_path=speaker,
+                language=language
+            )
+            pcm_chunks = EXECUTOR.stream(chunks)
+            try:
+                async for chunk in pcm_chunks:
+                    data = await ENCODERS.call(encoder.feed, chunk)
+                    if data:
+                        await websocket.send_bytes(data)
+            finally:
+                await pcm_chunks.aclose()
+            await websocket.send_json({"event": "sentence_end"})
+
+        data = await ENCODERS.call(encoder.finish)
+        if data:
+            await websocket.send_bytes(data)
+        await websocket.send_json({"event": "done"})
+        await websocket.close()
+    except WebSocketDisconnect:
+        logger.info("WebSocket client disconnected")
+    except QueueFullError as e:
+        logger.warning(e)
+        await websocket.send_json({"event": "error", "detail": str(e), "retry_after": e.retry_after})
+        await websocket.close(code=1013)
+    except Exception as e:
+        logger.error(e)
+        await websocket.send_json({"event": "error", "detail": str(e)})
+        await websocket.close(code=1011)
+    finally:
+        encoder.close()
+        receiver.cancel()
+        fragments.put(None)
+        await splitter
+
 @app.post("/tts_to_file")
 async def tts_to_file(request: SynthesisFileRequest):
     try:
-        if XTTS.model_source == "local":
-          logger.info(f"Processing TTS to file with request: {request}")
+        logger.info(f"Processing TTS to file with request: {request}")
 
         # Validate language code against supported languages.
         if request.language.lower() not in supported_languages:
              raise HTTPException(status_code=400,
                                  detail="Language code sent is either unsupported or misspelled.")
 
-        # Now use process_tts_to_file for saving the file.
-        output_file = XTTS.process_tts_to_file(
-            text=request.text,
-            speaker_name_or_path=request.speaker_wav,
-            language=request.language.lower(),
-            file_name_or_path=request.file_name_or_path  # The user-provided path to save the file is used here.
+        # The user-provided path to save the file is used here.
+        output_file = XTTS.get_output_path(request.file_name_or_path)
+        audio_format = get_audio_format(request.format, default=format_from_path(output_file))
+        await wait_until_ready(request.deadline)
+
+        if XTTS.is_long_form(request.text):
+            # Written segment by segment on the inference slot, the file grows while it is synthesized
+            await run_inference(
+                XTTS.process_long_form_to_file,
+                deadline=request.deadline,
+                key=("file", request.text, request.speaker_wav, request.language.lower(), output_file, audio_format),
+                text=request.text,
+                speaker_name_or_path=request.speaker_wav,
+                language=request.language.lower(),
+                file_name_or_path=output_file,
+                audio_format=audio_format
+            )
+            return {"message": "The audio was successfully made and stored.", "output_path": output_file}
+
+        audio = await synthesize_audio(
+            request.text,
+            request.speaker_wav,
+            request.language.lower(),
+            audio_format,
+            deadline=request.deadline
         )
+
+        def write_file():
+            with timed("io"), open(output_file, "wb") as f:
+                f.write(audio)
+        await run_in_threadpool(write_file)
         return {"message": "The audio was successfully made and stored.", "output_path": output_file}
 
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(e)
         raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
@@ -0,0 +1,340 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import threading
+
+from loguru import logger
+
+# inotify event flags, see inotify(7)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_CLOEXEC = 0o2000000
+# Completed writes, renames, creation and removal; reads and partial writes are ignored
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+
+EVENT_HEADER = struct.Struct("iIII")
+
+
+def scan_speakers(folder):
+    """
+    Builds {speaker_name: speaker} for a speaker folder with os.scandir.
+
+    Every speaker is a {speaker_name, speaker_wav, preview, signature} dict where
+    signature holds (realpath, size, mtime_ns) of each wav, enough to tell when
+    the reference audio changed without reading it.
+    """
+    speakers = {}
+    with os.scandir(folder) as it:
+        entries = sorted(it, key=lambda e: e.name)
+
+    for entry in entries:
+        if entry.name.startswith('.'):
+            # Hidden entries, including uploads that are still being written
+            continue
+        try:
+            if entry.is_dir():
+                # multi-sample voice
+                speaker = _multi_sample_speaker(folder, entry.name)
+                if speaker is not None:
+                    speakers[entry.name] = speaker
+            elif entry.name.endswith('.wav') and entry.is_file():
+                speaker = _single_sample_speaker(folder, entry.name, entry.stat())
+                speakers[speaker['speaker_name']] = speaker
+        except FileNotFoundError:
+            # Removed while we were scanning, the next scan settles it
+            continue
+    return dict(sorted(speakers.items()))
+
+
+def scan_speaker(folder, speaker_name):
+    """ scan_speakers for a single speaker, None if the folder has no such speaker. """
+    if speaker_name.startswith('.'):
+        return None
+    speaker = None
+    path = os.path.join(folder, speaker_name)
+    try:
+        if os.path.isdir(path):
+            speaker = _multi_sample_speaker(folder, speaker_name)
+        # A wav next to a directory of the same name wins, as it sorts after it in a full scan
+        if os.path.isfile(path + '.wav'):
+            speaker = _single_sample_speaker(folder, speaker_name + '.wav', os.stat(path + '.wav'))
+    except FileNotFoundError:
+        return None
+    return speaker
+
+
+def speaker_name_of(entry_name):
+    """ The speaker a top-level entry of the speaker folder belongs to. """
+    return entry_name[:-4] if entry_name.endswith('.wav') else entry_name
+
+
+def _multi_sample_speaker(folder, name):
+    with os.scandir(os.path.join(folder, name)) as sub:
+        wavs = sorted((e for e in sub if e.is_file() and e.name.endswith('.wav')), key=lambda e: e.name)
+    if len(wavs) == 0:
+        # no wav files in directory
+        return None
+    return {
+        'speaker_name': name,
+        'speaker_wav': [os.path.join(folder, name, w.name) for w in wavs],
+        # use the first file found as the preview
+        'preview': os.path.join(name, wavs[0].name),
+        'signature': tuple(_file_signature(w.path, w.stat()) for w in wavs),
+    }
+
+
+def _single_sample_speaker(folder, file_name, stat):
+    path = os.path.join(folder, file_name)
+    return {
+        'speaker_name': os.path.splitext(file_name)[0],
+        'speaker_wav': path,
+        'preview': file_name,
+        'signature': (_file_signature(path, stat),),
+    }
+
+
+def _file_signature(path, stat):
+    return (os.path.realpath(path), stat.st_size, stat.st_mtime_ns)
+
+
+def parse_events(buffer):
+    """ Splits a read from an inotify descriptor into (wd, mask, name) tuples. """
+    events = []
+    offset = 0
+    while offset + EVENT_HEADER.size <= len(buffer):
+        wd, mask, _cookie, length = EVENT_HEADER.unpack_from(buffer, offset)
+        offset += EVENT_HEADER.size
+        # The name is padded with NULs
+        name = os.fsdecode(buffer[offset:offset + length].split(b"\0", 1)[0])
+        offset += length
+        events.append((wd, mask, name))
+    return events
+
+
+class _Inotify:
+    """ Minimal inotify binding through libc, Linux only. """
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.fd = libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+    def add_watch(self, path):
+        wd = self._add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {path}")
+        return wd
+
+    def read(self, timeout):
+        """ [(wd, mask, name)] of the events that arrived within timeout, None if there were none. """
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return None
+        return parse_events(os.read(self.fd, 64 * (EVENT_HEADER.size + 256)))
+
+    def close(self):
+        os.close(self.fd)
+
+
+class SpeakerIndex:
+    """
+    In-memory index of the speaker folder, kept current by a watcher thread.
+
+    The watcher uses inotify where available and polls otherwise. inotify
+    events name the entries that changed, so only those speakers are scanned
+    again; the whole folder is rescanned every rescan_interval seconds and when
+    events were lost. After every rescan on_change(changed, removed) is called
+    with the speakers that were added or whose audio changed and the ones that
+    disappeared.
+
+    The folder is first scanned by load(), meant for a background thread at
+    startup; a lookup that comes earlier runs that scan itself.
+    """
+
+    def __init__(self, folder, on_change=None, poll_interval=5.0, rescan_interval=60.0):
+        self.folder = folder
+        self.on_change = on_change
+        self.poll_interval = poll_interval
+        # Even with inotify, rescan now and then: it misses changes made on other hosts over network storage
+        self.rescan_interval = rescan_interval
+
+        self._speakers = {}
+        self._loaded = False
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def load(self):
+        """ The initial scan, speakers found by it are not reported to on_change. """
+        with self._lock:
+            if self._loaded:
+                return
+            try:
+                self._speakers = scan_speakers(self.folder)
+            except FileNotFoundError:
+                logger.warning(f"Speaker folder {self.folder} does not exist")
+            self._loaded = True
+
+    def speakers(self):
+        """ All speakers, sorted by name. """
+        if not self._loaded:
+            self.load()
+        return list(self._speakers.values())
+
+    def get(self, speaker_name):
+        if not self._loaded:
+            self.load()
+        return self._speakers.get(speaker_name)
+
+    def set_folder(self, folder):
+        with self._lock:
+            self.folder = folder
+        self.rescan()
+        # Point the watcher at the new folder
+        self._wakeup.set()
+
+    def rescan(self, speaker_names=None):
+        """ Rescans the whole folder, or only the given speakers. """
+        if not self._loaded:
+            return self.load()
+        with self._lock:
+            folder = self.folder
+            if speaker_names is None:
+                try:
+                    speakers = scan_speakers(folder)
+                except FileNotFoundError:
+                    logger.warning(f"Speaker folder {folder} disappeared")
+                    speakers = {}
+                old = self._speakers
+                self._speakers = speakers
+            else:
+                old = {name: self._speakers[name] for name in speaker_names if name in self._speakers}
+                speakers = {}
+                for name in speaker_names:
+                    speaker = scan_speaker(folder, name)
+                    if speaker is not None:
+                        speakers[name] = speaker
+                # Lookups read the dict without the lock, so it is replaced rather than updated
+                updated = {name: s for name, s in self._speakers.items() if name not in old}
+                updated.update(speakers)
+                self._speakers = dict(sorted(updated.items()))
+
+        changed = [s for name, s in speakers.items() if name not in old or old[name]['signature'] != s['signature']]
+        removed = [s for name, s in old.items() if name not in speakers or speakers[name]['signature'] != s['signature']]
+        if (changed or removed) and self.on_change is not None:
+            logger.info(f"Speaker folder changed: {len(changed)} new or modified, {len(removed)} removed or replaced")
+            try:
+                self.on_change(changed, removed)
+            except Exception as e:
+                logger.error(f"Speaker change handler failed: {e}")
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._watch, name="speaker-watcher", daemon=True)
+            self._thread.start()
+
+    def _watch(self):
+        self.load()
+        if not sys.platform.startswith("linux"):
+            return self._poll()
+
+        inotify = None
+        folder = None
+        full_rescan = False
+        while True:
+            # inotify watches are not recursive: watch the folder and each speaker directory.
+            # A new instance per folder drops the watches on the previous one.
+            if inotify is None or folder != self.folder:
+                if inotify is not None:
+                    inotify.close()
+                folder = self.folder
+                try:
+                    inotify = _Inotify()
+                except (OSError, AttributeError) as e:
+                    logger.warning(f"inotify unavailable ({e}), polling the speaker folder instead")
+                    return self._poll()
+                full_rescan = True
+            if full_rescan:
+                try:
+                    folder_wd = inotify.add_watch(folder)
+                except OSError as e:
+                    logger.warning(f"Could not watch the speaker folder ({e}), polling instead")
+                    inotify.close()
+                    return self._poll()
+                directories = {}  # wd -> speaker directory name
+                for speaker in self.speakers():
+                    if isinstance(speaker['speaker_wav'], list):
+                        self._watch_directory(inotify, directories, speaker['speaker_name'])
+
+            speaker_names, full_rescan = self._wait_for_changes(inotify, folder_wd, directories)
+            if full_rescan:
+                self.rescan()
+                continue
+            for name in speaker_names:
+                # New speaker directories, possibly still empty, and renamed ones; before the
+                # scan, so files written into them meanwhile raise events of their own
+                self._watch_directory(inotify, directories, name)
+            self.rescan(speaker_names)
+
+    def _wait_for_changes(self, inotify, folder_wd, directories):
+        """
+        Collects the speakers touched by the next burst of events. Returns
+        (speaker names, False), or (None, True) when the folder needs a full
+        rescan: periodically, after a folder switch or when events were lost.
+        """
+        waited = 0.0
+        events = None
+        while events is None and waited < self.rescan_interval and not self._wakeup.is_set():
+            events = inotify.read(1.0)
+            waited += 1.0
+        if events is None:
+            self._wakeup.clear()
+            return None, True
+
+        speaker_names = set()
+        # Let a burst of events (a copy in progress, a bulk import) settle first
+        while events is not None:
+            for wd, mask, name in events:
+                if mask & IN_Q_OVERFLOW:
+                    return None, True
+                if wd == folder_wd:
+                    if mask & (IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED):
+                        return None, True
+                    speaker_names.add(speaker_name_of(name))
+                elif wd in directories:
+                    speaker_names.add(directories[wd])
+                    if mask & IN_IGNORED:
+                        # The directory is gone, or no longer watched
+                        del directories[wd]
+            events = inotify.read(0.5)
+        return speaker_names, False
+
+    def _watch_directory(self, inotify, directories, speaker_name):
+        path = os.path.join(self.folder, speaker_name)
+        if speaker_name.startswith('.') or not os.path.isdir(path):
+            return
+        try:
+            # An already watched directory keeps its wd, e.g. after a rename
+            directories[inotify.add_watch(path)] = speaker_name
+        except OSError:
+            # Removed since the last scan
+            pass
+
+    def _poll(self):
+        while True:
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+            self.rescan()
@@ -0,0 +1,93 @@
+import json
+import os
+import threading
+import time
+
+from loguru import logger
+
+
+class SpeakerUsage:
+    """
+    Request counts and recency per speaker, persisted across restarts.
+
+    Each speaker has a demand score: its request count with every request
+    decaying by half over half_life seconds, so both how often and how lately a
+    voice was used count. The scores decide which latents stay pinned in
+    memory, which are loaded first at startup and which get prewarmed.
+    """
+
+    def __init__(self, path, half_life=7 * 24 * 3600, save_interval=30.0):
+        self.path = path
+        self.half_life = half_life
+        self.save_interval = save_interval
+        self._speakers = {}  # speaker name -> {"count", "last_used", "score"}
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._dirty = False
+        self._saved_at = time.monotonic()
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+            speakers = data.get("speakers")
+            if speakers is None:
+                # Older files only had the last use time
+                speakers = {name: {"count": 1, "last_used": float(t), "score": 1.0} for name, t in data.get("last_used", {}).items()}
+            self._speakers = speakers
+        except FileNotFoundError:
+            pass
+        except (ValueError, AttributeError, TypeError) as e:
+            logger.warning(f"Ignoring unreadable speaker usage file {self.path}: {e}")
+
+    def _decayed(self, stats, now):
+        return stats["score"] * 0.5 ** ((now - stats["last_used"]) / self.half_life)
+
+    def touch(self, speaker_name):
+        """ Records a request, returns True when the counts were saved to disk. """
+        now = time.time()
+        with self._lock:
+            stats = self._speakers.get(speaker_name)
+            if stats is None:
+                stats = self._speakers[speaker_name] = {"count": 0, "last_used": now, "score": 0.0}
+            stats["score"] = self._decayed(stats, now) + 1.0
+            stats["count"] += 1
+            stats["last_used"] = now
+            self._dirty = True
+            due = time.monotonic() - self._saved_at >= self.save_interval
+        return self.save() if due else False
+
+    def score(self, speaker_name):
+        stats = self._speakers.get(speaker_name)
+        return self._decayed(stats, time.time()) if stats else 0.0
+
+    def last_used(self, speaker_name):
+        stats = self._speakers.get(speaker_name)
+        return stats["last_used"] if stats else 0.0
+
+    def stats(self, top=20):
+        """ The speakers in highest demand. """
+        with self._lock:
+            names = list(self._speakers)
+        names.sort(key=self.score, reverse=True)
+        return [{"speaker": name, **self._speakers[name], "score": round(self.score(name), 3)} for name in names[:top]]
+
+    def save(self):
+        # Requests record usage from several threads; one save at a time, so an older snapshot never lands last
+        with self._save_lock:
+            with self._lock:
+                if not self._dirty:
+                    return False
+                data = {"speakers": {name: dict(stats) for name, stats in self._speakers.items()}}
+                self._dirty = False
+                self._saved_at = time.monotonic()
+
+            tmp_path = self.path + ".tmp"
+            try:
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(data, f)
+                os.replace(tmp_path, self.path)
+            except OSError as e:
+                logger.warning(f"Could not save speaker usage: {e}")
+            return True
@@ -1,20 +1,42 @@
 # tts.py
 
 import torch
-import torchaudio
+import torch.nn.functional as F
 
 from TTS.api import TTS
 
 from TTS.tts.configs.xtts_config import XttsConfig
 from TTS.tts.models.xtts import Xtts
+from TTS.tts.layers.xtts.tokenizer import split_sentence
 from pathlib import Path
 
-from xtts_api_server.modeldownloader import download_model,check_tts_version
+from xtts_api_server.modeldownloader import download_model
+from xtts_api_server.audio_cache import AudioCache
+from xtts_api_server.latents_store import LatentsStore
+from xtts_api_server.latents_cache import LatentsCache
+from xtts_api_server.speaker_index import SpeakerIndex
+from xtts_api_server.speaker_usage import SpeakerUsage
+from xtts_api_server.gpt_batching import GPTBatcher
+from xtts_api_server.vocoder_batching import VocoderBatcher
+from xtts_api_server.long_form import Crossfader, pack_sentences
+from xtts_api_server.reference_audio import ReferenceAudioCache, SpeakerEmbeddingCache, speaker_embedding, gpt_cond_latent
+from xtts_api_server.audio_formats import StreamEncoder, format_from_path, stream_format, to_pcm16, wav_header
+from xtts_api_server.metrics import STAGE_SECONDS, timed, observe_synthesis
 
 from loguru import logger
+import copy
+import math
 import os
 import time 
 import re
+import hashlib
+import itertools
+import queue
+import shutil
+import tempfile
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
 
 # List of supported language codes
 supported_languages = {
@@ -39,29 +61,128 @@ supported_languages = {
 
 reversed_supported_languages = {name: code for code, name in supported_languages.items()}
 
+# Names of uploaded speakers: letters, digits, spaces, dashes and underscores
+speaker_name_pattern = re.compile(r"^[\w\- ]+$")
+
+# Limits on the uncompressed size of uploaded zips, reference wavs are far smaller
+zip_member_max_bytes = 100 * 2**20
+zip_max_bytes = 2 * 2**30
+
 class TTSWrapper:
-    def __init__(self,output_folder = "./output", speaker_folder="./speakers",lowvram = False,model_source = "local",model_version = "2.0.2",device = "cuda",deepspeed = False):
+    def __init__(self,output_folder = "./output", speaker_folder="./speakers",lowvram = False,model_source = "local",model_version = "2.0.2",device = "cuda",deepspeed = False,cache_folder = "./cache",audio_cache_size = 0,latents_cache_size = 256 * 2**20,latents_workers = 2,pinned_speakers = 16,gpt_batch_size = 1,vocoder_batch_window = 0.005,model_replicas = 1,long_form_chars = 1000,prefix_cache_size = 64 * 2**20,reference_cache_size = 1024 * 2**20):
 
         self.cuda = device # If the user has chosen what to use, we rewrite the value to the value we want to use
         self.device = 'cpu' if lowvram else (self.cuda if torch.cuda.is_available() else "cpu")
         self.lowvram = lowvram  # Store whether we want to run in low VRAM mode.
 
-        self.latents_cache = {} 
+        # Speaker latents in memory, keyed by reference audio contents; latents_cache_size is in bytes
+        self.latents_cache = LatentsCache(latents_cache_size)
+        # The batched GPT's per-speaker prefix KV, fp16, with its own budget so it never pushes latents out
+        self.prefix_cache = LatentsCache(prefix_cache_size)
+
+        # Generation parameters shared by the file and the streaming paths
+        self.tts_settings = {
+            "temperature": 0.75,
+            "length_penalty": 1.0,
+            "repetition_penalty": 5.0,
+            "top_k": 50,
+            "top_p": 0.85,
+            "enable_text_splitting": True,
+        }
+        self.sample_rate = 24000
+        self.stream_chunk_size = 20
 
         self.model_source = model_source
         self.model_version = model_version
 
         self.deepspeed = deepspeed
 
+        # Concurrent requests share batched GPT decoding when gpt_batch_size > 1. Low VRAM mode moves
+        # the model per request and DeepSpeed keeps its KV cache inside its kernels, so both decode alone.
+        if gpt_batch_size > 1 and (lowvram or deepspeed):
+            logger.warning("GPT batching is not available with --lowvram or --deepspeed, requests are decoded one at a time")
+            gpt_batch_size = 1
+        self.gpt_batch_size = gpt_batch_size
+        self.gpt_batcher = None
+        # With batching, stream chunks that arrive within vocoder_batch_window seconds are vocoded together
+        self.vocoder_batch_window = vocoder_batch_window
+        self.vocoder_batcher = None
+        # Generator frames of left context in each streamed chunk's window, more than HiFiGAN's receptive field
+        self.vocoder_context_frames = 32
+        # Unbatched streaming keeps its GPT prefix in the model, so those streams run one at a time
+        self._stream_lock = threading.Lock()
+        # Without batching, sentence N is vocoded here while the GPT decodes sentence N+1
+        self._vocoder_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="vocoder")
+        self._vocoder_stream = None
+
+        # /tts_to_file texts longer than long_form_chars are split into segments synthesized in parallel,
+        # by the batcher or by model_replicas copies of the model, 0 disables it
+        self.long_form_chars = long_form_chars
+        self.long_form_segment_chars = 500
+        if model_replicas > 1 and (lowvram or deepspeed):
+            logger.warning("Model replicas are not available with --lowvram or --deepspeed, long texts use a single model")
+            model_replicas = 1
+        if model_replicas > 1 and gpt_batch_size > 1:
+            # Segments then go through the batcher, the copies would only take memory
+            logger.warning("Model replicas are not used with --gpt-batch-size above 1, long texts are batched instead")
+            model_replicas = 1
+        self.model_replicas = model_replicas
+        self._replicas = queue.Queue()  # idle replicas
+
         self.speaker_folder = speaker_folder
         self.output_folder = output_folder
+        self.cache_folder = cache_folder
         
         self.create_directories()
-        check_tts_version()
+
+        # (path, size, mtime) -> sha256 of the file contents
+        self._file_hashes = {}
+        # Uploads claim a speaker name under this lock, so one name is never written twice
+        self._speaker_write_lock = threading.Lock()
+
+        # Speakers are listed from an index kept current by a watcher instead of scanning the folder per request,
+        # the first scan runs in the background with the model loading
+        self.speaker_index = SpeakerIndex(self.speaker_folder, on_change=self.on_speakers_changed)
+        self.speaker_index.start()
+        # Latents are created by background threads, speakers in highest demand first;
+        # the latents of the pinned_speakers most requested voices are never evicted
+        self.usage = SpeakerUsage(os.path.join(self.cache_folder, "speaker_usage.json"))
+        self.pinned_speakers = pinned_speakers
+        self.latents_workers = max(1, latents_workers)
+        self._latents_queue = queue.PriorityQueue()  # (priority, sequence, speaker)
+        self._latents_sequence = itertools.count()
+        self._latents_threads = []
+        self._latents_errors = {}  # speaker name -> last latents error
+
+        # Per-thread vocoder time, filled by the HiFiGAN hooks
+        self._stage_times = threading.local()
+
+        # Startup progress, reported by /ready while the model loads in the background
+        self.load_progress = {"stage": "waiting"}
+
+        # Speaker latents of the whole library kept across restarts, packed fp16 and memory mapped;
+        # latents_cache is the hot set of upcast latents on the device
+        # The api source always loads the latest model, whatever -v says
+        latents_version = "latest" if self.model_source == "api" else self.model_version
+        self.latents_store = LatentsStore(os.path.join(self.cache_folder, "latents"), latents_version)
+        # Reference wavs decoded and resampled once, read back memory mapped; reference_cache_size is in bytes
+        self.reference_audio = ReferenceAudioCache(os.path.join(self.cache_folder, "reference"), max_bytes=reference_cache_size)
+        # Per-file speaker embeddings, so changing one sample of a voice only processes that file
+        self.speaker_embeddings = SpeakerEmbeddingCache(os.path.join(self.cache_folder, "embeddings"), latents_version)
+
+        # Synthesized audio cache, audio_cache_size is in bytes, 0 disables it
+        self.audio_cache = None
+        if audio_cache_size > 0:
+            self.audio_cache = AudioCache(os.path.join(self.cache_folder, "audio"), audio_cache_size)
     
     def load_model(self):
+        self.load_progress["stage"] = "loading_model"
+        # Every source ends up with the Xtts model itself, so they all share the latents
+        # cache and call inference directly instead of going through TTS.tts()
         if self.model_source == "api":
-            self.model = TTS("tts_models/multilingual/multi-dataset/xtts_v2")
+            tts = TTS("tts_models/multilingual/multi-dataset/xtts_v2").to(self.device)
+            self.model = tts.synthesizer.tts_model
+            self.install_stage_hooks()
 
         if self.model_source == "apiManual":
             this_dir = Path(__file__).parent.resolve()
@@ -71,16 +192,57 @@ class TTSWrapper:
             config_path = this_dir / 'models' / f'v{self.model_version}' / 'config.json'
             checkpoint_dir = this_dir / 'models' / f'v{self.model_version}'
 
-            self.model = TTS(model_path=checkpoint_dir,config_path=config_path).to(self.device)
+            tts = TTS(model_path=checkpoint_dir,config_path=config_path).to(self.device)
+            self.model = tts.synthesizer.tts_model
+            self.install_stage_hooks()
 
         if self.model_source == "local":
           self.load_local_model()
-          if self.lowvram == False:
-            # Due to the fact that we create latents on the cpu and load them from the cuda we get an error
-            logger.info("Pre-create latents for all current speakers")
-            self.create_latents_for_all() 
+
+        self.load_progress["stage"] = "warming_up"
+        self.warm_up()
+
+        if self.model_replicas > 1:
+          self.load_replicas()
+
+        if self.gpt_batch_size > 1:
+          logger.info(f"Batching GPT decoding of up to {self.gpt_batch_size} sentences")
+          self.gpt_batcher = GPTBatcher(self.model.gpt, self.tts_settings, self.gpt_batch_size)
+          self.vocoder_batcher = VocoderBatcher(self.model.hifigan_decoder.waveform_decoder, self.gpt_batch_size, self.vocoder_batch_window)
+
+        if self.lowvram == False:
+          # Due to the fact that we create latents on the cpu and load them from the cuda we get an error
+          logger.info("Pre-create latents for all current speakers in the background")
+          self.pin_hot_speakers()
+          self.create_latents_for_all() 
           
+        self.load_progress["stage"] = "ready"
         logger.info("Model successfully loaded ")
+
+    def load_replicas(self):
+        """ Copies of the model for long-form synthesis, each running its own segment. """
+        self.load_progress["stage"] = "loading_replicas"
+        self._replicas.put(self.model)
+        for _ in range(self.model_replicas - 1):
+            self._replicas.put(copy.deepcopy(self.model))
+        logger.info(f"Loaded {self.model_replicas} model replicas for long texts")
+
+    def warm_up(self):
+        """ Runs one short generation so the first request doesn't pay for CUDA kernel setup. """
+        speakers = self.get_speakers_by_demand()
+        if not speakers or self.lowvram:
+            return
+        gpt_cond_latent, speaker_embedding = self.get_or_create_latents(speakers[0]['speaker_name'], speakers[0]['speaker_wav'])
+        start_time = time.time()
+        with torch.no_grad():
+            self.model.inference(
+                "Warm up.",
+                "en",
+                gpt_cond_latent=gpt_cond_latent,
+                speaker_embedding=speaker_embedding,
+                **self.tts_settings
+            )
+        logger.info(f"Warm-up done in {time.time() - start_time:.2f} seconds.")
     
     def load_local_model(self):
         this_dir = Path(__file__).parent.resolve()
@@ -95,6 +257,41 @@ class TTSWrapper:
         self.model = Xtts.init_from_config(config)
         self.model.load_checkpoint(config,use_deepspeed=self.deepspeed, checkpoint_dir=str(checkpoint_dir))
         self.model.to(self.device)
+        self.install_stage_hooks()
+
+    def install_stage_hooks(self):
+        """ Times the HiFiGAN decoder so inference time can be split into GPT decode and vocoder. """
+        def start(module, inputs):
+            self._sync_device()
+            self._stage_times.vocoder_start = time.perf_counter()
+
+        def stop(module, inputs, output):
+            self._sync_device()
+            elapsed = time.perf_counter() - self._stage_times.vocoder_start
+            self._stage_times.vocoder = getattr(self._stage_times, "vocoder", 0.0) + elapsed
+
+        self.model.hifigan_decoder.register_forward_pre_hook(start)
+        self.model.hifigan_decoder.register_forward_hook(stop)
+
+    def _sync_device(self):
+        # CUDA kernels run asynchronously, wait for them so timings are real.
+        # Only this thread's stream, so timing the vocoder doesn't stall a GPT decode running beside it.
+        if str(self.device).startswith("cuda"):
+            torch.cuda.current_stream().synchronize()
+
+    def _take_vocoder_time(self):
+        elapsed = getattr(self._stage_times, "vocoder", 0.0)
+        self._stage_times.vocoder = 0.0
+        return elapsed
+
+    def observe_model_stages(self, model_time):
+        """ Splits model time into the gpt and vocoder stages. """
+        vocoder_time = self._take_vocoder_time()
+        # When the stages overlapped the GPT time was measured on its own
+        gpt_time = getattr(self._stage_times, "gpt", None)
+        self._stage_times.gpt = None
+        STAGE_SECONDS.observe(vocoder_time, stage="vocoder")
+        STAGE_SECONDS.observe(gpt_time if gpt_time is not None else max(model_time - vocoder_time, 0.0), stage="gpt")
 
     def switch_model_device(self):
         # We check for lowram and the existence of cuda
@@ -112,22 +309,165 @@ class TTSWrapper:
                 torch.cuda.empty_cache()
 
     def get_or_create_latents(self, speaker_name, speaker_wav):
-        if speaker_name not in self.latents_cache:
+        with timed("latents"):
+            return self._get_or_create_latents(speaker_name, speaker_wav)
+
+    def _get_or_create_latents(self, speaker_name, speaker_wav):
+        speaker_hash = self.get_speaker_hash(speaker_wav)
+
+        def create():
+            stored = self.latents_store.load(speaker_hash, self.device)
+            if stored is not None:
+                return stored
             logger.info(f"creating latents for {speaker_name}: {speaker_wav}")
-            gpt_cond_latent, speaker_embedding = self.model.get_conditioning_latents(speaker_wav)
-            self.latents_cache[speaker_name] = (gpt_cond_latent, speaker_embedding)
-        return self.latents_cache[speaker_name]
+            gpt_cond_latent, speaker_embedding = self.compute_conditioning_latents(speaker_wav)
+            self.latents_store.put(speaker_hash, gpt_cond_latent, speaker_embedding)
+            return gpt_cond_latent, speaker_embedding
 
-    def create_latents_for_all(self):
-        speakers_list = self._get_speakers()
+        return self.latents_cache.get_or_create(speaker_hash, create)
+
+    @staticmethod
+    def prefix_kv_key(speaker_hash):
+        return f"{speaker_hash}:prefix_kv"
+
+    def get_prefix_kv(self, speaker_wav, gpt_cond_latent):
+        """
+        The batched GPT's keys and values for the speaker's conditioning latent.
+
+        They are kept in half precision in the prefix cache, which has its own
+        budget, so requests for a cached speaker only prefill their text.
+        """
+        if self.gpt_batcher is None:
+            return None
+        key = self.prefix_kv_key(self.get_speaker_hash(speaker_wav))
 
-        for speaker in speakers_list:
-            self.get_or_create_latents(speaker['speaker_name'],speaker['speaker_wav'])
+        def create():
+            prefix_kv = self.gpt_batcher.speaker_prefix(gpt_cond_latent)
+            return tuple(tuple(t.half() for t in layer) for layer in prefix_kv)
 
-        logger.info(f"Latents created for all {len(speakers_list)} speakers.")
+        with timed("latents"):
+            return self.prefix_cache.get_or_create(key, create)
+
+    def compute_conditioning_latents(self, speaker_wav, max_ref_length=30, gpt_cond_len=6):
+        """
+        Xtts.get_conditioning_latents, built from cached intermediates.
+
+        The speaker embedding is the mean of per-file embeddings, only files not
+        seen before are processed. The GPT latent only looks at the first
+        gpt_cond_len seconds of the concatenated references, so only those are read.
+        """
+        wavs = speaker_wav if isinstance(speaker_wav, list) else [speaker_wav]
+        sample_rate = self.reference_audio.sample_rate
+        file_hashes = [self.get_file_hash(wav) for wav in wavs]
+
+        embeddings = []
+        for wav, file_hash in zip(wavs, file_hashes):
+            embedding = self.speaker_embeddings.get(file_hash, max_ref_length)
+            if embedding is None:
+                audio = self.reference_audio.load(wav, max_ref_length, self.device, file_hash)
+                embedding = speaker_embedding(self.model, audio, sample_rate)
+                self.speaker_embeddings.put(file_hash, max_ref_length, embedding)
+            embeddings.append(embedding.to(self.device))
+
+        prefix = self.reference_audio.load_prefix(wavs, max_ref_length, gpt_cond_len, self.device, file_hashes)
+        return gpt_cond_latent(self.model, prefix, sample_rate, gpt_cond_len), torch.stack(embeddings).mean(dim=0)
+
+    def sort_by_demand(self, speakers):
+        return sorted(speakers, key=lambda s: (self.usage.score(s['speaker_name']), self.usage.last_used(s['speaker_name'])), reverse=True)
+
+    def get_speakers_by_demand(self):
+        return self.sort_by_demand(self._get_speakers())
+
+    def record_usage(self, speaker_name):
+        # Demand is re-evaluated whenever the counts are saved
+        if self.usage.touch(speaker_name) and not self.lowvram and self.load_progress["stage"] == "ready":
+            threading.Thread(target=self.pin_hot_speakers, name="pin-speakers", daemon=True).start()
+
+    def pin_hot_speakers(self):
+        """ Pins the latents of the speakers in highest demand and queues them ahead of everything else. """
+        hot = [s for s in self.get_speakers_by_demand()[: self.pinned_speakers] if self.usage.score(s['speaker_name']) > 0]
+        hashes = []
+        for speaker in hot:
+            try:
+                hashes.append(self.get_speaker_hash(speaker['speaker_wav']))
+            except OSError:
+                # Removed in the meantime
+                continue
+        self.latents_cache.set_pinned(hashes)
+        if self.gpt_batcher is not None:
+            self.prefix_cache.set_pinned([self.prefix_kv_key(speaker_hash) for speaker_hash in hashes])
+        self.schedule_latents(hot, priority=0)
+
+    def prepare_latents(self, speaker_name, speaker_wav):
+        """ Makes sure a speaker's latents are stored, and loads them into the hot set if pinned or while it has room. """
+        speaker_hash = self.get_speaker_hash(speaker_wav)
+        if speaker_hash in self.latents_store and not self.latents_cache.has_room() and not self.latents_cache.is_pinned(speaker_hash):
+            return
+        gpt_cond_latent, _ = self.get_or_create_latents(speaker_name, speaker_wav)
+        if self.prefix_cache.is_pinned(self.prefix_kv_key(speaker_hash)):
+            # Hot speakers get their GPT prefix ready too
+            self.get_prefix_kv(speaker_wav, gpt_cond_latent)
+
+    def create_latents_for_all(self):
+        """ Queues latents creation for every speaker, in order of demand, without waiting for it. """
+        speakers_list = self.get_speakers_by_demand()
+        self.schedule_latents(speakers_list)
+        logger.info(f"Latents scheduled for all {len(speakers_list)} speakers.")
+
+    def schedule_latents(self, speakers, priority=1):
+        """ Creates latents for speakers on the background workers, lower priority values go first. """
+        for speaker in speakers:
+            self._latents_queue.put((priority, next(self._latents_sequence), speaker))
+        while len(self._latents_threads) < self.latents_workers:
+            thread = threading.Thread(target=self._latents_worker, name="latents-worker", daemon=True)
+            thread.start()
+            self._latents_threads.append(thread)
+
+    def _latents_worker(self):
+        while True:
+            _, _, speaker = self._latents_queue.get()
+            try:
+                self.prepare_latents(speaker['speaker_name'], speaker['speaker_wav'])
+                self._latents_errors.pop(speaker['speaker_name'], None)
+            except Exception as e:
+                self._latents_errors[speaker['speaker_name']] = str(e)
+                logger.error(f"Could not create latents for {speaker['speaker_name']}: {e}")
+            finally:
+                self._latents_queue.task_done()
+            if self._latents_queue.unfinished_tasks == 0:
+                self.latents_store.flush()
+
+    def get_load_progress(self):
+        return {
+            **self.load_progress,
+            "speakers_total": len(self._get_speakers()),
+            "speakers_cached": len(self.latents_store),
+            "speakers_resident": len(self.latents_cache),
+            "latents_pending": self._latents_queue.unfinished_tasks,
+        }
+
+    def on_speakers_changed(self, changed, removed):
+        """ Drops latents and reference audio of removed or replaced speakers and queues new ones for background creation. """
+        # Files a replaced speaker still has, e.g. the other samples when one is added
+        kept = {file_signature for speaker in changed for file_signature in speaker['signature']}
+        for speaker in removed:
+            speaker_hash = self._known_speaker_hash(speaker['signature'])
+            if speaker_hash is not None:
+                self.latents_cache.discard(speaker_hash)
+                self.latents_store.discard(speaker_hash)
+                self.prefix_cache.discard(self.prefix_kv_key(speaker_hash))
+            for file_signature in speaker['signature']:
+                file_hash = self._file_hashes.get(file_signature)
+                if file_hash is not None and file_signature not in kept:
+                    self.reference_audio.discard(file_hash)
+
+        # Before the model is ready create_latents_for_all picks them up; low VRAM creates latents on demand
+        if self.lowvram or self.load_progress["stage"] != "ready":
+            return
+        self.schedule_latents(self.sort_by_demand(changed))
 
     def create_directories(self):
-        directories = [self.output_folder, self.speaker_folder]
+        directories = [self.output_folder, self.speaker_folder, self.cache_folder]
 
         for sanctuary in directories:
             # List of folders to be checked for existence
@@ -142,7 +482,11 @@ class TTSWrapper:
         if os.path.exists(folder) and os.path.isdir(folder):
             self.speaker_folder = folder
             self.create_directories()
+            self.speaker_index.set_folder(folder)
             logger.info(f"Speaker folder is set to {folder}")
+            if not self.lowvram and self.load_progress["stage"] == "ready":
+                # Prewarm the voices in highest demand from the new folder first
+                threading.Thread(target=self.pin_hot_speakers, name="pin-speakers", daemon=True).start()
         else:
             raise ValueError("Provided path is not a valid directory")
 
@@ -163,38 +507,9 @@ class TTSWrapper:
         """
         Gets info on all the speakers.
 
-        Returns a list of {speaker_name,speaker_wav,preview} dicts
+        Returns a list of {speaker_name,speaker_wav,preview,signature} dicts
         """
-        speakers = []
-        for f in os.listdir(self.speaker_folder):
-            full_path = os.path.join(self.speaker_folder,f)
-            if os.path.isdir(full_path):
-                # multi-sample voice
-                subdir_files = self.get_wav_files(full_path) 
-                if len(subdir_files) == 0:
-                    # no wav files in directory
-                    continue
-
-                speaker_name = f
-                speaker_wav = [os.path.join(self.speaker_folder,f,s) for s in subdir_files]
-                # use the first file found as the preview
-                preview = os.path.join(f,subdir_files[0])
-                speakers.append({
-                        'speaker_name': speaker_name,
-                        'speaker_wav': speaker_wav,
-                        'preview': preview
-                        })
-
-            elif f.endswith('.wav'):
-                speaker_name = os.path.splitext(f)[0]
-                speaker_wav = full_path 
-                preview = f
-                speakers.append({
-                        'speaker_name': speaker_name,
-                        'speaker_wav': speaker_wav,
-                        'preview': preview
-                        })
-        return speakers
+        return self.speaker_index.speakers()
 
     def get_speakers(self):
         """ Gets available speakers """
@@ -226,6 +541,221 @@ class TTSWrapper:
         return speakers_special
 
 
+    def check_new_speaker_name(self, speaker_name):
+        if not speaker_name or speaker_name.startswith('.') or not speaker_name_pattern.match(speaker_name):
+            raise ValueError(f"Invalid speaker name {speaker_name!r}, use letters, digits, spaces, dashes and underscores")
+        full_path = os.path.join(self.speaker_folder, speaker_name)
+        if os.path.exists(full_path) or os.path.exists(f"{full_path}.wav"):
+            raise FileExistsError(f"Speaker {speaker_name} already exists")
+
+    @staticmethod
+    def check_wav(file_name, data):
+        if not file_name.lower().endswith('.wav') or data[:4] != b"RIFF" or data[8:12] != b"WAVE":
+            raise ValueError(f"{file_name} is not a wav file")
+
+    def _write_speaker(self, speaker_name, wavs):
+        """
+        Writes [(file_name, bytes)] as a speaker: one wav becomes <name>.wav, several a <name> folder.
+
+        Files are written under a unique hidden name first so the watcher never sees a
+        half-written speaker, then moved in place without replacing anything. Raises
+        FileExistsError if the speaker was created in the meantime.
+        """
+        for file_name, data in wavs:
+            self.check_wav(file_name, data)
+
+        full_path = os.path.join(self.speaker_folder, speaker_name)
+        if len(wavs) == 1:
+            fd, tmp_path = tempfile.mkstemp(prefix=f".{speaker_name}.", suffix=".tmp", dir=self.speaker_folder)
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(wavs[0][1])
+                # mkstemp makes the file private to this user
+                os.chmod(tmp_path, 0o644)
+                with self._speaker_write_lock:
+                    self.check_new_speaker_name(speaker_name)
+                    try:
+                        # Unlike a rename, link fails if the target exists
+                        os.link(tmp_path, f"{full_path}.wav")
+                    except FileExistsError:
+                        raise
+                    except OSError:
+                        # No hard links on this filesystem, write in place; the lock keeps
+                        # other uploads out and the exclusive create anything else
+                        self._write_exclusive(f"{full_path}.wav", wavs[0][1])
+            finally:
+                os.remove(tmp_path)
+            return
+
+        tmp_dir = tempfile.mkdtemp(prefix=f".{speaker_name}.", suffix=".tmp", dir=self.speaker_folder)
+        try:
+            os.chmod(tmp_dir, 0o755)
+            for i, (file_name, data) in enumerate(wavs):
+                # Keep names unique when files from different folders share a name
+                name = os.path.basename(file_name)
+                with open(os.path.join(tmp_dir, f"{i:03d}_{name}"), "wb") as f:
+                    f.write(data)
+            with self._speaker_write_lock:
+                self.check_new_speaker_name(speaker_name)
+                try:
+                    os.rename(tmp_dir, full_path)
+                except OSError as e:
+                    # A folder that appeared since the check, rename refuses to replace it unless it is empty
+                    if os.path.exists(full_path):
+                        raise FileExistsError(f"Speaker {speaker_name} already exists") from e
+                    raise
+        except BaseException:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+
+    @staticmethod
+    def _write_exclusive(path, data):
+        with open(path, "xb") as f:
+            try:
+                f.write(data)
+            except BaseException:
+                os.remove(path)
+                raise
+
+    def _prepare_speakers(self, speaker_names):
+        """ Indexes freshly written speakers and queues their latents ahead of the startup backlog. """
+        self.speaker_index.rescan(speaker_names)
+        speakers = [self.speaker_index.get(name) for name in speaker_names]
+        speakers = [s for s in speakers if s is not None]
+        # Before the model is ready create_latents_for_all picks them up
+        if not self.lowvram and self.load_progress["stage"] == "ready":
+            self.schedule_latents(speakers, priority=0)
+
+    def add_speaker(self, speaker_name, wavs):
+        """ Stores uploaded reference wavs [(file_name, bytes)] as a new speaker, returns its id. """
+        self.check_new_speaker_name(speaker_name)
+        self._write_speaker(speaker_name, wavs)
+        self._prepare_speakers([speaker_name])
+        logger.info(f"Added speaker {speaker_name} with {len(wavs)} samples")
+        return speaker_name
+
+    def import_speakers_zip(self, file):
+        """
+        Imports every speaker in a zip: top-level wavs become single-sample speakers,
+        top-level folders multi-sample ones. Returns (imported ids, {name: reason} skipped).
+        """
+        with zipfile.ZipFile(file) as archive:
+            groups = {}
+            total_size = 0
+            for info in archive.infolist():
+                parts = [p for p in info.filename.replace("\\", "/").split("/") if p]
+                if info.is_dir() or not parts or not parts[-1].lower().endswith('.wav'):
+                    continue
+                if any(p.startswith('.') or p == '..' for p in parts):
+                    # macOS resource forks and anything trying to leave the folder
+                    continue
+                speaker_name = os.path.splitext(parts[0])[0] if len(parts) == 1 else parts[0]
+                groups.setdefault(speaker_name, []).append(info)
+                total_size += info.file_size
+            # file_size is what reads return at most, a forged header can't make them larger
+            if total_size > zip_max_bytes:
+                raise ValueError(f"The zip holds {total_size / 2**20:.0f} MB of wavs, the limit is {zip_max_bytes / 2**20:.0f} MB")
+
+            def import_speaker(speaker_name):
+                self.check_new_speaker_name(speaker_name)
+                for info in groups[speaker_name]:
+                    if info.file_size > zip_member_max_bytes:
+                        raise ValueError(f"{info.filename} is larger than {zip_member_max_bytes / 2**20:.0f} MB")
+                # ZipFile reads are safe from several threads, decompression runs in parallel
+                wavs = [(info.filename, archive.read(info)) for info in groups[speaker_name]]
+                self._write_speaker(speaker_name, wavs)
+
+            imported, skipped = [], {}
+            with ThreadPoolExecutor(max_workers=self.latents_workers) as pool:
+                results = {name: pool.submit(import_speaker, name) for name in groups}
+                for name, result in results.items():
+                    try:
+                        result.result()
+                        imported.append(name)
+                    except (ValueError, OSError, zipfile.BadZipFile) as e:
+                        skipped[name] = str(e)
+
+        self._prepare_speakers(imported)
+        logger.info(f"Imported {len(imported)} speakers from zip, skipped {len(skipped)}")
+        return imported, skipped
+
+    def get_speaker_status(self, speaker_name):
+        """ Whether a speaker's latents are ready: ready, pending or failed. """
+        speaker = self.speaker_index.get(speaker_name)
+        if speaker is None:
+            raise ValueError(f"Speaker {speaker_name} not found.")
+        status = {"speaker_id": speaker_name, "status": "pending"}
+        if self.get_speaker_hash(speaker['speaker_wav']) in self.latents_store:
+            status["status"] = "ready"
+        elif speaker_name in self._latents_errors:
+            status["status"] = "failed"
+            status["error"] = self._latents_errors[speaker_name]
+        return status
+
+    def get_file_hash(self, path):
+        """ Content hash of a file, memoized on its size and modification time. """
+        stat = os.stat(path)
+        memo_key = (os.path.realpath(path), stat.st_size, stat.st_mtime_ns)
+        if memo_key not in self._file_hashes:
+            sha = hashlib.sha256()
+            with open(path, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    sha.update(block)
+            self._file_hashes[memo_key] = sha.hexdigest()
+        return self._file_hashes[memo_key]
+
+    def get_speaker_hash(self, speaker_wav):
+        """ Identity of a speaker: the hash of its reference wav contents. """
+        wavs = speaker_wav if isinstance(speaker_wav, list) else [speaker_wav]
+        hashes = sorted(self.get_file_hash(wav) for wav in wavs)
+        return hashlib.sha256("".join(hashes).encode()).hexdigest()
+
+    def _known_speaker_hash(self, signature):
+        """ Speaker hash from already hashed files, None if any of them was never hashed. """
+        hashes = [self._file_hashes.get(file_signature) for file_signature in signature]
+        if None in hashes:
+            return None
+        return hashlib.sha256("".join(sorted(hashes)).encode()).hexdigest()
+
+    def get_cache_key(self, text, speaker_wav, language, audio_format="wav"):
+        """ Key of a synthesis result in the audio cache. """
+        return AudioCache.make_key(
+            text=text,
+            speaker=self.get_speaker_hash(speaker_wav),
+            language=language,
+            settings=self.tts_settings,
+            model_source=self.model_source,
+            model_version=self.model_version,
+            format=audio_format,
+        )
+
+    def get_cached_audio(self, text, speaker_name_or_path, language, audio_format="wav"):
+        """ Returns (cache_key, audio bytes or None); the key is None when the cache is disabled. """
+        if self.audio_cache is None:
+            return None, None
+        speaker_wav = self.get_speaker_wav(speaker_name_or_path)
+        cache_key = self.get_cache_key(self.clean_text(text), speaker_wav, language, audio_format)
+        with timed("io"):
+            audio = self.audio_cache.get(cache_key)
+        if audio is not None:
+            logger.info("Audio cache hit, skipping generation")
+        return cache_key, audio
+
+    def store_cached_audio(self, cache_key, audio):
+        if self.audio_cache is not None and cache_key is not None:
+            with timed("io"):
+                self.audio_cache.put(cache_key, audio)
+
+    def get_latents_cache_bytes(self):
+        """ Memory held by cached speaker latents. """
+        return self.latents_cache.total_bytes
+
+    def get_cache_stats(self):
+        caches = {"latents": self.latents_cache.stats(), "prefix_kv": self.prefix_cache.stats(), "reference": self.reference_audio.stats()}
+        if self.audio_cache is None:
+            return {"enabled": False, **caches}
+        return {"enabled": True, **self.audio_cache.stats(), **caches}
+
     def list_languages(self):
         return reversed_supported_languages
 
@@ -236,52 +766,299 @@ class TTSWrapper:
         text = re.sub(r'"\s?(.*?)\s?"', r"'\1'", text)
         return text
 
-    def local_generation(self,text,speaker_name,speaker_wav,language,output_file):
+    def local_generation(self,text,speaker_name,speaker_wav,language):
         # Log time
         generate_start_time = time.time()  # Record the start time of loading the model
 
         gpt_cond_latent, speaker_embedding = self.get_or_create_latents(speaker_name, speaker_wav)
 
-        out = self.model.inference(
+        self._take_vocoder_time()
+        inference_start_time = time.perf_counter()
+        prefix_kv = self.get_prefix_kv(speaker_wav, gpt_cond_latent)
+        wav = self.generate_wav(text, language, gpt_cond_latent, speaker_embedding, prefix_kv)
+        self.observe_model_stages(time.perf_counter() - inference_start_time)
+
+        generate_end_time = time.time()  # Record the time to generate TTS
+        generate_elapsed_time = generate_end_time - generate_start_time
+
+        logger.info(f"Processing time: {generate_elapsed_time:.2f} seconds.")
+        observe_synthesis(generate_elapsed_time, len(wav) / self.sample_rate)
+        return wav
+
+    def generate_wav(self, text, language, gpt_cond_latent, speaker_embedding, prefix_kv=None):
+        if self.gpt_batcher is not None:
+            return self.batched_inference(text, language, gpt_cond_latent, speaker_embedding, prefix_kv)
+        if self.tts_settings["enable_text_splitting"] and not self.deepspeed:
+            # DeepSpeed's kernels share a workspace, so they can't run the two stages at once
+            return self.pipelined_inference(text, language, gpt_cond_latent, speaker_embedding)
+        return self.model.inference(
             text,
             language,
             gpt_cond_latent=gpt_cond_latent,
             speaker_embedding=speaker_embedding,
-            temperature=0.75,
-            length_penalty=1.0,
-            repetition_penalty=5.0,
-            top_k=50,
-            top_p=0.85,
-            enable_text_splitting=True
+            **self.tts_settings
+        )["wav"]
+
+    @torch.inference_mode()
+    def batched_inference(self, text, language, gpt_cond_latent, speaker_embedding, prefix_kv=None):
+        """
+        Xtts.inference with the GPT decode handed to the batcher.
+
+        All sentences are submitted at once so they decode alongside each other and
+        alongside other requests; each is vocoded as soon as its codes are ready.
+        """
+        pending = [
+            (text_tokens, self.gpt_batcher.submit(gpt_cond_latent, text_tokens, prefix_kv))
+            for text_tokens in self.tokenize_sentences(text, language)
+        ]
+
+        wavs = [
+            self.vocode_sentence(text_tokens, future.result(), gpt_cond_latent, speaker_embedding)
+            for text_tokens, future in pending
+        ]
+        return torch.cat(wavs, dim=0).numpy()
+
+    @torch.inference_mode()
+    def pipelined_inference(self, text, language, gpt_cond_latent, speaker_embedding):
+        """
+        Xtts.inference as a two-stage pipeline: while the vocoder thread turns
+        sentence N into audio, the GPT decodes sentence N+1. The waveforms are
+        joined in sentence order, so the output is the same as sequential runs.
+        """
+        gpt = self.model.gpt
+        settings = self.tts_settings
+        sentences = list(self.tokenize_sentences(text, language))
+
+        gpt_time = 0.0
+        pending = []
+        for text_tokens in sentences:
+            gpt_start = time.perf_counter()
+            gpt_codes = gpt.generate(
+                cond_latents=gpt_cond_latent,
+                text_inputs=text_tokens,
+                input_tokens=None,
+                do_sample=True,
+                top_p=settings["top_p"],
+                top_k=settings["top_k"],
+                temperature=settings["temperature"],
+                num_return_sequences=self.model.gpt_batch_size,
+                num_beams=1,
+                length_penalty=settings["length_penalty"],
+                repetition_penalty=settings["repetition_penalty"],
+                output_attentions=False,
+            )
+            gpt_time += time.perf_counter() - gpt_start
+            if len(sentences) == 1:
+                pending.append((self.vocode_sentence(text_tokens, gpt_codes, gpt_cond_latent, speaker_embedding), 0.0))
+                break
+
+            ready = None
+            if str(self.device).startswith("cuda"):
+                # The vocoder runs on its own CUDA stream and must see the finished codes
+                ready = torch.cuda.Event()
+                ready.record()
+            pending.append(self._vocoder_pool.submit(self._pipelined_vocode, text_tokens, gpt_codes, gpt_cond_latent, speaker_embedding, ready))
+
+        wavs = []
+        vocoder_time = 0.0
+        for item in pending:
+            wav, elapsed = item if isinstance(item, tuple) else item.result()
+            wavs.append(wav)
+            vocoder_time += elapsed
+        # The vocoder ran on another thread; report both stages to this request
+        self._stage_times.vocoder = getattr(self._stage_times, "vocoder", 0.0) + vocoder_time
+        self._stage_times.gpt = gpt_time
+        return torch.cat(wavs, dim=0).numpy()
+
+    @torch.inference_mode()
+    def _pipelined_vocode(self, text_tokens, gpt_codes, gpt_cond_latent, speaker_embedding, ready):
+        self._take_vocoder_time()
+        if ready is None:
+            wav = self.vocode_sentence(text_tokens, gpt_codes, gpt_cond_latent, speaker_embedding)
+        else:
+            if self._vocoder_stream is None:
+                self._vocoder_stream = torch.cuda.Stream(device=self.device)
+            self._vocoder_stream.wait_event(ready)
+            with torch.cuda.stream(self._vocoder_stream):
+                wav = self.vocode_sentence(text_tokens, gpt_codes, gpt_cond_latent, speaker_embedding)
+        return wav, self._take_vocoder_time()
+
+    def vocode_sentence(self, text_tokens, gpt_codes, gpt_cond_latent, speaker_embedding):
+        """ Second half of Xtts.inference for one sentence: GPT latents of the codes, then HiFiGAN. """
+        gpt = self.model.gpt
+        expected_output_len = torch.tensor([gpt_codes.shape[-1] * gpt.code_stride_len], device=self.device)
+        text_len = torch.tensor([text_tokens.shape[-1]], device=self.device)
+        gpt_latents = gpt(
+            text_tokens,
+            text_len,
+            gpt_codes,
+            expected_output_len,
+            cond_latents=gpt_cond_latent,
+            return_attentions=False,
+            return_latent=True,
         )
+        # .cpu() waits for the decode to finish on whichever stream ran it
+        return self.model.hifigan_decoder(gpt_latents, g=speaker_embedding).cpu().squeeze()
 
-        torchaudio.save(output_file, torch.tensor(out["wav"]).unsqueeze(0), 24000)
+    @torch.inference_mode()
+    def batched_stream(self, text, language, gpt_cond_latent, speaker_embedding, prefix_kv=None, overlap_wav_len=1024):
+        """
+        Xtts.inference_stream with the GPT decode and the vocoder shared with other streams.
+
+        XTTS vocodes all latents of the sentence so far for every chunk and
+        crossfades it with the previous one. Here only the interpolation to the
+        generator input covers the whole sentence; the generator runs on a window
+        of fixed size at its end, long enough to hold the new samples plus the
+        generator's receptive field, so the audio is the same while every chunk of
+        every stream has the same length and can share a vocoder call.
+        """
+        decoder = self.model.hifigan_decoder
+        hop_length = decoder.output_hop_length
+        # Generator frames: the new frames of a chunk, the crossfade and context on the left
+        new_frames = math.ceil(self.stream_chunk_size * decoder.ar_mel_length_compression / hop_length * decoder.output_sample_rate / decoder.input_sample_rate)
+        window = new_frames + math.ceil(overlap_wav_len / hop_length) + self.vocoder_context_frames
+
+        for text_tokens in self.tokenize_sentences(text, language):
+            tokens = self.gpt_batcher.stream(gpt_cond_latent, text_tokens, prefix_kv)
+            all_latents = []
+            new_tokens = 0
+            wav_gen_len, wav_overlap = None, None
+            is_end = False
+            while not is_end:
+                try:
+                    _, latent = next(tokens)
+                    all_latents.append(latent)
+                    new_tokens += 1
+                except StopIteration:
+                    is_end = True
+
+                if is_end or new_tokens >= self.stream_chunk_size:
+                    z = self.decoder_input(torch.stack(all_latents)[None, :])
+                    start = max(0, z.shape[-1] - window)
+                    vocoder_start = time.perf_counter()
+                    wav = self.vocoder_batcher.decode(z[:, :, start:], speaker_embedding)
+                    # Counted like the HiFiGAN hooks count it on the unbatched path
+                    self._stage_times.vocoder = getattr(self._stage_times, "vocoder", 0.0) + time.perf_counter() - vocoder_start
+                    wav_chunk, wav_gen_len, wav_overlap = self.handle_window(wav, start * hop_length, wav_gen_len, wav_overlap, overlap_wav_len)
+                    new_tokens = 0
+                    yield wav_chunk
+
+    def decoder_input(self, gpt_latents):
+        """ The HiFiGAN generator input for (batch, frames, dim) GPT latents, as HifiDecoder.forward computes it. """
+        decoder = self.model.hifigan_decoder
+        z = F.interpolate(gpt_latents.transpose(1, 2), scale_factor=[decoder.ar_mel_length_compression / decoder.output_hop_length], mode="linear")
+        if decoder.output_sample_rate != decoder.input_sample_rate:
+            z = F.interpolate(z, scale_factor=[decoder.output_sample_rate / decoder.input_sample_rate], mode="linear")
+        return z
+
+    @staticmethod
+    def handle_window(wav, offset, wav_gen_len, wav_overlap, overlap_len):
+        """
+        Xtts.handle_chunks for a waveform of which only the samples from offset on were generated.
 
-        generate_end_time = time.time()  # Record the time to generate TTS
-        generate_elapsed_time = generate_end_time - generate_start_time
+        Takes and returns the length of the previous whole waveform instead of the waveform itself.
+        """
+        start = 0 if wav_gen_len is None else wav_gen_len - overlap_len
+        wav_chunk = wav[start - offset : len(wav) - overlap_len].clone()
+        if wav_overlap is not None:
+            if overlap_len > len(wav_chunk):
+                # Too short to crossfade, pass on the rest as it is
+                wav_chunk = wav[start - offset :] if wav_gen_len is not None else wav[-overlap_len:]
+                return wav_chunk, offset + len(wav), None
+            crossfade_wav = wav_chunk[:overlap_len] * torch.linspace(0.0, 1.0, overlap_len, device=wav_chunk.device)
+            wav_chunk[:overlap_len] = wav_overlap * torch.linspace(1.0, 0.0, overlap_len, device=wav_overlap.device)
+            wav_chunk[:overlap_len] += crossfade_wav
+        return wav_chunk, offset + len(wav), wav[-overlap_len:]
+
+    def tokenize_sentences(self, text, language):
+        """ Splits and tokenizes text the way Xtts.inference does. """
+        language = language.split("-")[0]
+        if self.tts_settings["enable_text_splitting"]:
+            sentences = split_sentence(text, language, self.model.tokenizer.char_limits[language])
+        else:
+            sentences = [text]
+
+        for sentence in sentences:
+            text_tokens = torch.IntTensor(self.model.tokenizer.encode(sentence.strip().lower(), lang=language)).unsqueeze(0).to(self.device)
+            if text_tokens.shape[-1] >= self.model.args.gpt_max_text_tokens:
+                raise ValueError("XTTS can only generate text with a maximum of 400 tokens per sentence.")
+            yield text_tokens
+
+    def get_batching_stats(self):
+        if self.gpt_batcher is None:
+            return {}
+        return {**self.gpt_batcher.stats(), "vocoder": self.vocoder_batcher.stats()}
+
+    def stream_generation(self,text,speaker_name,speaker_wav,language):
+        """ Yields 16-bit PCM chunks as soon as the vocoder produces them. """
+        generate_start_time = time.time()
+        gpt_cond_latent, speaker_embedding = self.get_or_create_latents(speaker_name, speaker_wav)
 
+        if self.gpt_batcher is not None:
+            prefix_kv = self.get_prefix_kv(speaker_wav, gpt_cond_latent)
+            chunks = self.batched_stream(text, language, gpt_cond_latent, speaker_embedding, prefix_kv)
+            yield from self._stream_chunks(chunks, generate_start_time)
+            return
+
+        with self._stream_lock:
+            chunks = self.model.inference_stream(
+                text,
+                language,
+                gpt_cond_latent=gpt_cond_latent,
+                speaker_embedding=speaker_embedding,
+                stream_chunk_size=self.stream_chunk_size,
+                **self.tts_settings
+            )
+            yield from self._stream_chunks(chunks, generate_start_time)
+
+    def _stream_chunks(self, chunks, generate_start_time):
+        # Only the time spent inside the model counts, not the time the consumer holds a chunk
+        self._take_vocoder_time()
+        first_chunk_time = None
+        model_time = 0.0
+        samples = 0
+        chunks = iter(chunks)
+        while True:
+            chunk_start_time = time.perf_counter()
+            try:
+                chunk = next(chunks)
+            except StopIteration:
+                break
+            model_time += time.perf_counter() - chunk_start_time
+
+            if first_chunk_time is None:
+                first_chunk_time = time.time() - generate_start_time
+                logger.info(f"Time to first chunk: {first_chunk_time:.2f} seconds.")
+            if isinstance(chunk, list):
+                chunk = torch.cat(chunk, dim=0)
+            chunk = chunk.cpu().numpy()
+            samples += len(chunk)
+            yield to_pcm16(chunk)
+
+        self.observe_model_stages(model_time)
+        generate_elapsed_time = time.time() - generate_start_time
         logger.info(f"Processing time: {generate_elapsed_time:.2f} seconds.")
-
-    def api_generation(self,text,speaker_wav,language,output_file):
-        self.model.tts_to_file(
-                text=text,
-                speaker_wav=speaker_wav,
-                language=language,
-                file_path=output_file,
-        )
+        observe_synthesis(model_time, samples / self.sample_rate)
 
     def get_speaker_wav(self, speaker_name_or_path):
         """ Gets the speaker_wav(s) for a given speaker name. """
+        if not speaker_name_or_path:
+            # Would resolve to the speaker folder itself
+            raise ValueError("No speaker given.")
+        speaker = self.speaker_index.get(speaker_name_or_path)
         if speaker_name_or_path.endswith('.wav'):
             # it's a file name
-            if os.path.isabs(spekaer_name_or_path):
+            if os.path.isabs(speaker_name_or_path):
                 # absolute path; nothing to do
                 speaker_wav = speaker_name_or_path
             else:
                 # make it a full path
                 speaker_wav = os.path.join(self.speaker_folder, speaker_name_or_path)
+        elif speaker is not None:
+            # it's an indexed speaker name
+            speaker_wav = speaker['speaker_wav']
         else:
-            # it's a speaker name
+            # it's a speaker name the watcher hasn't picked up yet
             full_path = os.path.join(self.speaker_folder, speaker_name_or_path) 
             wav_file = f"{full_path}.wav"
             if os.path.isdir(full_path):
@@ -297,36 +1074,153 @@ class TTSWrapper:
         return speaker_wav
 
 
-    def process_tts_to_file(self, text, speaker_name_or_path, language, file_name_or_path="out.wav"):
-        try:
-            speaker_wav = self.get_speaker_wav(speaker_name_or_path)
-            # Determine output path based on whether a full path or a file name was provided
-            if os.path.isabs(file_name_or_path):
-                # An absolute path was provided by user; use as is.
-                output_file = file_name_or_path
-            else:
-                # Only a filename was provided; prepend with output folder.
-                output_file = os.path.join(self.output_folder, file_name_or_path)
+    def process_tts_to_wav(self, text, speaker_name_or_path, language):
+        """ Runs the model and returns the float waveform, without caching or encoding. """
+        speaker_wav = self.get_speaker_wav(speaker_name_or_path)
+        self.record_usage(speaker_name_or_path)
 
-            # Replace double quotes with single, asterisks, carriage returns, and line feeds
+        # Replace double quotes with single, asterisks, carriage returns, and line feeds
+        with timed("text_cleaning"):
             clear_text = self.clean_text(text)
 
-            self.switch_model_device() # Load to CUDA if lowram ON
-
-            # Define generation if model via api or locally
-            if self.model_source == "local":
-                self.local_generation(clear_text,speaker_name_or_path,speaker_wav,language,output_file)
-            else:
-                self.api_generation(clear_text,speaker_wav,language,output_file)
-            
+        self.switch_model_device() # Load to CUDA if lowram ON
+        try:
+            return self.local_generation(clear_text,speaker_name_or_path,speaker_wav,language)
+        finally:
             self.switch_model_device() # Unload to CPU if lowram ON
-            return output_file
 
-        except Exception as e:
-            raise e  # Propagate exceptions for endpoint handling.
+    def get_output_path(self, file_name_or_path):
+        # Determine output path based on whether a full path or a file name was provided
+        if os.path.isabs(file_name_or_path):
+            # An absolute path was provided by user; use as is.
+            return file_name_or_path
+        # Only a filename was provided; prepend with output folder.
+        return os.path.join(self.output_folder, file_name_or_path)
+
+    def is_long_form(self, text):
+        return self.long_form_chars > 0 and len(text) > self.long_form_chars
+
+    def split_long_form(self, text, language):
+        """ Paragraphs, cut into segments of whole sentences; the first segment is a single sentence. """
+        language = language.split("-")[0]
+        segments = []
+        for paragraph in re.split(r"\n\s*\n", text):
+            paragraph = self.clean_text(paragraph).strip()
+            if not paragraph:
+                continue
+            sentences = split_sentence(paragraph, language, self.model.tokenizer.char_limits[language])
+            if not segments:
+                # A short first segment, so the start of the file is there early
+                segments.append(sentences[0])
+                sentences = sentences[1:]
+            segments.extend(pack_sentences(sentences, self.long_form_segment_chars))
+        return segments
+
+    def _synthesize_segment(self, text, language, gpt_cond_latent, speaker_embedding, prefix_kv):
+        if self.gpt_batcher is not None or self.model_replicas == 1:
+            return self.generate_wav(text, language, gpt_cond_latent, speaker_embedding, prefix_kv)
+        model = self._replicas.get()
+        try:
+            return model.inference(
+                text,
+                language,
+                gpt_cond_latent=gpt_cond_latent,
+                speaker_embedding=speaker_embedding,
+                **self.tts_settings
+            )["wav"]
+        finally:
+            self._replicas.put(model)
+
+    def long_form_generation(self, segments, speaker_name, speaker_wav, language):
+        """ Synthesizes segments in parallel, yields their waveforms in order as soon as each is ready. """
+        gpt_cond_latent, speaker_embedding = self.get_or_create_latents(speaker_name, speaker_wav)
+        prefix_kv = self.get_prefix_kv(speaker_wav, gpt_cond_latent)
 
-        
+        if self.gpt_batcher is not None:
+            workers = self.gpt_batch_size
+        else:
+            workers = self.model_replicas
+        pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="long-form")
+        futures = [pool.submit(self._synthesize_segment, segment, language, gpt_cond_latent, speaker_embedding, prefix_kv) for segment in segments]
+        try:
+            for future in futures:
+                yield future.result()
+        finally:
+            for future in futures:
+                future.cancel()
+            pool.shutdown(wait=False)
+
+    def process_long_form_to_file(self, text, speaker_name_or_path, language, file_name_or_path="out.wav", audio_format=None):
+        """
+        Writes a long text to a file as it is synthesized: segments run in parallel
+        and are appended in order with a short crossfade, so the beginning of the
+        file is ready long before the end.
+        """
+        output_file = self.get_output_path(file_name_or_path)
+        # Written incrementally, so wav is 16-bit here and cached under that name
+        audio_format = stream_format(audio_format or format_from_path(output_file))
+
+        cache_key, audio = self.get_cached_audio(text, speaker_name_or_path, language, audio_format)
+        if audio is not None:
+            with timed("io"), open(output_file, "wb") as f:
+                f.write(audio)
+            return output_file
+
+        speaker_wav = self.get_speaker_wav(speaker_name_or_path)
+        self.record_usage(speaker_name_or_path)
+        with timed("text_cleaning"):
+            segments = self.split_long_form(text, language)
+        logger.info(f"Long text of {len(text)} characters split into {len(segments)} segments")
+
+        generate_start_time = time.time()
+        crossfader = Crossfader(int(self.sample_rate * 0.02))
+        encoder = StreamEncoder(audio_format, self.sample_rate)
+        samples = 0
+        self.switch_model_device() # Load to CUDA if lowram ON
+        try:
+            with open(output_file, "wb") as f:
+                for i, wav in enumerate(self.long_form_generation(segments, speaker_name_or_path, speaker_wav, language)):
+                    pcm = crossfader.push(wav)
+                    samples += len(pcm)
+                    f.write(encoder.feed(to_pcm16(pcm)))
+                    f.flush()
+                    if i == 0:
+                        logger.info(f"First segment written after {time.time() - generate_start_time:.2f} seconds")
+                pcm = crossfader.finish()
+                samples += len(pcm)
+                f.write(encoder.feed(to_pcm16(pcm)) + encoder.finish())
+                if audio_format == "wav_s16":
+                    # The header was written open-ended, now the size is known
+                    f.seek(0)
+                    f.write(wav_header(self.sample_rate, data_size=samples * 2))
+        except BaseException:
+            encoder.close()
+            raise
+        finally:
+            self.switch_model_device() # Unload to CPU if lowram ON
 
+        generate_elapsed_time = time.time() - generate_start_time
+        logger.info(f"Processing time: {generate_elapsed_time:.2f} seconds.")
+        observe_synthesis(generate_elapsed_time, samples / self.sample_rate)
+
+        if self.audio_cache is not None:
+            with open(output_file, "rb") as f:
+                self.store_cached_audio(cache_key, f.read())
+        return output_file
+
+    def process_tts_to_stream(self, text, speaker_name_or_path, language):
+        """ Returns a generator of raw PCM chunks. """
+        # Resolve the speaker up front so a bad request fails before streaming starts
+        speaker_wav = self.get_speaker_wav(speaker_name_or_path)
+        self.record_usage(speaker_name_or_path)
+        with timed("text_cleaning"):
+            clear_text = self.clean_text(text)
 
+        return self._stream_on_device(clear_text,speaker_name_or_path,speaker_wav,language)
 
-        
+    def _stream_on_device(self,text,speaker_name,speaker_wav,language):
+        self.switch_model_device() # Load to CUDA if lowram ON
+        try:
+            yield from self.stream_generation(text,speaker_name,speaker_wav,language)
+        finally:
+            self.switch_model_device() # Unload to CPU if lowram ON
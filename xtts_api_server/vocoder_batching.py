@@ -0,0 +1,81 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import torch
+from loguru import logger
+
+
+class VocoderBatcher:
+    """
+    Micro-batched HiFiGAN decoding across concurrent streams.
+
+    Streams hand in the HiFiGAN generator input of their next chunk and wait
+    for the waveform. The vocoder thread takes whatever arrives within window
+    seconds of the first chunk, decodes chunks with the same number of frames
+    in one call and routes each waveform back to its stream. Chunks are never
+    padded, the generator's receptive field would carry padding into the
+    waveform; streams send fixed size windows so their chunks line up.
+    """
+
+    def __init__(self, decoder, max_batch_size=8, window=0.005):
+        self.decoder = decoder
+        self.max_batch_size = max_batch_size
+        self.window = window
+        self._queue = queue.Queue()
+
+        self.calls = 0
+        self.chunks = 0
+
+        self._thread = threading.Thread(target=self._run, name="vocoder-batcher", daemon=True)
+        self._thread.start()
+
+    def decode(self, decoder_input, speaker_embedding):
+        """ Vocodes a (1, channels, frames) generator input, blocks until the (samples,) waveform is ready. """
+        future = Future()
+        self._queue.put((decoder_input, speaker_embedding, future))
+        return future.result()
+
+    def stats(self):
+        return {
+            "calls": self.calls,
+            "chunks": self.chunks,
+            "avg_batch_size": self.chunks / self.calls if self.calls else 0.0,
+        }
+
+    def _run(self):
+        with torch.inference_mode():
+            while True:
+                batch = [self._queue.get()]
+                deadline = time.monotonic() + self.window
+                while len(batch) < self.max_batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        batch.append(self._queue.get(timeout=remaining))
+                    except queue.Empty:
+                        break
+                groups = {}
+                for item in batch:
+                    groups.setdefault(item[0].shape[-1], []).append(item)
+                for group in groups.values():
+                    try:
+                        self._decode(group)
+                    except Exception as e:
+                        logger.exception("Batched vocoder decode failed")
+                        for _, _, future in group:
+                            if not future.done():
+                                future.set_exception(e)
+
+    def _decode(self, batch):
+        decoder_input = torch.cat([z for z, _, _ in batch])
+        speaker_embeddings = torch.cat([embedding for _, embedding, _ in batch])
+
+        wavs = self.decoder(decoder_input, g=speaker_embeddings)
+        self.calls += 1
+        self.chunks += len(batch)
+
+        for row, (_, _, future) in enumerate(batch):
+            future.set_result(wavs[row].reshape(-1))